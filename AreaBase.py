@@ -0,0 +1,88 @@
+import enum
+import time
+import aiofiles
+
+
+class AreaType(enum.Enum):
+    """地区类型与划分的int64二进制区段的枚举"""
+    Province = 1 << 48
+    City = 1 << 36
+    Country = 1 << 24
+    Town = 1 << 12
+    Village = 1
+
+
+def level(type: AreaType) -> int:
+    if(type == AreaType.Village):
+        return 5
+    elif(type == AreaType.Town):
+        return 4
+    elif(type == AreaType.Country):
+        return 3
+    elif(type == AreaType.City):
+        return 2
+    else:
+        return 1
+
+
+async def read_file(file_name: str) -> str:
+    async with aiofiles.open(file_name) as file:
+        return await file.read()
+
+
+def time_use(start_time: float) -> float:
+    return round(time.time()-start_time, 2)
+
+
+def out(mode: str, desc: any) -> None:
+    print(f"{time.strftime('[%H:%M:%S]', time.localtime())} [{mode}] {desc}")
+
+
+def trim_right(str: str) -> str:
+    """移除该字符串从右往左数第一个'/'右边的字符"""
+    return str[: str.rfind('/')+1]
+
+
+# level与type的映射 下标为level-1
+LEVEL_TYPES: list[AreaType] = [AreaType.Province, AreaType.City, AreaType.Country,
+                               AreaType.Town, AreaType.Village]
+# 每一级的type值 查询时不经过enum 下标为level-1
+LEVEL_VALUES: list[int] = [t.value for t in LEVEL_TYPES]
+# id的每一级占12位 同级序号从1开始 最多4095个
+LEVEL_MASK: int = 0xFFF
+
+
+def level_of(id: int) -> int:
+    """由id计算level id最低的非零12位区段即为所在的级别 即最低位的1所在的区段"""
+    lv = 5 - ((id & -id).bit_length() - 1) // 12 if id > 0 else 0
+    if(lv < 1):
+        raise ValueError(f'无效的id {id}')
+    return lv
+
+
+def parent_of(id: int) -> int:
+    """由id计算父级id 省级返回None"""
+    lv = level_of(id)
+    if(lv == 1):
+        return None
+    return id - id % LEVEL_VALUES[lv - 2]
+
+
+def ancestors_of(id: int) -> list[int]:
+    """由id计算所有祖先id 从省级开始 与parents_id一致
+    跳过为0的区段 地级市直辖的乡级单位(东莞 中山 儋州 嘉峪关)没有县级"""
+    return [id - id % LEVEL_VALUES[i] for i in range(level_of(id) - 1) if(id // LEVEL_VALUES[i] & LEVEL_MASK)]
+
+
+def subtree_range(id: int) -> tuple[int, int]:
+    """id的所有后代都在开区间(id, id + 本级的type值)内"""
+    return (id, id + LEVEL_VALUES[level_of(id) - 1])
+
+
+def level_range(id: int, level: int) -> tuple[int, int]:
+    """id下第level级后代的id所在的半开区间[下界, 上界) id为None时为全国
+    区间内仍可能有更深级别的数据 需要再按level过滤"""
+    if(id == None):
+        return (LEVEL_VALUES[level - 1], (LEVEL_MASK + 1) * LEVEL_VALUES[0])
+    lo, hi = subtree_range(id)
+    return (lo + LEVEL_VALUES[level - 1], hi)
@@ -0,0 +1,418 @@
+import argparse
+import asyncio
+import collections
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+import zlib
+from urllib.parse import urlparse
+from aiohttp import web
+from AreaBase import AreaType, level, out, read_file
+from AreaCache import PageCache
+from AreaParser import Row, extract
+from AreaRows import RowBlock
+from AreaStorage import Storage, create_storage
+import AreaInfo
+
+
+# 统计局站点上区划代码页面的路径
+PATH_BASE: str = '/tjsj/tjbz/tjyqhdmhcxhfdm/'
+# 页面 => (状态码, 页面字节)
+Pages = dict[str, tuple[int, bytes]]
+# 模拟村级页面轮流使用的城乡分类代码
+TYPE_CODES: tuple[int, ...] = (111, 112, 121, 122, 123, 210, 220)
+
+
+def page(body: str) -> bytes:
+    return (f'<html><head><meta http-equiv="Content-Type" content="text/html; charset=gb2312">'
+            f'</head><body>{body}</body></html>').encode('gb18030')
+
+
+def index_page(dates: dict[int, str]) -> bytes:
+    """首页 列出各年份及其发布日期"""
+    return page('<ul class="center_list_contlist">' + ''.join(
+        f'<li><a href="{year}/index.html"><span class="cont_tit"><font class="cont_tit03">{year}年</font>'
+        f'<font class="cont_tit02">{date}</font></span></a></li>' for year, date in dates.items()) + '</ul>')
+
+
+def synthetic(year: int, date: str, provinces: int = 2, cities: int = 8, counties: int = 8,
+              towns: int = 10, villages: int = 20) -> tuple[Pages, int]:
+    """生成与统计局格式一致的页面 返回 (页面, 应得的行数)
+    包含原站点的几种特殊情况: 没有链接的市辖区 链接404的县(金门县) 只有表头没有数据的乡级页面(大胡同街道)
+    不设县级 直接管辖乡级单位的地级市(东莞)"""
+    pages: Pages = {}
+    rows = 0
+    pages[f'{PATH_BASE}index.html'] = (200, index_page({year: date}))
+    base = f'{PATH_BASE}{year}/'
+    links = ''.join(f'<td><a href="{11 + p}.html">省{p}<br/></a></td>' for p in range(provinces))
+    pages[f'{base}index.html'] = (200, page(f'<table class="provincetable"><tr class="provincetr">{links}</tr></table>'))
+    rows += provinces
+    for p in range(provinces):
+        pc = f'{11 + p}'
+        city_rows = ''
+        for c in range(cities):
+            cc = f'{pc}{c + 1:02d}'
+            city_rows += (f'<tr class="citytr"><td><a href="{pc}/{cc}.html">{cc}00000000</a></td>'
+                          f'<td><a href="{pc}/{cc}.html">市{c}</a></td></tr>')
+            county_rows = f'<tr class="countytr"><td>{cc}01000000</td><td>市辖区</td></tr>'
+            rows += 2
+            for k in range(counties):
+                kc = f'{cc}{k + 2:02d}'
+                county_rows += (f'<tr class="countytr"><td><a href="{cc[2:]}/{kc}.html">{kc}000000</a></td>'
+                                f'<td><a href="{cc[2:]}/{kc}.html">县{k}</a></td></tr>')
+                rows += 1
+                if(p == 0 and c == 0 and k == counties - 1):
+                    # 链接存在但页面404
+                    continue
+                town_rows = ''
+                for t in range(towns):
+                    tc = f'{kc}{t + 1:03d}'
+                    town_rows += (f'<tr class="towntr"><td><a href="{kc[4:]}/{tc}.html">{tc}000</a></td>'
+                                  f'<td><a href="{kc[4:]}/{tc}.html">镇{t}</a></td></tr>')
+                    rows += 1
+                    if(p == 0 and c == 0 and k == 0 and t == towns - 1):
+                        # 页面正常但只有表头
+                        village_rows = ''
+                    else:
+                        village_rows = ''.join(f'<tr class="villagetr"><td>{tc}{v + 1:03d}</td>'
+                                               f'<td>{TYPE_CODES[v % len(TYPE_CODES)]}</td><td>村{v}</td></tr>'
+                                               for v in range(villages))
+                        rows += villages
+                    pages[f'{base}{pc}/{cc[2:]}/{kc[4:]}/{tc}.html'] = (200, page(
+                        f'<table class="villagetable"><tr class="villagehead"><td>统计用区划代码</td>'
+                        f'<td>城乡分类代码</td><td>名称</td></tr>{village_rows}</table>'))
+                pages[f'{base}{pc}/{cc[2:]}/{kc}.html'] = (200, page(f'<table class="towntable">{town_rows}</table>'))
+            pages[f'{base}{pc}/{cc}.html'] = (200, page(f'<table class="countytable">{county_rows}</table>'))
+        if(p == 0):
+            # 不设县级的地级市(东莞) 市页面直接列出乡级单位 乡级代码的县级段为00
+            cc = f'{pc}{cities + 1:02d}'
+            city_rows += (f'<tr class="citytr"><td><a href="{pc}/{cc}.html">{cc}00000000</a></td>'
+                          f'<td><a href="{pc}/{cc}.html">市{cities}</a></td></tr>')
+            town_rows = ''
+            rows += 1
+            for t in range(towns):
+                tc = f'{cc}00{t + 1:03d}'
+                town_rows += (f'<tr class="towntr"><td><a href="{cc[2:]}/{tc}.html">{tc}000</a></td>'
+                              f'<td><a href="{cc[2:]}/{tc}.html">镇{t}</a></td></tr>')
+                village_rows = ''.join(f'<tr class="villagetr"><td>{tc}{v + 1:03d}</td>'
+                                       f'<td>{TYPE_CODES[v % len(TYPE_CODES)]}</td><td>村{v}</td></tr>'
+                                       for v in range(villages))
+                rows += 1 + villages
+                pages[f'{base}{pc}/{cc[2:]}/{tc}.html'] = (200, page(
+                    f'<table class="villagetable"><tr class="villagehead"><td>统计用区划代码</td>'
+                    f'<td>城乡分类代码</td><td>名称</td></tr>{village_rows}</table>'))
+            pages[f'{base}{pc}/{cc}.html'] = (200, page(f'<table class="towntable">{town_rows}</table>'))
+        pages[f'{base}{pc}.html'] = (200, page(f'<table class="citytable">{city_rows}</table>'))
+    return pages, rows
+
+
+def recorded(path: str) -> Pages:
+    """读取PageCache中保存的页面 按url的路径回放"""
+    cache = PageCache(path, 'only')
+    pages: Pages = {}
+    try:
+        for url, in cache.db.execute('select url from page').fetchall():
+            entry = cache.get(url)
+            if(entry):
+                pages[urlparse(url).path] = (entry.status, entry.body)
+    finally:
+        cache.close()
+    return pages
+
+
+class ReplaySite:
+    """本地回放站点 按路径返回页面 fail和timeout为注入502和超时的比例
+    每个路径是否出错由 (seed, 路径) 的crc32决定 只在第一次请求时出错 重试可以成功 每次运行结果相同
+    capacity不为0时模拟限流 同时处理的请求超过capacity个时返回503"""
+
+    def __init__(self, pages: Pages, fail: float = 0, timeout: float = 0, delay: float = 1.5, seed: int = 1,
+                 latency: float = 0, capacity: int = 0) -> None:
+        self.pages = pages
+        self.fail = fail
+        self.timeout = timeout
+        # 每个请求固定增加的秒数 模拟网络往返
+        self.latency = latency
+        self.capacity = capacity
+        # 正在处理的请求数
+        self.active = 0
+        # 客户端地址 每个TCP连接一个
+        self.peers: set = set()
+        # 超时的页面等待的秒数 需要大于爬虫的请求超时
+        self.delay = delay
+        self.seed = seed
+        self.attempts: collections.Counter = collections.Counter()
+        self.served: collections.Counter = collections.Counter()
+
+    def fault(self, path: str) -> str:
+        if(self.attempts[path] > 1):
+            return None
+        r = zlib.crc32(f'{self.seed}{path}'.encode()) / 0xFFFFFFFF
+        if(r < self.fail):
+            return '502'
+        if(r < self.fail + self.timeout):
+            return 'timeout'
+        return None
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.peers.add(request.transport.get_extra_info('peername'))
+        self.active += 1
+        try:
+            if(self.capacity and self.active > self.capacity):
+                self.served['503'] += 1
+                return web.Response(status=503, text='Service Unavailable')
+            return await self.replay(request)
+        finally:
+            self.active -= 1
+
+    async def replay(self, request: web.Request) -> web.Response:
+        self.attempts[request.path] += 1
+        if(self.latency):
+            await asyncio.sleep(self.latency)
+        fault = self.fault(request.path)
+        if(fault == '502'):
+            self.served['502'] += 1
+            return web.Response(status=502, text='Bad Gateway')
+        if(fault == 'timeout'):
+            # 爬虫早已超时断开 这次响应不计入
+            self.served['timeout'] += 1
+            await asyncio.sleep(self.delay)
+            return web.Response(status=504, text='Gateway Timeout')
+        status, body = self.pages.get(request.path, (404, None))
+        self.served[str(status)] += 1
+        if(status != 200):
+            return web.Response(status=status, text='Not Found')
+        return web.Response(body=body, content_type='text/html')
+
+    async def start(self, port: int = 0) -> tuple[web.AppRunner, str]:
+        """port为0时随机端口 返回 (runner, 首页地址)"""
+        app = web.Application()
+        app.router.add_get('/{tail:.*}', self.handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', port)
+        await site.start()
+        port = runner.addresses[0][1]
+        return runner, f'http://127.0.0.1:{port}{PATH_BASE}index.html'
+
+
+class NullStorage(Storage):
+    """丢弃所有数据 只测爬取和解析"""
+
+    name = 'null'
+
+    async def open(self) -> None:
+        pass
+
+    async def save(self, rows: list[tuple]) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+
+def timed_save(storage: Storage, stats: dict) -> None:
+    """记录写库的总行数和总耗时"""
+    save = storage.save
+
+    async def wrapper(rows: list[tuple]) -> None:
+        start_time = time.perf_counter()
+        await save(rows)
+        stats['insert_rows'] += len(rows)
+        stats['insert_seconds'] += time.perf_counter() - start_time
+    storage.save = wrapper
+
+
+def parse_cost(pages: Pages, backend: str) -> tuple[int, float]:
+    """离线解析所有区划页面 返回 (页面数, 每页毫秒)"""
+    count, cost = 0, 0.0
+    for path, (status, body) in pages.items():
+        if(status != 200 or path.endswith(f'{PATH_BASE}index.html')):
+            continue
+        start_time = time.perf_counter()
+        try:
+            extract(body, backend)
+        except ValueError:
+            continue
+        cost += time.perf_counter() - start_time
+        count += 1
+    return count, cost / max(count, 1) * 1000
+
+
+def walk(pages: Pages, info: tuple[str, int, list[int], str]) -> list[tuple[tuple, bytes]]:
+    """离线遍历info页面及其所有下级页面 返回 [(页面信息, 页面字节)]"""
+    ctx = AreaInfo.CrawlContext(0, '')
+    result = []
+    todo = [info]
+    while(todo):
+        info = todo.pop()
+        status, body = pages.get(urlparse(info[0]).path, (404, None))
+        page_rows = extract(body, 'fast') if status == 200 else None
+        if(page_rows == None):
+            continue
+        result.append((info, body))
+        todo += AreaInfo.build_data(ctx, page_rows[1], page_rows[0], info[0], info[1], [*info[2], info[1]], info[3])[1]
+    return result
+
+
+def tuple_rows(info: tuple, type: AreaType, data: list[Row], year: int, date: str) -> list[tuple]:
+    """原先build_data构建的行元组 每行9个字段 同一页面共用parents_id列表 full_name逐行拼接"""
+    parents = [*info[2], info[1]]
+    if(type == AreaType.Village):
+        return [(type.value * (i + 1) + info[1], e[0], e[2], f'{info[3]}/{e[2]}', int(e[1]), level(type), year, parents, date)
+                for i, (e, _) in enumerate(data)]
+    return [(type.value * (i + 1) + info[1], e[0], e[1], f'{info[3]}/{e[1]}', None, level(type), year, parents, date)
+            for i, (e, _) in enumerate(data)]
+
+
+def block_rows(info: tuple, type: AreaType, data: list[Row], year: int, date: str) -> RowBlock:
+    """现在的build_data 返回该页面的RowBlock"""
+    ctx = AreaInfo.CrawlContext(year, date)
+    return AreaInfo.build_data(ctx, data, type, info[0], info[1], [*info[2], info[1]], info[3])[0]
+
+
+def memory(pages: Pages, year: int, date: str = '2021-10-31') -> dict:
+    """离线重放行数最多的市 用tracemalloc对比从解析页面开始 整个市的数据以行元组和以RowBlock保存时占用的内存
+    解析结果中只有被行引用的部分留在内存里 与爬虫中数据在写库队列里等待时一致"""
+    index = f'http://replay{PATH_BASE}{year}/index.html'
+    ctx = AreaInfo.CrawlContext(year, date)
+    cities = []
+    for p in AreaInfo.build_data(ctx, extract(pages[urlparse(index).path][1], 'fast')[1], AreaType.Province, index)[1]:
+        cities += [info for info, _ in walk(pages, p) if info[1] != p[1] and len(info[2]) == 1]
+    city = max((walk(pages, c) for c in cities), key=len)
+    report = {'city': city[0][0][3], 'pages': len(city)}
+    for name, build in (('tuple', tuple_rows), ('block', block_rows)):
+        tracemalloc.start()
+        kept = []
+        for info, body in city:
+            type, data = extract(body, 'fast')
+            kept.append(build(info, type, data, year, date))
+            del data
+        report[f'{name}_bytes'] = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        report['rows'] = sum(len(k) for k in kept)
+        if(name == 'tuple'):
+            expected = [r for rows in kept for r in rows]
+        else:
+            # 写库时展开的行与原先的行元组一致
+            assert [r for block in kept for r in block] == expected
+        del kept
+    report['bytes_per_row'] = {k: round(report[f'{k}_bytes'] / report['rows'], 1) for k in ('tuple', 'block')}
+    return report
+
+
+async def bench(args: argparse.Namespace) -> dict:
+    config = json.loads(await read_file('config.json'))
+    years = list(range(args.year, args.year + args.years))
+    if(args.cache):
+        pages, expected = recorded(args.cache), None
+    else:
+        # 每年的页面相同 只有年份和发布日期不同
+        pages, expected = {}, 0
+        for year in years:
+            year_pages, rows = synthetic(year, f'{year}-10-31', args.provinces, args.cities,
+                                         args.counties, args.towns, args.villages)
+            pages.update(year_pages)
+            expected += rows
+        pages[f'{PATH_BASE}index.html'] = (200, index_page({year: f'{year}-10-31' for year in years}))
+    site = ReplaySite(pages, args.fail, args.timeout, seed=args.seed, latency=args.latency / 1000,
+                      capacity=args.capacity)
+    runner, url = await site.start()
+    work = tempfile.mkdtemp(prefix='areabench')
+    try:
+        # 不读写缓存 每次都从回放站点下载 断点日志用新文件
+        config['Year'] = years
+        config['YearConcurrency'] = args.year_concurrency or config['YearConcurrency']
+        config['Cache'] = {'Path': os.path.join(work, 'cache'), 'Mode': 'bypass'}
+        config['Checkpoint'] = os.path.join(work, 'checkpoint.jsonl')
+        config['Incremental']['Enable'] = False
+        config['Storage']['Type'] = args.storage
+        config['Storage']['Sqlite'] = os.path.join(work, 'bench.sqlite3')
+        config['Storage']['Parquet'] = os.path.join(work, 'parquet')
+        if(args.concurrency):
+            config['Concurrency'] = args.concurrency
+        if(args.adaptive != None):
+            config['Adaptive']['Enable'] = args.adaptive == 'on'
+        if(args.keep_alive != None):
+            config['KeepAlive'] = args.keep_alive
+        storage = NullStorage() if args.storage == 'null' else create_storage(config)
+        stats = {'insert_rows': 0, 'insert_seconds': 0.0}
+        timed_save(storage, stats)
+        AreaInfo.URL_BASE = url
+        try:
+            await AreaInfo.init(storage, config)
+            start_time = time.perf_counter()
+            # make_data等所有数据写入后才返回 写库时间包含在内
+            await AreaInfo.start()
+            elapsed = time.perf_counter() - start_time
+            await AreaInfo.close()
+        finally:
+            await runner.cleanup()
+        fetched = site.served['200'] + site.served['404']
+        parsed, parse_ms = parse_cost(pages, config['Parser'])
+        report = {'pages': fetched, 'seconds': round(elapsed, 3), 'pages_per_second': round(fetched / elapsed, 1),
+                  'rows': stats['insert_rows'], 'rows_per_second': round(stats['insert_rows'] / elapsed, 1),
+                  'parse_ms_per_page': round(parse_ms, 4), 'parser': config['Parser'],
+                  'insert_rows_per_second': round(stats['insert_rows'] / max(stats['insert_seconds'], 1e-9), 1),
+                  'storage': storage.name, 'years': len(years), 'year_concurrency': config['YearConcurrency'], 'injected_502': site.served['502'], 'injected_timeout': site.served['timeout'],
+                  'throttled_503': site.served['503'], 'connections': len(site.peers),
+                  'adaptive': config['Adaptive']['Enable'], 'keep_alive': config['KeepAlive'],
+                  'expected_rows': expected}
+        if(args.storage == 'sqlite'):
+            # 断点续爬和重试都不应产生重复行
+            conn = sqlite3.connect(config['Storage']['Sqlite'])
+            report['stored_rows'] = sum(conn.execute(f'select count(*) from area_info_{year}').fetchone()[0]
+                                        for year in years)
+            conn.close()
+        return report
+    finally:
+        # 缓存 断点日志和数据库文件只在本次测试中使用
+        shutil.rmtree(work, ignore_errors=True)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='离线回放性能测试 不访问统计局网站')
+    parser.add_argument('--cache', help='回放PageCache目录中录制的页面 不给时生成模拟页面')
+    parser.add_argument('--year', type=int, default=2021)
+    parser.add_argument('--years', type=int, default=1, help='从--year开始连续爬取的年数')
+    parser.add_argument('--year-concurrency', type=int, help='覆盖config.json的YearConcurrency')
+    parser.add_argument('--latency', type=float, default=0, help='回放站点每个请求增加的毫秒数')
+    parser.add_argument('--capacity', type=int, default=0, help='回放站点同时处理的请求超过该数时返回503')
+    parser.add_argument('--adaptive', choices=['on', 'off'], help='覆盖config.json的Adaptive.Enable')
+    parser.add_argument('--keep-alive', type=int, help='覆盖config.json的KeepAlive 0为每个请求新建连接')
+    parser.add_argument('--provinces', type=int, default=2)
+    parser.add_argument('--cities', type=int, default=8)
+    parser.add_argument('--counties', type=int, default=8)
+    parser.add_argument('--towns', type=int, default=10)
+    parser.add_argument('--villages', type=int, default=20)
+    parser.add_argument('--fail', type=float, default=0.01, help='注入502的页面比例')
+    parser.add_argument('--timeout', type=float, default=0.002, help='注入超时的页面比例')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--concurrency', type=int, help='覆盖config.json的Concurrency')
+    parser.add_argument('--storage', default='null', choices=['null', 'sqlite', 'parquet', 'postgres', 'temporal'])
+    parser.add_argument('--json', help='结果另存为json文件')
+    parser.add_argument('--memory', action='store_true', help='不爬取 只对比一个市的数据以行元组和RowBlock保存时的内存')
+    args = parser.parse_args()
+    if(args.memory):
+        pages = recorded(args.cache) if args.cache else synthetic(args.year, '2021-10-31', args.provinces, args.cities,
+                                                                   args.counties, args.towns, args.villages)[0]
+        out('bench', json.dumps(memory(pages, args.year), ensure_ascii=False))
+        return 0
+    report = asyncio.run(bench(args))
+    out('bench', json.dumps(report, ensure_ascii=False))
+    if(args.json):
+        with open(args.json, 'w') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if(report['expected_rows'] != None and report['rows'] != report['expected_rows']):
+        out('bench', f"行数不一致 写入{report['rows']} 应为{report['expected_rows']}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    # python AreaBench.py [--storage sqlite] [--fail 0.01] [--timeout 0.002] [--json result.json]
+    sys.exit(main())
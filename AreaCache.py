@@ -0,0 +1,99 @@
+import hashlib
+import os
+import sqlite3
+import time
+import zlib
+from typing import NamedTuple
+
+
+class CacheEntry(NamedTuple):
+    status: int
+    body: bytes
+    fetch_time: float
+    # 404或页面正常但没有数据 下次直接跳过
+    negative: bool
+
+
+class PageCache:
+    """本地页面缓存 以url为键 保存原始的gb18030字节 状态码和下载时间
+    页面内容按sha1存放在objects目录下并用zlib压缩 相同内容只存一份
+    url到内容的索引放在index.sqlite3中
+
+    Mode:
+    read    读穿透 命中直接返回 未命中时下载并写入缓存 (默认)
+    only    只读缓存 未命中时报错 不发出任何网络请求
+    refresh 总是重新下载 并覆盖缓存
+    bypass  不读也不写缓存"""
+
+    MODES = ('read', 'only', 'refresh', 'bypass')
+
+    def __init__(self, path: str, mode: str = 'read') -> None:
+        if(mode not in self.MODES):
+            raise ValueError(f'未知的缓存模式 {mode}')
+        self.path = path
+        self.mode = mode
+        os.makedirs(os.path.join(path, 'objects'), exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(path, 'index.sqlite3'),
+                                  isolation_level=None)
+        self.db.execute('pragma journal_mode=wal')
+        self.db.execute('pragma synchronous=normal')
+        self.db.execute("""create table if not exists page(
+                            url text not null primary key,
+                            status int not null,
+                            digest text null,
+                            fetch_time real not null,
+                            negative int not null default 0)""")
+
+    @property
+    def readable(self) -> bool:
+        return self.mode in ('read', 'only')
+
+    @property
+    def writable(self) -> bool:
+        return self.mode in ('read', 'refresh')
+
+    def get(self, url: str) -> CacheEntry:
+        """未命中时返回None"""
+        row = self.db.execute('select status, digest, fetch_time, negative from page where url = ?',
+                              (url,)).fetchone()
+        if(row == None):
+            return None
+        status, digest, fetch_time, negative = row
+        body = None
+        if(digest):
+            try:
+                with open(self.object_path(digest), 'rb') as f:
+                    body = zlib.decompress(f.read())
+            except FileNotFoundError:
+                # 内容文件被删除 视为未命中
+                return None
+        return CacheEntry(status, body, fetch_time, bool(negative))
+
+    def put(self, url: str, status: int, body: bytes) -> None:
+        """写入一次下载结果 404直接记为负缓存"""
+        digest = None
+        if(body != None):
+            digest = hashlib.sha1(body).hexdigest()
+            file = self.object_path(digest)
+            if(not os.path.exists(file)):
+                os.makedirs(os.path.dirname(file), exist_ok=True)
+                temp = f'{file}.{os.getpid()}.tmp'
+                with open(temp, 'wb') as f:
+                    f.write(zlib.compress(body))
+                os.replace(temp, file)
+        self.db.execute('insert or replace into page values (?, ?, ?, ?, ?)',
+                        (url, status, digest, time.time(), int(status == 404)))
+
+    def evict(self, url: str) -> None:
+        """删除一个url的缓存 如状态码为200但不是区划页面的限流页 内容文件可能被其他url共用 不删除"""
+        self.db.execute('delete from page where url = ?', (url,))
+
+    def mark_negative(self, url: str) -> None:
+        """页面可以访问但没有下级数据 如天津大胡同街道"""
+        self.db.execute('update page set negative = 1 where url = ?', (url,))
+
+    def object_path(self, digest: str) -> str:
+        return os.path.join(self.path, 'objects', digest[:2], digest[2:])
+
+    def close(self) -> None:
+        self.db.close()
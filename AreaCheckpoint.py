@@ -0,0 +1,37 @@
+import json
+import os
+
+
+class Checkpoint:
+    """断点续爬日志 每完成并保存一个市或省就追加一行json
+    {"year": 2021, "kind": "city", "id": 281543696187392}
+    重启后跳过已完成的子树 删除日志文件即可重新完整爬取"""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.finished: set[tuple[int, str, int]] = set()
+        if(os.path.exists(path)):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    if(line.strip()):
+                        record = json.loads(line)
+                        self.finished.add((record['year'], record['kind'], record['id']))
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def done(self, year: int, kind: str, id: int) -> bool:
+        return (year, kind, id) in self.finished
+
+    def mark(self, year: int, kind: str, id: int) -> None:
+        """写入后立即落盘 进程被杀掉也不会丢失已完成的记录"""
+        if(self.done(year, kind, id)):
+            return
+        self.finished.add((year, kind, id))
+        self.file.write(json.dumps({'year': year, 'kind': kind, 'id': id}) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def count(self, year: int, kind: str) -> int:
+        return sum(1 for f in self.finished if f[0] == year and f[1] == kind)
+
+    def close(self) -> None:
+        self.file.close()
@@ -0,0 +1,109 @@
+import asyncio
+import collections
+from aiohttp import ClientTimeout
+from AreaMetrics import HTTP_BACKOFFS
+
+
+class AdaptiveLimit:
+    """AIMD自适应并发限制 取代固定大小的Semaphore 用法相同: async with limit as epoch
+    每个成功的请求使窗口增加 1/窗口 大约每个往返时间加1
+    出现429/5xx/超时 或平滑后的延迟超过最低延迟的latency倍时 窗口乘以decrease
+    窗口减小后 减小之前发出的请求再失败不会重复减小 同一轮拥塞只减一次
+    请求超时按 平滑延迟 + 4倍延迟偏差 计算(与TCP的RTO相同) 限制在[min_timeout, max_timeout]内"""
+
+    def __init__(self,
+                 initial: int = 8,
+                 min_window: int = 2,
+                 max_window: int = 50,
+                 latency: float = 3,
+                 decrease: float = 0.5,
+                 min_timeout: float = 1,
+                 max_timeout: float = 10,
+                 slack: float = 0.05) -> None:
+        self.window = float(initial)
+        self.min_window = min_window
+        self.max_window = max_window
+        self.latency = latency
+        self.decrease = decrease
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        # 延迟比最低延迟多不到slack秒时不算拥塞 低延迟网络下抖动相对最低延迟很大
+        self.slack = slack
+        # 正在进行的请求数
+        self.inflight = 0
+        self.waiters: collections.deque[asyncio.Future] = collections.deque()
+        # 每减小一次窗口加1
+        self.epoch = 0
+        # 平滑延迟 延迟偏差 最低延迟 单位秒
+        self.srtt: float = None
+        self.rttvar: float = None
+        self.base: float = None
+        # 判断拥塞用的平滑延迟 窗口减小后从最低延迟重新开始 需要连续几个慢请求才会再次减小
+        self.signal: float = None
+
+    @classmethod
+    def from_config(cls, max_window: int, config: dict) -> 'AdaptiveLimit':
+        """从config.json的Adaptive节点创建 最大窗口为Concurrency"""
+        return cls(config['Initial'], config['Min'], max_window, config['Latency'],
+                   config['Decrease'], config['MinTimeout'], config['MaxTimeout'])
+
+    async def __aenter__(self) -> int:
+        while(self.inflight >= int(self.window)):
+            waiter = asyncio.get_running_loop().create_future()
+            self.waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if(waiter in self.waiters):
+                    self.waiters.remove(waiter)
+                else:
+                    # 已被唤醒又被取消 把名额让给下一个
+                    self.wake()
+                raise
+        self.inflight += 1
+        return self.epoch
+
+    async def __aexit__(self, *args) -> None:
+        self.inflight -= 1
+        self.wake()
+
+    def wake(self) -> None:
+        free = int(self.window) - self.inflight
+        while(free > 0 and self.waiters):
+            waiter = self.waiters.popleft()
+            if(not waiter.done()):
+                waiter.set_result(None)
+                free -= 1
+
+    def timeout(self) -> ClientTimeout:
+        if(self.srtt == None):
+            return ClientTimeout(total=self.max_timeout)
+        return ClientTimeout(total=min(self.max_timeout, max(self.min_timeout, self.srtt + 4 * self.rttvar)))
+
+    def feedback(self, epoch: int, seconds: float, congested: str = None) -> None:
+        """每次请求结束后调用 epoch为进入时的返回值 congested为拥塞的原因(状态码或异常名) 正常时为None"""
+        if(congested):
+            self.backoff(epoch, congested)
+            return
+        if(self.srtt == None):
+            self.srtt, self.rttvar, self.base, self.signal = seconds, seconds / 2, seconds, seconds
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - seconds)
+            self.srtt = 0.875 * self.srtt + 0.125 * seconds
+            self.signal = 0.875 * self.signal + 0.125 * seconds
+            # 最低延迟缓慢上浮 服务端整体变慢后不会一直判定为拥塞
+            self.base = min(seconds, self.base * 1.001)
+        if(self.signal > max(self.base * self.latency, self.base + self.slack)):
+            self.backoff(epoch, 'latency')
+        else:
+            self.window = min(self.max_window, self.window + 1 / self.window)
+            self.wake()
+
+    def backoff(self, epoch: int, reason: str) -> None:
+        if(epoch != self.epoch):
+            return
+        self.epoch += 1
+        self.window = max(self.min_window, self.window * self.decrease)
+        if(self.base != None):
+            self.signal = self.base
+        HTTP_BACKOFFS.inc(reason)
@@ -0,0 +1,243 @@
+import asyncio
+import csv
+import datetime
+import json
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator
+import asyncpg
+from AreaBase import out, read_file
+from AreaStorage import AREA_COLUMNS, Storage
+
+# pyarrow只有导出Parquet时需要 不是爬虫的必需依赖
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+
+# 分区目录为 year=2021/level=3 year和level由目录名给出 不再存为列
+# name重复很多(如 居委会 村委会 各地同名乡镇) 使用字典编码
+def schema() -> 'pa.Schema':
+    return pa.schema([('id', pa.int64()),
+                      ('number', pa.string()),
+                      ('name', pa.dictionary(pa.int32(), pa.string())),
+                      ('full_name', pa.string()),
+                      ('type', pa.int16()),
+                      ('parents_id', pa.list_(pa.int64())),
+                      ('release_date', pa.date32())])
+
+
+class ParquetSink:
+    """按 (year, level) 分区写Parquet 每个分区一个ParquetWriter
+    每个分区最多缓存batch_rows行 攒满就写成一个row group 内存占用与总行数无关
+    写入过程中的文件以.开头(读取数据集时忽略) 一年写完后才改名为part-{run}.parquet并删除该分区以前的文件
+    中途出错时以前导出的数据不受影响 也不会留下没有footer无法读取的文件"""
+
+    def __init__(self, path: str, batch_rows: int = 65536, compression: str = 'zstd') -> None:
+        if(pa == None):
+            raise ImportError('导出Parquet需要安装pyarrow')
+        self.path = path
+        self.batch_rows = batch_rows
+        self.compression = compression
+        self.schema = schema()
+        self.buffers: dict[tuple[int, int], list[tuple]] = {}
+        self.writers: dict[tuple[int, int], pq.ParquetWriter] = {}
+        self.rows = 0
+        # 每次运行的文件名不同 不会覆盖其他运行的文件
+        self.run = f'{time.strftime("%Y%m%d%H%M%S")}-{os.getpid()}'
+
+    def write(self, rows: list[tuple]) -> None:
+        """rows与Storage.save相同 为 (id, number, name, full_name, type, level, year, parents_id, release_date)"""
+        for r in rows:
+            key = (r[6], r[5])
+            buffer = self.buffers.get(key)
+            if(buffer == None):
+                buffer = self.buffers[key] = []
+            buffer.append(r)
+            if(len(buffer) >= self.batch_rows):
+                self.flush(key)
+
+    def flush(self, key: tuple[int, int]) -> None:
+        buffer = self.buffers.pop(key, None)
+        if(not buffer):
+            return
+        writer = self.writers.get(key)
+        if(writer == None):
+            folder = os.path.join(self.path, f'year={key[0]}', f'level={key[1]}')
+            os.makedirs(folder, exist_ok=True)
+            writer = self.writers[key] = pq.ParquetWriter(self.file(key, True), self.schema,
+                                                          compression=self.compression, use_dictionary=['name'])
+        dates: dict[str, datetime.date] = {}
+        columns = [[r[0] for r in buffer],
+                   [r[1] for r in buffer],
+                   [r[2] for r in buffer],
+                   [r[3] for r in buffer],
+                   [r[4] for r in buffer],
+                   [r[7] for r in buffer],
+                   [date(r[8], dates) for r in buffer]]
+        writer.write_batch(pa.record_batch(columns, schema=self.schema))
+        self.rows += len(buffer)
+
+    def file(self, key: tuple[int, int], temp: bool = False) -> str:
+        folder = os.path.join(self.path, f'year={key[0]}', f'level={key[1]}')
+        return os.path.join(folder, f'.part-{self.run}.parquet.tmp' if temp else f'part-{self.run}.parquet')
+
+    def publish(self, key: tuple[int, int]) -> None:
+        """关闭文件后改名 改名是原子的 再删除该分区以前运行的文件"""
+        self.writers.pop(key).close()
+        target = self.file(key)
+        os.replace(self.file(key, True), target)
+        folder = os.path.dirname(target)
+        for name in os.listdir(folder):
+            if(name.startswith('part-') and name.endswith('.parquet') and name != os.path.basename(target)):
+                os.remove(os.path.join(folder, name))
+
+    def finish_year(self, year: int) -> None:
+        """写出该年剩余的数据 关闭并发布文件"""
+        for key in [k for k in self.buffers if k[0] == year]:
+            self.flush(key)
+        for key in [k for k in self.writers if k[0] == year]:
+            self.publish(key)
+
+    def close(self, publish: bool = True) -> None:
+        """publish为False时丢弃没有完成的年份 已发布的文件不变"""
+        if(publish):
+            for key in list(self.buffers):
+                self.flush(key)
+        self.buffers.clear()
+        for key in list(self.writers):
+            if(publish):
+                self.publish(key)
+            else:
+                self.writers.pop(key).close()
+                os.remove(self.file(key, True))
+
+
+def date(value: str | datetime.date, dates: dict) -> datetime.date:
+    """发布日期 爬虫给出的是字符串 数据库读出的是date 相同的字符串只转换一次"""
+    if(isinstance(value, datetime.date)):
+        return value
+    result = dates.get(value)
+    if(result == None):
+        result = dates[value] = datetime.date.fromisoformat(value)
+    return result
+
+
+class ParquetStorage(Storage):
+    """爬虫直接写Parquet 不经过数据库 config.json的Storage.Type为parquet 目录为Storage.Parquet
+    一年的文件在finish_year时才发布 中途退出时该年没有写完的数据全部丢弃
+    因此不能断点续爬 断点日志中有要爬取年份的记录时拒绝启动"""
+
+    name = 'parquet'
+    resumable = False
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.sink: ParquetSink = None
+        # pyarrow写文件时释放GIL 放在专用线程中不阻塞事件循环
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix='parquet')
+
+    async def run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def open(self) -> None:
+        self.sink = ParquetSink(self.path)
+        out('ParquetStorage', f'写入目录 > {self.path}')
+
+    async def save(self, rows: list[tuple]) -> None:
+        await self.run(self.sink.write, rows)
+
+    async def finish_year(self, year: int) -> None:
+        await self.run(self.sink.finish_year, year)
+
+    async def close(self) -> None:
+        # 正常结束时每年都已finish_year 剩下的是出错中止的年份
+        await self.run(self.sink.close, False)
+        self.executor.shutdown()
+
+
+async def read_postgres(dsn: str, year: int, batch: int) -> AsyncIterator[list[tuple]]:
+    """游标流式读取一年的数据 每次返回batch行"""
+    conn = await asyncpg.connect(dsn)
+    try:
+        async with conn.transaction():
+            cursor = await conn.cursor(f"select {','.join(AREA_COLUMNS)} from area_info where year = $1 order by id", year)
+            while True:
+                records = await cursor.fetch(batch)
+                if(not records):
+                    break
+                yield [tuple(r) for r in records]
+    finally:
+        await conn.close()
+
+
+async def read_sqlite(path: str, year: int, batch: int) -> AsyncIterator[list[tuple]]:
+    conn = sqlite3.connect(path)
+    try:
+        cursor = conn.execute(f"select {','.join(AREA_COLUMNS)} from area_info_{year} order by id")
+        while True:
+            records = cursor.fetchmany(batch)
+            if(not records):
+                break
+            yield [(*r[:7], json.loads(r[7]), r[8]) for r in records]
+    finally:
+        conn.close()
+
+
+def write_csv(rows: list[tuple], file) -> None:
+    """对比用 与原先逐行导出的CSV一致 parents_id写为 {1,2,3}"""
+    writer = csv.writer(file)
+    for r in rows:
+        writer.writerow((*r[:7], '{' + ','.join(map(str, r[7])) + '}', r[8]))
+
+
+def folder_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+
+
+async def export(year: int, path: str, with_csv: bool, batch: int = 10000) -> None:
+    """导出一年的数据到path目录 with_csv时同时导出一份CSV对比大小和耗时"""
+    config = json.loads(await read_file('config.json'))
+    if(config['Storage']['Type'] == 'sqlite'):
+        batches = read_sqlite(config['Storage']['Sqlite'], year, batch)
+    else:
+        batches = read_postgres(config['ODBC'], year, batch)
+    sink = ParquetSink(path)
+    os.makedirs(path, exist_ok=True)
+    # CSV放在目录外面 以免按目录读取数据集时混进去
+    csv_file = open(f'{path.rstrip(os.sep)}_{year}.csv', 'w', encoding='utf-8', newline='') if with_csv else None
+    costs = {'read': 0.0, 'parquet': 0.0, 'csv': 0.0}
+    try:
+        start_time = time.perf_counter()
+        async for rows in batches:
+            costs['read'] += time.perf_counter() - start_time
+            start_time = time.perf_counter()
+            sink.write(rows)
+            costs['parquet'] += time.perf_counter() - start_time
+            if(csv_file):
+                start_time = time.perf_counter()
+                write_csv(rows, csv_file)
+                costs['csv'] += time.perf_counter() - start_time
+            start_time = time.perf_counter()
+        start_time = time.perf_counter()
+        sink.close()
+        costs['parquet'] += time.perf_counter() - start_time
+    finally:
+        if(csv_file):
+            csv_file.close()
+    size = folder_size(os.path.join(path, f'year={year}'))
+    out('export', f'{year}年 共{sink.rows}行 读取耗时{round(costs["read"], 2)}s '
+        f'parquet 耗时{round(costs["parquet"], 2)}s {round(size / 1024 / 1024, 2)}MB')
+    if(csv_file):
+        size = os.path.getsize(csv_file.name)
+        out('export', f'csv 耗时{round(costs["csv"], 2)}s {round(size / 1024 / 1024, 2)}MB')
+
+
+if __name__ == '__main__':
+    # python AreaExport.py 2021 [目录] [csv]  导出为 目录/year=2021/level=*/part-{运行}.parquet 加csv时同时导出 目录_2021.csv 对比
+    asyncio.run(export(int(sys.argv[1]), sys.argv[2] if len(sys.argv) > 2 else 'export', 'csv' in sys.argv[3:]))
@@ -0,0 +1,86 @@
+import hashlib
+from asyncpg import Pool
+from AreaBase import AreaType, level
+from AreaParser import Row
+
+
+# 复用上一年的下级数据 id和parents_id由页面位置决定 页面不变时与上一年完全一致
+REUSE_SQL: str = """insert into area_info (id, number, name, full_name, type, level, year, parents_id, release_date)
+                    select id, number, name, full_name, type, level, $1, parents_id, to_date($2, 'yyyy-MM-dd')
+                    from area_info where year = $3 and id > $4 and id < $5 and level > $6
+                    on conflict (id, year) do update set number = excluded.number, name = excluded.name,
+                    full_name = excluded.full_name, type = excluded.type, level = excluded.level,
+                    parents_id = excluded.parents_id, release_date = excluded.release_date"""
+
+
+class Increment:
+    """年度增量爬取
+    读取上一年已入库的数据 记录每个页面(以父级id区分)的 (父级全称, 下级编码和名称的摘要)
+    今年同一个页面的摘要不变时 不再下载它的下级页面 直接把上一年的下级数据复制成今年
+    只对列出第Level级(2-4)及以下数据的页面生效 Level=4时县级页面不变就跳过其下所有村级页面"""
+
+    def __init__(self, pool: Pool, level: int) -> None:
+        self.pool = pool
+        self.level = level
+        # 上一年
+        self.prev_year: int = None
+        # 父级id => (父级全称, 下级摘要)
+        self.pages: dict[int, tuple[str, bytes]] = {}
+        # 本年复用的页面数和行数
+        self.reused_pages = 0
+        self.reused_rows = 0
+
+    async def load(self, year: int) -> int:
+        """加载year之前最近一年的页面摘要 没有上一年时返回None"""
+        self.pages.clear()
+        self.reused_pages = 0
+        self.reused_rows = 0
+        async with self.pool.acquire() as conn:
+            self.prev_year = await conn.fetchval(
+                'select max(year) from area_info where year < $1', year)
+            if(self.prev_year == None):
+                return None
+            digests: dict[int, tuple] = {}
+            async with conn.transaction():
+                # 按id排序 同一父级下的数据就是页面上的顺序
+                async for r in conn.cursor("""select number, name, full_name, parents_id[array_upper(parents_id, 1)] as parent
+                                              from area_info where year = $1 and level >= $2 and level < 5 order by id""",
+                                           self.prev_year, self.level):
+                    page = digests.get(r['parent'])
+                    if(page == None):
+                        page = (r['full_name'][: -len(r['name']) - 1], hashlib.sha1())
+                        digests[r['parent']] = page
+                    page[1].update(f"{r['number']}\t{r['name']}\n".encode())
+        self.pages = {k: (v[0], v[1].digest()) for k, v in digests.items()}
+        return self.prev_year
+
+    def unchanged(self, parent_id: int, parent_full_name: str, type: AreaType, rows: list[Row]) -> bool:
+        """页面与上一年同一父级的页面是否一致 村级页面没有下级 省级页面始终下载"""
+        if(self.prev_year == None or type in (AreaType.Province, AreaType.Village) or level(type) < self.level):
+            return False
+        page = self.pages.get(parent_id)
+        if(page == None or page[0] != parent_full_name):
+            return False
+        digest = hashlib.sha1()
+        for cells, _ in rows:
+            digest.update(f'{cells[0]}\t{cells[1]}\n'.encode())
+        return digest.digest() == page[1]
+
+    async def reuse(self, parent_id: int, type: AreaType, year: int, release_date: str) -> int:
+        """复制parent_id下第level(type)级以下的所有数据 返回复制的行数"""
+        async with self.pool.acquire() as conn:
+            status = await conn.execute(REUSE_SQL, year, release_date, self.prev_year,
+                                        parent_id, parent_id + self.parent_span(type), level(type))
+        count = int(status.split()[-1])
+        self.reused_pages += 1
+        self.reused_rows += count
+        return count
+
+    @staticmethod
+    def parent_span(type: AreaType) -> int:
+        """type级数据的父级所占的id区间长度 父级的所有后代都在(父级id, 父级id + 区间)内"""
+        spans = {AreaType.City: AreaType.Province.value,
+                 AreaType.Country: AreaType.City.value,
+                 AreaType.Town: AreaType.Country.value,
+                 AreaType.Village: AreaType.Town.value}
+        return spans[type]
@@ -0,0 +1,220 @@
+import array
+import asyncio
+import json
+import sqlite3
+import sys
+import time
+from bisect import bisect_left
+from typing import Iterable, NamedTuple
+import asyncpg
+from AreaBase import LEVEL_VALUES, level_of, parent_of, ancestors_of, subtree_range, out, read_file
+
+
+class Area(NamedTuple):
+    id: int
+    number: str
+    name: str
+    # 城乡分类代码 只有村级有
+    type: int
+    level: int
+
+
+class AreaIndex:
+    """一年区划数据的只读内存索引
+    数据按id排序存放在array列中 不为每一行创建python对象 名称存为一整块utf-8字节加偏移
+    父级 祖先由id的位运算直接得到 所有后代在排序后的ids中是连续的一段
+    subtree_end[i]为第i行子树结束的位置 遍历下级时直接跳过孙级 不需要扫描整个子树"""
+
+    def __init__(self, year: int = None) -> None:
+        self.year = year
+        self.ids = array.array('q')
+        self.numbers = array.array('q')
+        self.levels = array.array('b')
+        # 城乡分类代码 没有时为-1
+        self.types = array.array('h')
+        self.name_offsets = array.array('I', [0])
+        self.names = bytearray()
+        # 按number排序后的行号
+        self.by_number = array.array('I')
+        self.subtree_end = array.array('I')
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[tuple[int, str, str, int, int]], year: int = None) -> 'AreaIndex':
+        """rows为 (id, number, name, type, level) 必须按id升序"""
+        index = cls(year)
+        for row in rows:
+            index.append(*row)
+        index.build()
+        return index
+
+    @classmethod
+    async def load_postgres(cls, dsn: str, year: int) -> 'AreaIndex':
+        """游标流式读取 不在内存中保留整年的记录对象"""
+        index = cls(year)
+        conn = await asyncpg.connect(dsn)
+        try:
+            async with conn.transaction():
+                async for r in conn.cursor('select id, number, name, type, level from area_info where year = $1 order by id',
+                                           year, prefetch=10000):
+                    index.append(r[0], r[1], r[2], r[3], r[4])
+        finally:
+            await conn.close()
+        index.build()
+        return index
+
+    @classmethod
+    def load_sqlite(cls, path: str, year: int) -> 'AreaIndex':
+        conn = sqlite3.connect(path)
+        try:
+            return cls.from_rows(conn.execute(
+                f'select id, number, name, type, level from area_info_{year} order by id'), year)
+        finally:
+            conn.close()
+
+    def append(self, id: int, number: str, name: str, type: int, level: int) -> None:
+        """追加一行 id必须比之前的都大 全部追加完后调用build"""
+        if(self.ids and id <= self.ids[-1]):
+            raise ValueError(f'必须按id升序且不重复 {id}')
+        self.ids.append(id)
+        self.numbers.append(int(number))
+        self.levels.append(level)
+        self.types.append(-1 if type == None else type)
+        self.names += name.encode()
+        self.name_offsets.append(len(self.names))
+
+    def build(self) -> None:
+        """生成number的排序和每行子树的结束位置"""
+        n = len(self.ids)
+        self.by_number = array.array('I', sorted(range(n), key=self.numbers.__getitem__))
+        self.subtree_end = array.array('I', bytes(4 * n))
+        # 栈中是还没有结束的祖先 (行号, 子树id上界) 遇到不在其子树内的id时出栈
+        stack: list[tuple[int, int]] = []
+        ids, levels, end = self.ids, self.levels, self.subtree_end
+        for i in range(n):
+            id = ids[i]
+            while(stack and id >= stack[-1][1]):
+                end[stack.pop()[0]] = i
+            stack.append((i, id + LEVEL_VALUES[levels[i] - 1]))
+        for i, _ in stack:
+            end[i] = n
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def position(self, id: int) -> int:
+        """id所在的行号 不存在时返回-1"""
+        i = bisect_left(self.ids, id)
+        if(i < len(self.ids) and self.ids[i] == id):
+            return i
+        return -1
+
+    def name(self, i: int) -> str:
+        """第i行的名称 names可以是bytearray 也可以是mmap上的memoryview"""
+        return str(self.names[self.name_offsets[i]: self.name_offsets[i + 1]], 'utf-8')
+
+    def row(self, i: int) -> Area:
+        return Area(self.ids[i], str(self.numbers[i]).zfill(12), self.name(i),
+                    None if self.types[i] < 0 else self.types[i], self.levels[i])
+
+    def get(self, id: int) -> Area:
+        i = self.position(id)
+        return None if i < 0 else self.row(i)
+
+    def get_by_code(self, code: str | int) -> Area:
+        """按12位区划代码查找"""
+        number = int(code)
+        j = bisect_left(self.by_number, number, key=self.numbers.__getitem__)
+        if(j < len(self.by_number) and self.numbers[self.by_number[j]] == number):
+            return self.row(self.by_number[j])
+        return None
+
+    def parent(self, id: int) -> Area:
+        parent_id = parent_of(id)
+        return None if parent_id == None else self.get(parent_id)
+
+    def ancestors(self, id: int) -> list[Area]:
+        """从省级开始的所有祖先 不在索引中的祖先跳过(某个省爬取失败时的不完整数据)"""
+        return [area for area in map(self.get, ancestors_of(id)) if(area != None)]
+
+    def children(self, id: int) -> list[Area]:
+        """直接下级 id为None时返回所有省"""
+        if(id == None):
+            i, end = 0, len(self.ids)
+        else:
+            i = self.position(id)
+            if(i < 0):
+                return []
+            i, end = i + 1, self.subtree_end[i]
+        result = []
+        while(i < end):
+            result.append(self.row(i))
+            i = self.subtree_end[i]
+        return result
+
+    def descendants(self, id: int, level: int = None) -> list[Area]:
+        """所有后代 level不为空时只返回该级"""
+        lo, hi = subtree_range(id)
+        i, end = bisect_left(self.ids, lo + 1), bisect_left(self.ids, hi)
+        return [self.row(k) for k in range(i, end) if(level == None or self.levels[k] == level)]
+
+    def level(self, id: int) -> int:
+        return level_of(id)
+
+    def full_name(self, id: int) -> str:
+        """缺少的祖先跳过 id本身不在索引中时抛出KeyError"""
+        area = self.get(id)
+        if(area == None):
+            raise KeyError(f'id不存在 {id}')
+        return '/'.join(a.name for a in self.ancestors(id) + [area])
+
+    def memory(self) -> int:
+        """各列占用的字节数"""
+        columns = [self.ids, self.numbers, self.levels, self.types,
+                   self.name_offsets, self.by_number, self.subtree_end]
+        return sum(c.itemsize * len(c) for c in columns) + len(self.names)
+
+
+def bench(index: AreaIndex, loop: int = 200000) -> None:
+    """随机id和代码的查找耗时"""
+    import random
+    sample = [index.ids[random.randrange(len(index))] for _ in range(loop)]
+    codes = [str(index.numbers[index.position(id)]).zfill(12) for id in sample]
+    for name, func, args in [('get', index.get, sample),
+                             ('get_by_code', index.get_by_code, codes),
+                             ('parent', index.parent, sample),
+                             ('ancestors', index.ancestors, sample),
+                             ('children', index.children, sample)]:
+        start_time = time.perf_counter()
+        for a in args:
+            func(a)
+        use = time.perf_counter() - start_time
+        out('bench', f'{name} {round(use / loop * 1e6, 2)}µs/次')
+
+
+async def load(config: dict, year: int) -> AreaIndex:
+    """根据config.json的Storage加载"""
+    if(config['Storage']['Type'] == 'sqlite'):
+        return AreaIndex.load_sqlite(config['Storage']['Sqlite'], year)
+    return await AreaIndex.load_postgres(config['ODBC'], year)
+
+
+async def main(year: int, codes: list[str]) -> None:
+    config = json.loads(await read_file('config.json'))
+    start_time = time.time()
+    index = await load(config, year)
+    out('main', f'{year}年 共{len(index)}条 加载耗时{round(time.time() - start_time, 2)}s '
+        f'占用{round(index.memory() / 1024 / 1024, 2)}MB')
+    for code in codes:
+        area = index.get_by_code(code)
+        if(area == None):
+            out('main', f'未找到 {code}')
+            continue
+        out('main', f'{area} {index.full_name(area.id)}')
+        out('main', f'下级 {[c.name for c in index.children(area.id)]}')
+    if(not codes and len(index)):
+        bench(index)
+
+
+if __name__ == '__main__':
+    # python AreaIndex.py 2021 [区划代码 ...] 不给代码时运行查找性能测试
+    asyncio.run(main(int(sys.argv[1]), sys.argv[2:]))
@@ -1,106 +1,200 @@
 import asyncio
 import json
-import asyncpg
-import enum
 import time
+from concurrent.futures import ProcessPoolExecutor
 from bs4 import BeautifulSoup
-from bs4.element import Tag, ResultSet
-import aiofiles
-from aiohttp import ClientSession, TCPConnector, ClientTimeout, ServerDisconnectedError, ClientConnectorError
-from asyncpg import Pool
+from aiohttp import ClientSession, TCPConnector, ClientTimeout, web
+from AreaBase import AreaType, level, read_file, time_use, out, trim_right
+from AreaCache import PageCache
+from AreaCheckpoint import Checkpoint
+from AreaCongestion import AdaptiveLimit
+from AreaIncrement import Increment
+from AreaMetrics import (CACHE_READS, CRAWL_QUEUE, FLUSH_ROWS, FLUSH_SECONDS, HTTP_WINDOW, PARSE_SECONDS,
+                         ROWS_BUILT, WRITER_QUEUE, serve, summary)
+from AreaParser import Row, extract
+from AreaRetry import RetryPolicy, FetchStatus
+from AreaRows import RowBlock
+from AreaStorage import Storage, PostgresStorage, create_storage
+from AreaWorkQueue import WorkQueue
+from AreaWriter import RowWriter
 
 
 # 全局数据库信息 = > config.json
 CONFIG: dict = None
-# 全局数据库连接池
-POOL: Pool = None
+# 存储后端 => config.json Storage
+STORAGE: Storage = None
 # 全局http回话
 SESSION: ClientSession = None
 # 区划代码首页地址
 URL_BASE: str = 'http://www.stats.gov.cn/tjsj/tjbz/tjyqhdmhcxhfdm/index.html'
 # 区划代码发布日期字典
 DATE_DICT: dict[int, str] = None
-# 休眠
-TIME_SLEEP: int = 0.5
-# 数据缓存
-DATA_TEMP: list[tuple[int, str, str, str, int, int, int, list[int], str]] = []
-# 城市缓存
-DATA_CITY: list[tuple[str, int, list[int], str]] = []
-# 当前年
-CONTEXT_YEAR: int = None
-
-
-class AreaType(enum.Enum):
-    Province = 1 << 48
-    City = 1 << 36
-    Country = 1 << 24
-    Town = 1 << 12
-    Village = 1
-
-
-async def main() -> None:
+# 重试策略 => config.json Retry
+RETRY: RetryPolicy = None
+# 全局并发请求限制 => config.json Concurrency 开启Adaptive时为自适应窗口 Concurrency为上限
+LIMIT: asyncio.Semaphore | AdaptiveLimit = None
+# 页面缓存 => config.json Cache
+CACHE: PageCache = None
+# 断点续爬日志 => config.json Checkpoint
+CHECKPOINT: Checkpoint = None
+# 分布式工作队列 => config.json Distributed 未开启时为None
+QUEUE: WorkQueue = None
+# 增量爬取 => config.json Incremental 未开启时为None
+INCREMENT: Increment = None
+# 写库管道 => config.json Writer
+WRITER: RowWriter = None
+# 页面解析进程池 => config.json ParseWorkers 为0时在事件循环内解析
+PARSER_POOL: ProcessPoolExecutor = None
+# 指标接口 => config.json Metrics 端口为0时不启动
+METRICS: web.AppRunner = None
+
+
+class CrawlContext:
+    """一年的爬取上下文 取代原先的CONTEXT_YEAR DATA_TEMP DATA_CITY全局变量
+    每年一个 多个年份可以在同一个事件循环中并发爬取 共用SESSION LIMIT和WRITER"""
+
+    def __init__(self, year: int, release_date: str) -> None:
+        self.year = year
+        self.release_date = release_date
+        # 城市缓存
+        self.cities: list[tuple[str, int, list[int], str]] = []
+
+
+async def main(storage: str = None) -> None:
     start_time = time.time()
-    await init()
+    await init(storage)
     await start()
-    await SESSION.close()
+    await close()
     out('main', f'程序共耗时{time_use(start_time)}s')
 
 
-async def init() -> None:
+async def init(storage: str | Storage = None, config: dict = None) -> None:
+    """config不为空时不读取config.json 用于离线性能测试"""
     # 1 初始化配置信息
-    await init_config()
-    # 2 初始化数据库
-    await init_sql()
-    # 3 初始化table
-    await init_table()
-    # 4 初始化session
+    await init_config(config)
+    # 2 创建存储 先不连接数据库
+    await init_storage(storage)
+    # 3 初始化断点日志 不能断点续爬或不支持分布式爬取时 在打开数据库连接和session之前报错
+    await init_checkpoint()
+    await init_queue()
+    # 4 连接存储 初始化数据表
+    await open_storage()
+    # 5 初始化session
     await init_session()
-    # 5 初始化日期字典
+    # 6 初始化页面缓存
+    await init_cache()
+    # 7 初始化增量爬取
+    await init_increment()
+    # 8 初始化写入管道
+    await init_writer()
+    # 9 初始化日期字典
     await init_date()
+    # 10 初始化解析进程池
+    await init_parser()
+    # 11 初始化指标接口
+    await init_metrics()
 
 
-async def init_config() -> None:
+async def init_config(config: dict = None) -> None:
     global CONFIG
-    info = await read_file('config.json')
-    out('init_config', info)
-    CONFIG = json.loads(info)
+    if(config == None):
+        info = await read_file('config.json')
+        out('init_config', info)
+        config = json.loads(info)
+    CONFIG = config
     out('init_config', '初始化配置信息成功')
 
 
-async def init_sql() -> None:
-    global POOL
-    conn: str = CONFIG['ODBC']
-    out('init_sql', f'正在连接 > {conn}')
-    POOL = await asyncpg.create_pool(conn)
-    out('init_sql', '数据库连接成功')
+async def init_storage(storage: str | Storage = None) -> None:
+    """storage为字符串时覆盖config.json中的Storage.Type 为Storage对象时直接使用 只创建 由open_storage连接"""
+    global STORAGE
+    if(isinstance(storage, Storage)):
+        STORAGE = storage
+    else:
+        if(storage):
+            CONFIG['Storage']['Type'] = storage
+        STORAGE = create_storage(CONFIG)
 
 
-async def init_table() -> None:
-    sql = await read_file('table.sql')
-    out('init_table', f'初始化表 > {sql}')
-    out('init_table', f'插入语句 > {CONFIG["InsertSQL"]}')
-    async with POOL.acquire() as conn:
-        await conn.execute(sql)
-    out('init_table', '数据表初始化完成')
+async def open_storage() -> None:
+    await STORAGE.open()
+    out('open_storage', f'存储初始化完成 > {STORAGE.name}')
 
 
 async def init_session() -> None:
     out('init_session', '初始化Session')
     time_out: int = 1
-    conn_limit: int = 50
+    conn_limit: int = CONFIG['Concurrency']
     header_dic: dict[str, str] = {
         'user-agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/96.0.4664.110 Safari/537.36 Edg/96.0.1054.62',
         'referer': URL_BASE}
-    global SESSION
+    keep_alive: int = CONFIG['KeepAlive']
+    global SESSION, LIMIT, RETRY
+    if(CONFIG['Adaptive']['Enable']):
+        # 自适应时每个请求的超时由LIMIT给出 这里的超时只是默认值
+        LIMIT = AdaptiveLimit.from_config(conn_limit, CONFIG['Adaptive'])
+        HTTP_WINDOW.func = lambda: LIMIT.window
+    else:
+        LIMIT = asyncio.Semaphore(conn_limit)
+        HTTP_WINDOW.set(conn_limit)
+    RETRY = RetryPolicy.from_config(CONFIG['Retry'])
+    # KeepAlive为0时与原先一样每个请求新建连接 域名解析结果缓存5分钟
     SESSION = ClientSession(
         timeout=ClientTimeout(total=time_out),
         headers=header_dic,
-        connector=TCPConnector(limit=conn_limit, force_close=True))
-    out('init_session', f'Session初始化成功 > 超时:{time_out} 限制连接数:{conn_limit}')
+        connector=TCPConnector(limit=conn_limit, ttl_dns_cache=300, force_close=keep_alive == 0,
+                               keepalive_timeout=keep_alive or None))
+    out('init_session', f'Session初始化成功 > 超时:{time_out} 限制连接数:{conn_limit} '
+        f'自适应:{type(LIMIT).__name__} 长连接:{keep_alive}s')
+
+
+async def init_cache() -> None:
+    global CACHE
+    CACHE = PageCache(CONFIG['Cache']['Path'], CONFIG['Cache']['Mode'])
+    out('init_cache', f'页面缓存初始化成功 > 目录:{CACHE.path} 模式:{CACHE.mode}')
+
+
+async def init_writer() -> None:
+    global WRITER
+    WRITER = RowWriter.from_config(save_data, CONFIG['Writer'])
+    out('init_writer', f'写入管道初始化成功 > 写入task:{len(WRITER.tasks)} 队列长度:{WRITER.queue.maxsize}')
+
+
+async def init_increment() -> None:
+    if(CONFIG['Incremental']['Enable']):
+        if(not isinstance(STORAGE, PostgresStorage)):
+            out('init_increment', f'增量爬取需要读取area_info {STORAGE.name}存储不支持 已关闭')
+            return
+        global INCREMENT
+        INCREMENT = Increment(STORAGE.pool, CONFIG['Incremental']['Level'])
+        out('init_increment', f'增量爬取 > 第{INCREMENT.level}级及以下的页面不变时复用上一年数据')
+
+
+async def init_queue() -> None:
+    if(CONFIG['Distributed']['Enable']):
+        # 一个worker合并一年时其他worker可能还在写暂存表 版本表只能单进程按年份顺序写入
+        if(STORAGE.ordered_years):
+            raise ValueError(f'{STORAGE.name}存储只能单进程按年份顺序写入 不支持分布式爬取')
+        global QUEUE
+        QUEUE = WorkQueue.from_config(CONFIG['ODBC'], CONFIG['Distributed'])
+        await QUEUE.open()
+        out('init_queue', f'分布式爬取 > worker:{QUEUE.worker} 租约:{QUEUE.lease}s 本地断点日志不再使用')
+
+
+async def init_checkpoint() -> None:
+    global CHECKPOINT
+    CHECKPOINT = Checkpoint(CONFIG['Checkpoint'])
+    out('init_checkpoint', f'断点日志 > {CHECKPOINT.path} 已完成{len(CHECKPOINT.finished)}项')
+    started = [year for year in CONFIG['Year'] if(CHECKPOINT.count(year, 'city') or CHECKPOINT.count(year, 'province'))]
+    if(not STORAGE.resumable and started):
+        CHECKPOINT.close()
+        raise ValueError(f'{STORAGE.name}存储不能断点续爬 断点日志中已有{started}年的记录 '
+                         f'删除{CHECKPOINT.path}后从头爬取')
 
 
 async def init_date() -> None:
-    body = await get_data(URL_BASE)
+    # 首页要能发现新发布的年份 不读缓存
+    body = await get_data(URL_BASE, refresh=True)
     html = BeautifulSoup(body, 'html.parser', from_encoding='gb18030')
     date_dict: dict[int, str] = {}
     for i in html.select('ul.center_list_contlist span.cont_tit'):
@@ -112,212 +206,361 @@ async def init_date() -> None:
     out('init_date', DATE_DICT)
 
 
+async def init_parser() -> None:
+    workers: int = CONFIG['ParseWorkers']
+    if(workers > 0):
+        global PARSER_POOL
+        PARSER_POOL = ProcessPoolExecutor(workers)
+        out('init_parser', f'解析进程池初始化成功 > 进程数:{workers}')
+    else:
+        out('init_parser', '在事件循环内直接解析页面')
+
+
+async def init_metrics() -> None:
+    WRITER_QUEUE.func = WRITER.queue.qsize
+    host: str = CONFIG['Metrics']['Host']
+    port: int = CONFIG['Metrics']['Port']
+    if(port):
+        global METRICS
+        METRICS = await serve(host, port)
+        out('init_metrics', f'指标接口 > http://{host}:{port}/metrics /metrics.json')
+
+
+async def close() -> None:
+    """写完剩余数据后关闭所有资源 输出指标汇总"""
+    await WRITER.close()
+    if(QUEUE):
+        await QUEUE.close()
+    await STORAGE.close()
+    await SESSION.close()
+    CACHE.close()
+    CHECKPOINT.close()
+    if(PARSER_POOL):
+        PARSER_POOL.shutdown()
+    if(METRICS):
+        await METRICS.cleanup()
+    for line in summary():
+        out('metrics', line)
+
+
 async def start() -> None:
-    for year in CONFIG['Year']:
+    """最多YearConcurrency个年份同时爬取 请求数仍由LIMIT统一限制
+    增量爬取需要上一年的数据已经入库 此时按配置的顺序逐年爬取
+    版本化存储只能按年份递增写入 此时按年份从小到大逐年爬取"""
+    contexts: list[CrawlContext] = []
+    for year in sorted(CONFIG['Year']) if STORAGE.ordered_years else CONFIG['Year']:
         if(year in DATE_DICT):
-            global CONTEXT_YEAR
-            CONTEXT_YEAR = year
-            out('start', f'开始下载{year}年数据')
-            await make_data()
+            contexts.append(CrawlContext(year, DATE_DICT[year]))
         else:
             out('start', f'未找到{year}年数据')
+    parallel: int = 1 if INCREMENT or STORAGE.ordered_years else CONFIG['YearConcurrency']
+    limit = asyncio.Semaphore(parallel)
+
+    async def run(ctx: CrawlContext) -> None:
+        async with limit:
+            out('start', f'开始下载{ctx.year}年数据')
+            start_time = time.time()
+            await make_data(ctx)
+            out('start', f'{ctx.year}年数据下载完成 用时{time_use(start_time)}s')
+    if(parallel == 1):
+        for ctx in contexts:
+            await run(ctx)
+    else:
+        await asyncio.gather(*[run(ctx) for ctx in contexts])
 
 
-async def make_data() -> None:
+async def make_data(ctx: CrawlContext) -> None:
     """组装数据 核心函数大变样 以市为分界线进行分区读取 增加模块的专一性
-    拆分功能职责 将通用部分声明称公共变量"""
+    拆分功能职责 将通用部分声明称公共变量
+    数据交给WRITER在后台写库 爬完一个市直接开始下一个市 写完后再记录断点"""
+    year = ctx.year
+    if(INCREMENT):
+        prev_year = await INCREMENT.load(year)
+        out('make_data', f'增量爬取 对比{prev_year}年的{len(INCREMENT.pages)}个页面')
     # 加载市以上的行政单位 包括城市
-    url = f'{trim_right(URL_BASE)}{CONTEXT_YEAR}/index.html'
+    url = f'{trim_right(URL_BASE)}{year}/index.html'
     body = await get_data(url)
-    html = BeautifulSoup(body, 'html.parser', from_encoding='gb18030')
-    page_rows: tuple[AreaType, ResultSet[Tag]] = read_data(html)
-    provinces = build_data(data=page_rows[1],
-                           type=page_rows[0],
-                           page_url=url)
-    out('make_data', '加载城市数据')
-    global DATA_CITY
+    page_rows: tuple[AreaType, list[Row]] = await read_data(body, url)
+    block, provinces = build_data(ctx,
+                                  data=page_rows[1],
+                                  type=page_rows[0],
+                                  page_url=url)
+    # 省级数据的key为0 省页面(城市列表)的key为省id 市以下的key为市id
+    await emit(ctx, 0, block)
+    # 断点续爬 已完成的省整个跳过 已完成的市跳过 插入语句为upsert 重复写入无副作用
+    # 分布式爬取时完成情况记录在area_work表中 所有省都要读取
+    if(not QUEUE):
+        provinces = [p for p in provinces
+                     if(not CHECKPOINT.done(year, 'province', p[1]))]
+        out('make_data', f'加载城市数据 已完成{CHECKPOINT.count(year, "province")}个省 跳过')
+    # 省级页面互不依赖 一次性并发读取 gather保证城市顺序与省份顺序一致
+    for cities in await asyncio.gather(*[next_down(ctx, p) for p in provinces]):
+        ctx.cities += cities
+    if(QUEUE):
+        await crawl_claimed(ctx)
+    else:
+        await crawl_cities(ctx, provinces)
+    # 省级数据和省页面的数据不随市记录完成 收尾前等它们全部写入
+    await WRITER.wait((year, 0))
     for p in provinces:
-        ps = p[2].copy()
-        ps.append(p[1])
-        p_body = await get_data(p[0])
-        p_html = BeautifulSoup(p_body, 'html.parser', from_encoding='gb18030')
-        p_page_rows: tuple[AreaType, ResultSet[Tag]] = read_data(p_html)
-        DATA_CITY += build_data(data=p_page_rows[1],
-                                type=p_page_rows[0],
-                                page_url=p[0],
-                                parent_id=p[1],
-                                parents_id=ps,
-                                parent_full_name=p[3])
-    for c in DATA_CITY:
-        out('make_data', f'执行下载数据 >> {c[3]}')
-        start_time = time.time()
-        await next_down(c)
-        out('make_data', f'{c[3]} 数据下载成功 用时{time_use(start_time)}s')
-        await save_data()
+        await WRITER.wait((year, p[1]))
+    # 共享的数据库由最后清空队列的worker收尾 其他worker还在写时不能收尾
+    if(QUEUE == None or not STORAGE.shared or await QUEUE.finalize(year)):
+        await STORAGE.finish_year(year)
+    else:
+        out('make_data', f'{year}年已由其他worker收尾 跳过')
+    if(INCREMENT):
+        out('make_data', f'增量爬取 复用{INCREMENT.reused_pages}个页面的下级数据 共{INCREMENT.reused_rows}条')
     # 完成一年的数据加载后清除城市缓存信息
-    DATA_CITY.clear()
-
-
-async def next_down(info: tuple[str, int, list[int], str], is_rec: bool = True) -> None:
-    """加载市以下的行政单位 不包括城市"""
+    ctx.cities.clear()
+
+
+async def crawl_cities(ctx: CrawlContext, provinces: list[tuple[str, int, list[int], str]]) -> None:
+    """逐个爬取没有完成的市 写入后记录断点"""
+    year = ctx.year
+    # 每个省还剩多少个市没有完成 市的parents_id只有省id
+    remain: dict[int, int] = {p[1]: 0 for p in provinces}
+    todo = [c for c in ctx.cities if(not CHECKPOINT.done(year, 'city', c[1]))]
+    for c in todo:
+        remain[c[2][0]] += 1
+    finishing = [asyncio.create_task(finish_province(year, id))
+                 for id, count in remain.items() if(count == 0)]
+    for c in todo:
+        out('crawl_cities', f'执行下载数据 >> {year}年 {c[3]}')
+        start_time = time.time()
+        await crawl(ctx, [c])
+        out('crawl_cities', f'{year}年 {c[3]} 数据下载成功 用时{time_use(start_time)}s')
+        finishing.append(asyncio.create_task(finish_city(year, c, remain)))
+    await asyncio.gather(*finishing)
+
+
+async def crawl_claimed(ctx: CrawlContext) -> None:
+    """分布式爬取 把市发布到工作队列 再逐个领取爬取 写入后标记完成
+    没有可领取的市但其他worker还在爬时继续等待 以便接手租约过期的市"""
+    year = ctx.year
+    total = await QUEUE.publish(year, ctx.cities)
+    out('crawl_claimed', f'{year}年 工作队列共{total}个市')
+    finishing: list[asyncio.Task] = []
+    while True:
+        claimed = await QUEUE.claim(year)
+        if(claimed == None):
+            # 自己领取的市写库完成前也是爬取中 先等它们完成
+            await asyncio.gather(*finishing)
+            finishing.clear()
+            if(await QUEUE.running(year) == 0):
+                break
+            await asyncio.sleep(QUEUE.poll)
+            continue
+        c, attempts = claimed
+        out('crawl_claimed', f'执行下载数据 >> {year}年 {c[3]} 第{attempts}次领取')
+        start_time = time.time()
+        try:
+            await crawl(ctx, [c])
+        except Exception as e:
+            # 马上放回队列 不必等租约过期
+            await QUEUE.release(year, c[1], attempts, f'{type(e).__name__} {e}')
+            raise
+        out('crawl_claimed', f'{year}年 {c[3]} 数据下载成功 用时{time_use(start_time)}s')
+        finishing.append(asyncio.create_task(finish_claimed(year, c[1])))
+    stats = await QUEUE.stats(year)
+    out('crawl_claimed', f'{year}年 已完成{stats.get(2, 0)}个市 放弃{stats.get(3, 0)}个')
+
+
+async def finish_claimed(year: int, id: int) -> None:
+    await WRITER.wait((year, id))
+    await QUEUE.finish(year, id)
+
+
+async def finish_city(year: int, city: tuple[str, int, list[int], str], remain: dict[int, int]) -> None:
+    """市的数据全部写入后记录断点 省下的市都完成后记录省"""
+    await WRITER.wait((year, city[1]))
+    CHECKPOINT.mark(year, 'city', city[1])
+    remain[city[2][0]] -= 1
+    if(remain[city[2][0]] == 0):
+        await finish_province(year, city[2][0])
+
+
+async def finish_province(year: int, id: int) -> None:
+    await WRITER.wait((year, 0))
+    await WRITER.wait((year, id))
+    CHECKPOINT.mark(year, 'province', id)
+
+
+async def emit(ctx: CrawlContext, key: int, block: RowBlock) -> None:
+    """把build_data构建好的一个页面的数据交给WRITER"""
+    await WRITER.put((ctx.year, key), block)
+
+
+async def crawl(ctx: CrawlContext, infos: list[tuple[str, int, list[int], str]]) -> None:
+    """工作队列爬取 取代原先逐个await的递归下载
+    infos为待爬取的边界(frontier) 由CONFIG['Concurrency']个worker并发消费
+    每个worker读取页面后将下级页面重新放回队列 直到队列清空"""
+    queue: asyncio.Queue[tuple[str, int, list[int], str]] = asyncio.Queue()
+    for info in infos:
+        queue.put_nowait(info)
+
+    async def worker() -> None:
+        while True:
+            info = await queue.get()
+            try:
+                for next_info in await next_down(ctx, info):
+                    queue.put_nowait(next_info)
+            finally:
+                queue.task_done()
+                CRAWL_QUEUE.set(queue.qsize())
+
+    workers = [asyncio.create_task(worker())
+               for _ in range(CONFIG['Concurrency'])]
+    join = asyncio.create_task(queue.join())
+    try:
+        # worker只有在出现异常时才会提前结束 此时直接抛出 避免join永远等待
+        done, _ = await asyncio.wait([join, *workers],
+                                     return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if(task is not join):
+                task.result()
+    finally:
+        join.cancel()
+        for w in workers:
+            w.cancel()
+        await asyncio.gather(join, *workers, return_exceptions=True)
+
+
+async def next_down(ctx: CrawlContext, info: tuple[str, int, list[int], str]) -> list[tuple[str, int, list[int], str]]:
+    """加载一个页面的下级行政单位 返回需要继续下载的下级页面"""
     ps = info[2].copy()
     ps.append(info[1])
     body = await get_data(info[0])
-    html = BeautifulSoup(body, 'html.parser', from_encoding='gb18030')
-    next_page_rows: tuple[AreaType, ResultSet[Tag]] = read_data(html)
+    if(body == None):
+        return []
+    next_page_rows: tuple[AreaType, list[Row]] = await read_data(body, info[0])
     if(next_page_rows == None):
         out('next_down', f'奇奇怪怪日志 url >> {info[0]}')
-        return
-    next_infos = build_data(data=next_page_rows[1],
-                            type=next_page_rows[0],
-                            page_url=info[0],
-                            parent_id=info[1],
-                            parents_id=ps,
-                            parent_full_name=info[3])
-    if(next_infos and is_rec):
-        for ni in next_infos:
-            await next_down(ni)
-
-
-async def save_data() -> None:
-    if(DATA_TEMP):
-        start_time = time.time()
-        async with POOL.acquire() as conn:
-            async with conn.transaction():
-                await conn.executemany(CONFIG['InsertSQL'], DATA_TEMP)
-        out('save_data', f'已插入数据{len(DATA_TEMP)}条 耗时{time_use(start_time)}s')
-        DATA_TEMP.clear()
-
-
-def read_data(html: BeautifulSoup) -> tuple[AreaType, ResultSet[Tag]]:
-    """读取数据 全新改版 核心思想不变 增加异常数据报错 为空时是大胡同街道场景"""
-    rows = html.select('tr.villagetr')
-    if(rows):
-        return (AreaType.Village, rows)
-    rows = html.select('tr.towntr')
-    if(rows):
-        return (AreaType.Town, rows)
-    rows = html.select('tr.countytr')
-    if(rows):
-        return (AreaType.Country, rows)
-    rows = html.select('tr.citytr')
-    if(rows):
-        return (AreaType.City, rows)
-    rows = html.select('tr.provincetr a')
-    if(rows):
-        return (AreaType.Province, rows)
-    if(html.select('a.STYLE3')):
-        out('read_data', f'注意奇奇怪怪发生啦 {html.prettify()}')
-        return None
-    else:
-        out('read_data', html.prettify())
-        raise Exception('捕获到异常数据')
+        if(CACHE.writable):
+            CACHE.mark_negative(info[0])
+        return []
+    block, next_infos = build_data(ctx,
+                                   data=next_page_rows[1],
+                                   type=next_page_rows[0],
+                                   page_url=info[0],
+                                   parent_id=info[1],
+                                   parents_id=ps,
+                                   parent_full_name=info[3])
+    await emit(ctx, ps[1] if len(ps) > 1 else ps[0], block)
+    # 增量爬取 页面与上一年一致时直接复用上一年的下级数据 不再往下走
+    if(INCREMENT and INCREMENT.unchanged(info[1], info[3], next_page_rows[0], next_page_rows[1])):
+        await INCREMENT.reuse(info[1], next_page_rows[0], ctx.year, ctx.release_date)
+        return []
+    return next_infos
 
 
-def build_data(data: ResultSet[Tag],
+async def save_data(rows: list[tuple]) -> None:
+    """由WRITER的写入task调用 输出每秒插入的行数便于对比不同的存储和写入方式"""
+    start_time = time.time()
+    await STORAGE.save(rows)
+    use = time.time() - start_time
+    FLUSH_ROWS.observe(len(rows))
+    FLUSH_SECONDS.observe(use)
+    out('save_data', f'已插入数据{len(rows)}条 耗时{round(use, 2)}s '
+        f'{STORAGE.name} {round(len(rows) / max(use, 1e-6))}条/s')
+
+
+async def read_data(body: bytes, url: str) -> tuple[AreaType, list[Row]]:
+    """读取数据 全新改版 核心思想不变 增加异常数据报错 为空时是大胡同街道场景
+    解析交给AreaParser 后端由CONFIG['Parser']指定 fast为默认 bs4为参考实现
+    配置了PARSER_POOL时页面字节交给子进程解析 事件循环可以继续下载
+    不是区划页面(如限流或验证页面)时从CACHE中删除url 下次重新下载 否则以后每次读缓存都会失败"""
+    start_time = time.perf_counter()
+    try:
+        if(PARSER_POOL):
+            page_rows = await asyncio.get_running_loop().run_in_executor(
+                PARSER_POOL, extract, body, CONFIG['Parser'])
+        else:
+            page_rows = extract(body, CONFIG['Parser'])
+    except ValueError:
+        if(CACHE.writable):
+            CACHE.evict(url)
+        raise
+    # 使用进程池时包含进程间传递的时间
+    PARSE_SECONDS.observe(time.perf_counter() - start_time, page_rows[0].name if page_rows else 'Empty')
+    if(page_rows == None):
+        out('read_data', f'注意奇奇怪怪发生啦 {body.decode("gb18030", errors="replace")}')
+    return page_rows
+
+
+def build_data(ctx: CrawlContext,
+               data: list[Row],
                type: AreaType,
                page_url: str,
                parent_id: int = None,
                parents_id: list[int] = [],
-               parent_full_name: str = '') -> list[tuple[str, int, list[int], str]]:
-    """构建数据对象 这个地方应该放回下级对象的所需的本方法所有参数 以满足递归调用"""
+               parent_full_name: str = '') -> tuple[RowBlock, list[tuple[str, int, list[int], str]]]:
+    """构建数据对象 这个地方应该放回下级对象的所需的本方法所有参数 以满足递归调用
+    返回 (本页数据的RowBlock, 下级页面) full_name和parents_id在写库时才生成"""
     next_base_url = trim_right(page_url)
     loop = len(data)
+    block = RowBlock(ctx.year, ctx.release_date, level(type), parent_id, parent_full_name)
+    ROWS_BUILT.inc(type.name, value=loop)
     if(type == AreaType.Village):
         for i in range(loop):
-            e: ResultSet[Tag] = data[i].find_all('td')
-            name: str = e[2].text
-            model = (type.value * (i+1) + parent_id, e[0].text, name,
-                     f'{parent_full_name}/{name}', int(e[1].text),
-                     level(type), CONTEXT_YEAR, parents_id, DATE_DICT[CONTEXT_YEAR])
-            DATA_TEMP.append(model)
-        return []
+            e: tuple[str, ...] = data[i][0]
+            block.append(type.value * (i+1) + parent_id, e[0], e[2], int(e[1]))
+        return block, []
     elif(type == AreaType.Province):
         next_infos: list = []
         for i in range(loop):
             id = type.value * (i+1)
-            e: Tag = data[i]
-            href: str = e.attrs['href']
-            name: str = e.text
-            model = (id, href[0: 2].ljust(12, '0'), name, name,
-                     None, level(type), CONTEXT_YEAR, [], DATE_DICT[CONTEXT_YEAR])
-            DATA_TEMP.append(model)
+            name: str = data[i][0][0]
+            href: str = data[i][1]
+            block.append(id, href[0: 2].ljust(12, '0'), name)
             next_info = (f'{next_base_url}{href}', id, parents_id, name)
             next_infos.append(next_info)
-        return next_infos
+        return block, next_infos
     else:
         next_infos: list = []
         for i in range(loop):
             id = type.value * (i+1) + parent_id
-            e: ResultSet[Tag] = data[i].find_all('td')
-            name: str = e[1].text
-            full_name = f'{parent_full_name}/{name}'
-            model = (id, e[0].text, name, full_name, None, level(type),
-                     CONTEXT_YEAR, parents_id, DATE_DICT[CONTEXT_YEAR])
-            DATA_TEMP.append(model)
-            a: Tag = e[0].find('a')
-            if(a):
-                url = f"{next_base_url}{a.attrs['href']}"
+            e: tuple[str, ...] = data[i][0]
+            name: str = e[1]
+            block.append(id, e[0], name)
+            href: str = data[i][1]
+            if(href):
+                full_name = f'{parent_full_name}/{name}'
+                url = f"{next_base_url}{href}"
                 next_info = (url, id, parents_id, full_name)
                 next_infos.append(next_info)
-        return next_infos
-
-
-def level(type: AreaType) -> int:
-    if(type == AreaType.Village):
-        return 5
-    elif(type == AreaType.Town):
-        return 4
-    elif(type == AreaType.Country):
-        return 3
-    elif(type == AreaType.City):
-        return 2
+        return block, next_infos
+
+
+async def get_data(url: str, refresh: bool = False) -> bytes:
+    """当404网站出现时 该方法会返回None 使用该方法需要判断是否为空
+    先读CACHE 负缓存(404或没有数据的页面)同样返回None refresh为True时跳过读缓存
+    502和超时交给RETRY异步退避重试 重试用尽后抛出异常"""
+    if(CACHE.readable and not (refresh and CACHE.mode != 'only')):
+        entry = CACHE.get(url)
+        if(entry):
+            CACHE_READS.inc('negative' if entry.negative else 'hit')
+            return None if entry.negative else entry.body
+        CACHE_READS.inc('miss')
+        if(CACHE.mode == 'only'):
+            raise Exception(f'get_data 缓存中没有 {url}')
+    result = await RETRY.fetch(SESSION, url, LIMIT, on_retry=retry_log)
+    if(result.status == FetchStatus.Ok):
+        if(CACHE.writable):
+            CACHE.put(url, 200, result.body)
+        return result.body
+    elif(result.status == FetchStatus.NotFound):
+        out('get_data', f'404出现了 {url} {result.error}')
+        if(CACHE.writable):
+            CACHE.put(url, 404, None)
+        return None
     else:
-        return 1
+        out('get_data', f'警告 第{result.attempts}次请求后放弃 {url} {result.error}')
+        raise Exception(f'get_data 放弃 {url}')
 
 
-async def get_data(url: str) -> bytes:
-    """当404网站出现时 该方法会返回None 使用该方法需要判断是否为空"""
-    try:
-        async with SESSION.get(url) as resp:
-            if(resp.status == 200):
-                return await resp.content.read()
-            elif(resp.status == 404):
-                body = await resp.text()
-                out('get_data', f'404出现了 {url} {body}')
-                return None
-            elif(resp.status == 502):
-                body = await resp.text()
-                out('get_data', f'502出现了 {TIME_SLEEP}秒后重试 {url} {body}')
-                time.sleep(TIME_SLEEP)
-                return await get_data(url)
-            else:
-                out('get_data', '警告 捕获到未知异常 下面是当前页面请求体')
-                out('get_data', await resp.text())
-                raise Exception("get_data")
-    # TimeoutError类名与urllib类库的超时异常类重名 这里需要指定
-    except (asyncio.exceptions.TimeoutError, ServerDisconnectedError, ClientConnectorError):
-        out('get_data', f'读取超时 {TIME_SLEEP}秒后重试 {url}')
-        time.sleep(TIME_SLEEP)
-        return await get_data(url)
-
-
-async def read_file(file_name: str) -> str:
-    async with aiofiles.open(file_name) as file:
-        return await file.read()
-
-
-def time_use(start_time: float) -> float:
-    return round(time.time()-start_time, 2)
-
-
-def out(mode: str, desc: any) -> None:
-    print(f"{time.strftime('[%H:%M:%S]', time.localtime())} [{mode}] {desc}")
-
-
-def trim_right(str: str) -> str:
-    """移除该字符串从右往左数第一个'/'右边的字符"""
-    return str[: str.rfind('/')+1]
+def retry_log(url: str, error: str, wait: float) -> None:
+    out('get_data', f'{error} {round(wait, 2)}秒后重试 {url}')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,82 @@
+import asyncio
+import collections
+import random
+import sys
+import time
+import aiohttp
+from AreaBase import out
+
+
+async def sample(session: aiohttp.ClientSession, base: str, limit: int = 2000) -> list[dict]:
+    """从 /areas 开始逐级取下级 收集最多limit个区域作为请求样本"""
+    async with session.get(f'{base}/areas') as resp:
+        level = await resp.json()
+    areas = list(level)
+    while(level and len(areas) < limit):
+        parents = random.sample(level, min(len(level), 20))
+        level = []
+        for p in parents:
+            async with session.get(f"{base}/areas/{p['number']}/children") as resp:
+                level += await resp.json()
+        areas += level
+    return areas[:limit]
+
+
+def paths(areas: list[dict], count: int) -> list[str]:
+    """请求混合 一半查单个区域 三成查下级 两成按名称前缀搜索"""
+    result = []
+    for _ in range(count):
+        area = random.choice(areas)
+        r = random.random()
+        if(r < 0.5):
+            result.append(f"/areas/{area['number']}")
+        elif(r < 0.8):
+            result.append(f"/areas/{area['number']}/children")
+        else:
+            result.append(f"/areas/search?q={area['name'][:random.randint(1, 2)]}")
+    return result
+
+
+async def worker(session: aiohttp.ClientSession, base: str, requests: list[str], deadline: float,
+                 costs: list[float], statuses: collections.Counter) -> None:
+    while(time.perf_counter() < deadline):
+        path = random.choice(requests)
+        start_time = time.perf_counter()
+        try:
+            async with session.get(base + path) as resp:
+                await resp.read()
+                statuses[resp.status] += 1
+        except aiohttp.ClientError as e:
+            statuses[type(e).__name__] += 1
+            continue
+        costs.append(time.perf_counter() - start_time)
+
+
+async def main(base: str, seconds: float, concurrency: int) -> None:
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector, headers={'Accept-Encoding': 'gzip'}) as session:
+        areas = await sample(session, base)
+        requests = paths(areas, 10000)
+        out('loadtest', f'样本{len(areas)}个区域 {len(set(requests))}种请求 并发{concurrency} 持续{seconds}s')
+        costs: list[float] = []
+        statuses: collections.Counter = collections.Counter()
+        start_time = time.perf_counter()
+        deadline = start_time + seconds
+        await asyncio.gather(*[worker(session, base, requests, deadline, costs, statuses)
+                               for _ in range(concurrency)])
+        use = time.perf_counter() - start_time
+    costs.sort()
+    if(not costs):
+        out('loadtest', f'没有成功的请求 {dict(statuses)}')
+        return
+
+    def ms(p: float) -> float:
+        return round(costs[min(len(costs) - 1, int(len(costs) * p))] * 1000, 2)
+    out('loadtest', f'{len(costs)}次请求 QPS {round(len(costs) / use)} '
+        f'p50 {ms(0.5)}ms p90 {ms(0.9)}ms p99 {ms(0.99)}ms max {round(costs[-1] * 1000, 2)}ms 状态 {dict(statuses)}')
+
+
+if __name__ == '__main__':
+    # python AreaLoadTest.py http://127.0.0.1:8080 [秒数] [并发数]  先启动 python AreaServer.py 2021
+    asyncio.run(main(sys.argv[1].rstrip('/'), float(sys.argv[2]) if len(sys.argv) > 2 else 10,
+                     int(sys.argv[3]) if len(sys.argv) > 3 else 50))
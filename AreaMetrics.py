@@ -0,0 +1,175 @@
+import json
+from bisect import bisect_left
+from typing import Callable
+from aiohttp import web
+
+
+class Counter:
+    """只增不减的计数 labels为标签名 inc时按顺序给出标签值"""
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values: dict[tuple[str, ...], float] = {}
+        REGISTRY.append(self)
+
+    def inc(self, *labels: str, value: float = 1) -> None:
+        self.values[labels] = self.values.get(labels, 0) + value
+
+    def total(self) -> float:
+        return sum(self.values.values())
+
+
+class Gauge:
+    """当前值 func不为空时在读取时调用 热路径上不需要做任何事"""
+
+    def __init__(self, name: str, help: str, func: Callable[[], float] = None) -> None:
+        self.name = name
+        self.help = help
+        self.labels = ()
+        self.func = func
+        self.value = 0.0
+        REGISTRY.append(self)
+
+    def inc(self, value: float = 1) -> None:
+        self.value += value
+
+    def dec(self, value: float = 1) -> None:
+        self.value -= value
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    @property
+    def values(self) -> dict[tuple[str, ...], float]:
+        return {(): self.func() if self.func else self.value}
+
+
+class Histogram:
+    """固定桶的直方图 observe只做一次二分和几次加法
+    每组标签值对应 [各桶计数..., 超过最大桶的计数, 总和, 次数]"""
+
+    def __init__(self, name: str, help: str, buckets: tuple[float, ...], labels: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.series: dict[tuple[str, ...], list[float]] = {}
+        REGISTRY.append(self)
+
+    def observe(self, value: float, *labels: str) -> None:
+        s = self.series.get(labels)
+        if(s == None):
+            s = self.series[labels] = [0] * (len(self.buckets) + 3)
+        s[bisect_left(self.buckets, value)] += 1
+        s[-2] += value
+        s[-1] += 1
+
+    def quantile(self, q: float, labels: tuple[str, ...] = ()) -> float:
+        """按桶的上界估计分位数 超过最大桶时返回inf"""
+        s = self.series.get(labels)
+        if(not s or not s[-1]):
+            return None
+        rank = q * s[-1]
+        seen = 0
+        for i, bound in enumerate(self.buckets):
+            seen += s[i]
+            if(seen >= rank):
+                return bound
+        return float('inf')
+
+
+# 所有指标 按定义顺序输出
+REGISTRY: list[Counter | Gauge | Histogram] = []
+# 秒 5ms到30s
+LATENCY_BUCKETS: tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# 秒 解析一个页面 0.05ms到0.5s
+PARSE_BUCKETS: tuple[float, ...] = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05, 0.5)
+# 行数 每次写库
+ROW_BUCKETS: tuple[float, ...] = (10, 100, 1000, 5000, 10000, 20000, 50000, 100000)
+
+HTTP_RESPONSES = Counter('area_http_responses_total', 'HTTP响应数 按状态码或异常类型', ('status',))
+HTTP_SECONDS = Histogram('area_http_seconds', '单次HTTP请求耗时 不含排队和重试等待', LATENCY_BUCKETS)
+HTTP_RETRIES = Counter('area_http_retries_total', '重试次数 按原因', ('reason',))
+HTTP_INFLIGHT = Gauge('area_http_inflight', '正在进行的HTTP请求数')
+HTTP_WINDOW = Gauge('area_http_window', '自适应并发窗口 未开启时为Concurrency')
+HTTP_BACKOFFS = Counter('area_http_backoffs_total', '并发窗口减小次数 按原因', ('reason',))
+CACHE_READS = Counter('area_cache_reads_total', '页面缓存读取 hit/negative/miss', ('result',))
+PARSE_SECONDS = Histogram('area_parse_seconds', '页面解析耗时 按区划等级', PARSE_BUCKETS, ('type',))
+ROWS_BUILT = Counter('area_rows_built_total', '构建的数据行数 按区划等级', ('type',))
+CRAWL_QUEUE = Gauge('area_crawl_queue', '工作队列中待爬取的页面数')
+WRITER_QUEUE = Gauge('area_writer_queue', '写库队列中的批次数')
+FLUSH_ROWS = Histogram('area_flush_rows', '每次写库的行数', ROW_BUCKETS)
+FLUSH_SECONDS = Histogram('area_flush_seconds', '每次写库的耗时', LATENCY_BUCKETS)
+
+
+def label_text(names: tuple[str, ...], values: tuple[str, ...], extra: str = '') -> str:
+    items = [f'{k}="{v}"' for k, v in zip(names, values)]
+    if(extra):
+        items.append(extra)
+    return '{' + ','.join(items) + '}' if items else ''
+
+
+def prometheus() -> str:
+    """Prometheus文本格式"""
+    lines = []
+    for m in REGISTRY:
+        lines.append(f'# HELP {m.name} {m.help}')
+        if(isinstance(m, Histogram)):
+            lines.append(f'# TYPE {m.name} histogram')
+            for labels, s in m.series.items():
+                seen = 0
+                for bound, count in zip((*m.buckets, '+Inf'), s):
+                    seen += count
+                    le = f'le="{bound}"'
+                    lines.append(f'{m.name}_bucket{label_text(m.labels, labels, le)} {seen}')
+                lines.append(f'{m.name}_sum{label_text(m.labels, labels)} {s[-2]}')
+                lines.append(f'{m.name}_count{label_text(m.labels, labels)} {s[-1]}')
+        else:
+            lines.append(f'# TYPE {m.name} {"counter" if isinstance(m, Counter) else "gauge"}')
+            for labels, value in m.values.items():
+                lines.append(f'{m.name}{label_text(m.labels, labels)} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def snapshot() -> dict:
+    """JSON格式 直方图给出次数 平均值和估计的p50 p99"""
+    result = {}
+    for m in REGISTRY:
+        if(isinstance(m, Histogram)):
+            result[m.name] = {','.join(labels): {'count': s[-1], 'sum': s[-2], 'mean': s[-2] / s[-1] if s[-1] else None,
+                                                 'p50': m.quantile(0.5, labels), 'p99': m.quantile(0.99, labels)}
+                              for labels, s in m.series.items()}
+        else:
+            result[m.name] = {','.join(labels): value for labels, value in m.values.items()}
+    return result
+
+
+def summary() -> list[str]:
+    """程序结束时输出的汇总 每个指标一行 没有数据的不输出"""
+    lines = []
+    for m in REGISTRY:
+        if(isinstance(m, Histogram)):
+            for labels, s in m.series.items():
+                name = f'{m.name}{label_text(m.labels, labels)}'
+                lines.append(f'{name} 次数{s[-1]} 平均{s[-2] / s[-1]:.6g} '
+                             f'p50≤{m.quantile(0.5, labels)} p99≤{m.quantile(0.99, labels)}')
+        elif(isinstance(m, Counter) and m.values):
+            lines.append(f'{m.name} ' + ' '.join(f'{",".join(k) or "total"}={v:g}' for k, v in m.values.items()))
+    return lines
+
+
+async def serve(host: str, port: int) -> web.AppRunner:
+    """/metrics为Prometheus文本 /metrics.json为JSON"""
+    async def text(request: web.Request) -> web.Response:
+        return web.Response(text=prometheus(), content_type='text/plain', charset='utf-8')
+
+    async def data(request: web.Request) -> web.Response:
+        return web.json_response(snapshot(), dumps=lambda v: json.dumps(v, ensure_ascii=False))
+    app = web.Application()
+    app.add_routes([web.get('/metrics', text), web.get('/metrics.json', data)])
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -0,0 +1,146 @@
+import html
+import re
+import sys
+import time
+from bs4 import BeautifulSoup
+from AreaBase import AreaType, out
+
+
+# 一行数据: (单元格文本, 下级页面链接) 省级的单元格只有名称 没有下级链接时为None
+Row = tuple[tuple[str, ...], str]
+# 行的css类名与区划等级 顺序即判断的优先级
+ROW_CLASS: dict[str, AreaType] = {
+    'villagetr': AreaType.Village,
+    'towntr': AreaType.Town,
+    'countytr': AreaType.Country,
+    'citytr': AreaType.City,
+    'provincetr': AreaType.Province}
+
+# tr的开始和结束标签 由table_rows配对 排版用的外层tr里面还有整张数据表格 不能用非贪婪匹配取内容
+RE_TR = re.compile(r'<(/?)tr\b([^>]*)>', re.I)
+RE_TD = re.compile(r'<td\b[^>]*>(.*?)</td\s*>', re.S | re.I)
+RE_A = re.compile(r'<a\b([^>]*)>(.*?)</a\s*>', re.S | re.I)
+RE_CLASS = re.compile(r'''\bclass\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))''', re.I)
+RE_HREF = re.compile(r'''\bhref\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))''', re.I)
+RE_TAG = re.compile(r'<[^>]*>')
+# 页面正常但没有下级数据的标记 2014 2015年大胡同街道
+RE_EMPTY = re.compile(r'''<(?:a|table)\b[^>]*\bclass\s*=\s*["']?[^"'>]*\b(?:STYLE3|villagetable)\b''')
+
+
+def extract(body: bytes, backend: str = 'fast') -> tuple[AreaType, list[Row]]:
+    """从页面中抽取区划等级和所有数据行
+    页面正常但没有数据时返回None 不是区划页面时抛出异常"""
+    return BACKENDS[backend](body)
+
+
+def extract_fast(body: bytes) -> tuple[AreaType, list[Row]]:
+    """一次gb18030解码 一遍正则扫描所有tr 不构建dom树"""
+    text = body.decode('gb18030', errors='replace')
+    found: dict[str, list[str]] = {}
+    for attrs, inner in table_rows(text):
+        m = RE_CLASS.search(attrs)
+        if(m):
+            for name in (m.group(1) or m.group(2) or m.group(3)).split():
+                if(name in ROW_CLASS):
+                    found.setdefault(name, []).append(inner)
+    for name, type in ROW_CLASS.items():
+        trs = found.get(name)
+        if(not trs):
+            continue
+        if(type == AreaType.Province):
+            rows = [((inner_text(a.group(2)),), attr(RE_HREF, a.group(1)))
+                    for tr in trs for a in RE_A.finditer(tr)]
+            if(not rows):
+                continue
+            return (type, rows)
+        rows = []
+        for tr in trs:
+            tds = RE_TD.findall(tr)
+            a = RE_A.search(tds[0]) if tds else None
+            rows.append((tuple(inner_text(td) for td in tds),
+                         attr(RE_HREF, a.group(1)) if a else None))
+        return (type, rows)
+    if(RE_EMPTY.search(text)):
+        return None
+    raise ValueError(f'捕获到异常数据 {text}')
+
+
+def table_rows(text: str) -> list[tuple[str, str]]:
+    """所有tr的 (属性, 内容) 按开始标签的顺序 与bs4的select一致
+    开始和结束标签按嵌套配对 外层tr的内容包含内层的tr 没有结束标签的tr忽略"""
+    rows: list[tuple[str, str]] = []
+    stack: list[tuple[int, str, int]] = []
+    for m in RE_TR.finditer(text):
+        if(m.group(1)):
+            if(stack):
+                start, attrs, index = stack.pop()
+                rows[index] = (attrs, text[start:m.start()])
+        else:
+            stack.append((m.end(), m.group(2), len(rows)))
+            rows.append(None)
+    return [r for r in rows if r]
+
+
+def extract_bs4(body: bytes) -> tuple[AreaType, list[Row]]:
+    """BeautifulSoup参考实现 与extract_fast的结果必须完全一致"""
+    page = BeautifulSoup(body, 'html.parser', from_encoding='gb18030')
+    for name, type in ROW_CLASS.items():
+        if(type == AreaType.Province):
+            rows = [((a.text,), a.attrs.get('href'))
+                    for a in page.select(f'tr.{name} a')]
+        else:
+            rows = []
+            for tr in page.select(f'tr.{name}'):
+                tds = tr.find_all('td')
+                a = tds[0].find('a') if tds else None
+                rows.append((tuple(td.text for td in tds),
+                             a.attrs.get('href') if a else None))
+        if(rows):
+            return (type, rows)
+    if(page.select('a.STYLE3') or page.select('table.villagetable')):
+        return None
+    raise ValueError(f'捕获到异常数据 {page.prettify()}')
+
+
+def inner_text(fragment: str) -> str:
+    """去掉标签后还原实体 与bs4的.text一致"""
+    return html.unescape(RE_TAG.sub('', fragment))
+
+
+def attr(pattern: re.Pattern, attrs: str) -> str:
+    m = pattern.search(attrs)
+    if(m == None):
+        return None
+    return html.unescape(m.group(1) or m.group(2) or m.group(3))
+
+
+BACKENDS = {'fast': extract_fast, 'bs4': extract_bs4}
+
+
+def conformance(files: list[str]) -> bool:
+    """用保存下来的页面比对各后端的抽取结果 并输出各自的耗时"""
+    ok = True
+    cost = {k: 0.0 for k in BACKENDS}
+    for file in files:
+        with open(file, 'rb') as f:
+            body = f.read()
+        results = {}
+        for k, func in BACKENDS.items():
+            start_time = time.perf_counter()
+            try:
+                results[k] = func(body)
+            except ValueError:
+                results[k] = ValueError
+            cost[k] += time.perf_counter() - start_time
+        if(len(set(map(repr, results.values()))) != 1):
+            ok = False
+            out('conformance', f'结果不一致 {file}')
+    for k, v in cost.items():
+        out('conformance', f'{k} 共{len(files)}个页面 耗时{round(v * 1000, 2)}ms')
+    out('conformance', '全部一致' if ok else '存在不一致的页面')
+    return ok
+
+
+if __name__ == '__main__':
+    # python AreaParser.py 页面1.html 页面2.html ...
+    sys.exit(0 if conformance(sys.argv[1:]) else 1)
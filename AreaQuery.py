@@ -0,0 +1,86 @@
+import asyncio
+import json
+import random
+import sys
+import time
+import asyncpg
+from AreaBase import level_of, level_range, out, read_file
+
+
+COLUMNS: str = 'id, number, name, full_name, type, level, parents_id'
+# id范围查询 走(year, id)索引的范围扫描
+RANGE_SQL: str = f"""select {COLUMNS} from area_info
+                     where year = $1 and id >= $2 and id < $3 and level = $4 order by id"""
+# 原先的数组包含查询 只有建了GIN索引才能走索引
+CONTAINS_SQL: str = f"""select {COLUMNS} from area_info
+                        where year = $1 and parents_id @> array[$2::int8] and level = $3 order by id"""
+GIN_SQL: str = 'create index if not exists area_info_parents_id on area_info using gin (parents_id)'
+
+
+async def descendants(conn: asyncpg.Connection, id: int, year: int, level: int = None) -> list[asyncpg.Record]:
+    """id在year年第level级的所有后代 level为空时为直接下级 id为None时为全国"""
+    if(level == None):
+        level = 1 if id == None else level_of(id) + 1
+    lo, hi = level_range(id, level)
+    return await conn.fetch(RANGE_SQL, year, lo, hi, level)
+
+
+async def children(conn: asyncpg.Connection, id: int, year: int) -> list[asyncpg.Record]:
+    return await descendants(conn, id, year)
+
+
+async def bench(conn: asyncpg.Connection, year: int, loop: int) -> None:
+    """随机挑选市和县 比较id范围查询与parents_id数组包含查询的耗时"""
+    parents = await conn.fetch('select id, level from area_info where year = $1 and level in (2, 3)', year)
+    if(not parents):
+        out('bench', f'{year}年没有数据')
+        return
+    sample = [random.choice(parents) for _ in range(loop)]
+    for name, query in [('range', lambda p: conn.fetch(RANGE_SQL, year, *level_range(p['id'], 5), 5)),
+                        ('contains', lambda p: conn.fetch(CONTAINS_SQL, year, p['id'], 5))]:
+        costs = []
+        rows = 0
+        for p in sample:
+            start_time = time.perf_counter()
+            rows += len(await query(p))
+            costs.append(time.perf_counter() - start_time)
+        costs.sort()
+        out('bench', f'{name} 平均{round(sum(costs) / loop * 1000, 2)}ms '
+            f'p50 {round(costs[loop // 2] * 1000, 2)}ms p99 {round(costs[int(loop * 0.99)] * 1000, 2)}ms 平均{rows // loop}行')
+    p = sample[0]
+    for name, sql, args in [('range', RANGE_SQL, (year, *level_range(p['id'], 5), 5)),
+                            ('contains', CONTAINS_SQL, (year, p['id'], 5))]:
+        plan = await conn.fetch(f'explain {sql}', *args)
+        out('bench', f'{name} 执行计划 ' + ' | '.join(r[0].strip() for r in plan))
+
+
+async def main(args: list[str]) -> int:
+    config = json.loads(await read_file('config.json'))
+    conn = await asyncpg.connect(config['ODBC'])
+    try:
+        if(args[0] == 'gin'):
+            await conn.execute(GIN_SQL)
+            out('main', 'parents_id的GIN索引创建完成')
+        elif(args[0] == 'bench'):
+            await conn.execute('analyze area_info')
+            await bench(conn, int(args[1]), int(args[2]) if len(args) > 2 else 200)
+        else:
+            year, code = int(args[0]), args[1]
+            area = await conn.fetchrow('select id from area_info where year = $1 and number = $2', year, code)
+            if(area == None):
+                out('main', f'{year}年没有区划代码{code}')
+                return 1
+            level = int(args[2]) if len(args) > 2 else None
+            for r in await descendants(conn, area['id'], year, level):
+                out('main', f"{r['number']} {r['full_name']}")
+    finally:
+        await conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    # python AreaQuery.py 2021 110101000000 [level]  子树查询
+    # python AreaQuery.py bench 2021 [次数]           与parents_id包含查询对比
+    # python AreaQuery.py gin                         可选 为parents_id建GIN索引
+    # 区划代码不存在时退出码为1
+    sys.exit(asyncio.run(main(sys.argv[1:])))
@@ -0,0 +1,326 @@
+import array
+import asyncio
+import collections
+import json
+import multiprocessing
+import re
+import sys
+import time
+from bisect import bisect_left, bisect_right
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Iterable, Iterator, NamedTuple, TextIO
+from AreaBase import LEVEL_VALUES, level_of, out, read_file
+from AreaIndex import AreaIndex, load
+
+
+# 不能单独说明位置的名称 不作为匹配模式
+SKIP_NAMES: set[str] = {'市辖区', '县', '省直辖县级行政区划', '自治区直辖县级行政区划'}
+# 去掉后仍能识别的后缀 长的在前
+SUFFIXES: tuple[str, ...] = ('特别行政区', '街道办事处', '自治区', '自治州', '自治县', '自治旗',
+                             '街道', '地区', '省', '市', '区', '县', '旗', '盟', '镇', '乡')
+# 自治地方去掉民族名称 如 恩施土家族苗族自治州 => 恩施
+ETHNIC: re.Pattern = re.compile(r'^(.{2,}?)(?:.{1,5}?族)+自治[区州县旗]$')
+# 村级名称在地址中的常见写法
+VILLAGE_ALIASES: list[tuple[str, str]] = [('社区居民委员会', '社区'), ('村民委员会', '村'),
+                                          ('居民委员会', '社区'), ('社区居委会', '社区'),
+                                          ('村委会', '村'), ('居委会', '社区')]
+# 名称只对应不超过这么多个区域时 可以不依赖上级单独作为匹配的起点
+ROOT_LIMIT: int = 16
+
+
+class Resolved(NamedTuple):
+    id: int
+    number: str
+    level: int
+    # 匹配到的字符数
+    score: int
+    # 存在得分相同的其他区域
+    ambiguous: bool
+
+
+class Automaton:
+    """Aho-Corasick多模式匹配 一次扫描找出文本中出现的所有模式
+    goto[node]为 字符 => 下一节点 fail[node]为失配后跳转的节点
+    out[node]为在该节点结束的所有模式(已合并fail链上的输出)"""
+
+    def __init__(self) -> None:
+        self.goto: list[dict[str, int]] = [{}]
+        self.fail: list[int] = [0]
+        self.out: list[tuple[int, ...]] = [()]
+
+    def add(self, word: str, value: int) -> None:
+        node = 0
+        for ch in word:
+            next = self.goto[node].get(ch)
+            if(next == None):
+                next = len(self.goto)
+                self.goto[node][ch] = next
+                self.goto.append({})
+                self.fail.append(0)
+                self.out.append(())
+            node = next
+        self.out[node] += (value,)
+
+    def build(self) -> None:
+        """按层次遍历计算fail"""
+        queue = list(self.goto[0].values())
+        for node in queue:
+            for ch, child in self.goto[node].items():
+                f = self.fail[node]
+                while(f and ch not in self.goto[f]):
+                    f = self.fail[f]
+                f = self.goto[f].get(ch, 0)
+                self.fail[child] = f
+                self.out[child] += self.out[f]
+                queue.append(child)
+
+    def find(self, text: str) -> list[tuple[int, int]]:
+        """返回 (结束位置, 模式) 结束位置为模式最后一个字符的下一位"""
+        goto, fail, output = self.goto, self.fail, self.out
+        result = []
+        node = 0
+        for pos, ch in enumerate(text, 1):
+            while(node and ch not in goto[node]):
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if(output[node]):
+                for value in output[node]:
+                    result.append((pos, value))
+        return result
+
+
+class AreaResolver:
+    """自由文本地址 => 区划代码和id
+    省市县乡四级的名称及其简称建一个Aho-Corasick自动机 每个模式对应同名区域的id(升序)
+    按出现顺序把匹配串成祖先 => 后代的链 后一个区域必须在前一个区域的子树中 即id在 (祖先id, 祖先id + 区间) 内
+    链的得分为匹配到的字符数 取得分最高的链的最后一个区域 再在它的子树中查找后面文本里的村级名称
+    村级名称有60多万个且大量重名 不进自动机 只在确定了县或乡之后按名称查字典"""
+
+    def __init__(self, index: AreaIndex) -> None:
+        self.index = index
+        self.automaton = Automaton()
+        # 模式 => 长度和同名区域的id
+        self.pattern_len: list[int] = []
+        self.pattern_ids: list[array.array] = []
+        patterns: dict[str, list[int]] = {}
+        # 村级名称 => 同名村的id 只有一个时直接存id
+        self.villages: dict[str, int | array.array] = {}
+        village_lens: set[int] = set()
+        # 村级名称的前两个字 大部分位置查一次集合就能跳过
+        self.village_heads: set[str] = set()
+        for i in range(len(index)):
+            name, id = index.name(i), index.ids[i]
+            if(index.levels[i] == 5):
+                for alias in village_aliases(name):
+                    ids = self.villages.get(alias)
+                    if(ids == None):
+                        self.villages[alias] = id
+                    elif(isinstance(ids, int)):
+                        self.villages[alias] = array.array('q', [ids, id])
+                    elif(ids[-1] != id):
+                        ids.append(id)
+                    village_lens.add(len(alias))
+                    self.village_heads.add(alias[:2])
+            elif(name not in SKIP_NAMES):
+                for alias in aliases(name):
+                    ids = patterns.setdefault(alias, [])
+                    if(not ids or ids[-1] != id):
+                        ids.append(id)
+        for word, ids in patterns.items():
+            self.automaton.add(word, len(self.pattern_len))
+            self.pattern_len.append(len(word))
+            self.pattern_ids.append(array.array('q', ids))
+        self.automaton.build()
+        # 村级名称的长度 从长到短尝试
+        self.village_lens = sorted(village_lens, reverse=True)
+
+    def resolve(self, text: str) -> Resolved:
+        """无法识别时返回None"""
+        pattern_len, pattern_ids = self.pattern_len, self.pattern_ids
+        # 链的最后一个区域id => (得分, 结束位置)
+        chains: dict[int, tuple[int, int]] = {}
+        get = chains.get
+        for end, p in self.automaton.find(text):
+            length = pattern_len[p]
+            start = end - length
+            ids = pattern_ids[p]
+            if(len(ids) <= ROOT_LIMIT):
+                # 同名区域不多 逐个由id算出祖先 接在得分最高的祖先链后面 没有时作为新链的起点
+                # 同一个匹配的区域之间结束位置相同 不会互相接上 可以直接写入chains
+                for id in ids:
+                    score = 0
+                    low = id & -id
+                    for value in LEVEL_VALUES:
+                        if(value <= low):
+                            break
+                        chain = get(id - id % value)
+                        if(chain != None and chain[1] <= start and chain[0] > score):
+                            score = chain[0]
+                    score += length
+                    chain = get(id)
+                    if(chain == None or chain[0] < score):
+                        chains[id] = (score, end)
+                continue
+            # 常见的名称 只取已有链的子树中的区域 ids升序 子树内的是连续的一段
+            found: dict[int, int] = {}
+            for parent, (score, parent_end) in chains.items():
+                if(parent_end > start):
+                    continue
+                a = bisect_right(ids, parent)
+                b = bisect_left(ids, parent + LEVEL_VALUES[level_of(parent) - 1], a)
+                for k in range(a, b):
+                    if(found.get(ids[k], 0) < score + length):
+                        found[ids[k]] = score + length
+            for id, score in found.items():
+                chain = get(id)
+                if(chain == None or chain[0] < score):
+                    chains[id] = (score, end)
+        if(not chains):
+            return None
+        # 得分最高 同分时取级别更深的
+        id, (score, end) = max(chains.items(), key=lambda c: (c[1][0], -(c[0] & -c[0]), -c[0]))
+        ambiguous = sum(1 for c in chains.values() if c[0] == score) > 1
+        lv = level_of(id)
+        if(lv >= 3):
+            village = self.village(text, end, id, id + LEVEL_VALUES[lv - 1])
+            if(village != None):
+                id, score, lv = village[0], score + village[1], 5
+        i = self.index.position(id)
+        return Resolved(id, str(self.index.numbers[i]).zfill(12), lv, score, ambiguous)
+
+    def village(self, text: str, start: int, lo: int, hi: int) -> tuple[int, int]:
+        """在start之后的文本中找 (lo, hi) 子树内的村级名称 从左往右 同一位置先试长的 返回 (id, 名称长度)"""
+        villages, heads = self.villages, self.village_heads
+        for pos in range(start, len(text) - 1):
+            if(text[pos: pos + 2] not in heads):
+                continue
+            for length in self.village_lens:
+                if(pos + length > len(text)):
+                    continue
+                ids = villages.get(text[pos: pos + length])
+                if(ids == None):
+                    continue
+                if(isinstance(ids, int)):
+                    if(lo < ids < hi):
+                        return (ids, length)
+                    continue
+                k = bisect_right(ids, lo)
+                if(k < len(ids) and ids[k] < hi):
+                    return (ids[k], length)
+        return None
+
+    def resolve_many(self, texts: Iterable[str]) -> list[Resolved]:
+        """批量解析 同一批中重复的地址只解析一次"""
+        done: dict[str, Resolved] = {}
+        result = []
+        for text in texts:
+            if(text in done):
+                result.append(done[text])
+            else:
+                result.append(done.setdefault(text, self.resolve(text)))
+        return result
+
+    def resolve_file(self, src: TextIO, dst: TextIO, batch: int = 10000, workers: int = 0) -> int:
+        """每行一个地址 输出 地址\t区划代码\tid\tlevel 无法识别时后三列为空 返回处理的行数
+        workers大于0时fork出多个进程 每个进程解析一批 输出顺序与输入一致 最多同时有2倍进程数的批次在处理"""
+        count = 0
+        if(workers <= 0):
+            for lines in batches(src, batch):
+                dst.write(self.format(lines))
+                count += len(lines)
+            return count
+        global WORKER
+        WORKER = self
+        context = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(workers, mp_context=context) as pool:
+            pending: collections.deque[Future] = collections.deque()
+            for lines in batches(src, batch):
+                pending.append(pool.submit(resolve_lines, lines))
+                count += len(lines)
+                if(len(pending) >= workers * 2):
+                    dst.write(pending.popleft().result())
+            while(pending):
+                dst.write(pending.popleft().result())
+        return count
+
+    def format(self, lines: list[str]) -> str:
+        buffer = []
+        for text, r in zip(lines, self.resolve_many(lines)):
+            if(r == None):
+                buffer.append(f'{text}\t\t\t\n')
+            else:
+                buffer.append(f'{text}\t{r.number}\t{r.id}\t{r.level}\n')
+        return ''.join(buffer)
+
+
+# 多进程文件模式中 子进程fork时继承的解析器
+WORKER: AreaResolver = None
+
+
+def resolve_lines(lines: list[str]) -> str:
+    return WORKER.format(lines)
+
+
+def batches(src: TextIO, batch: int) -> Iterator[list[str]]:
+    lines: list[str] = []
+    for line in src:
+        lines.append(line.rstrip('\r\n'))
+        if(len(lines) >= batch):
+            yield lines
+            lines = []
+    if(lines):
+        yield lines
+
+
+def aliases(name: str) -> set[str]:
+    """名称本身以及去掉后缀 民族名称后的简称 简称至少两个字"""
+    result = {name}
+    m = ETHNIC.match(name)
+    if(m):
+        result.add(m.group(1))
+        if(name[-1] != '区'):
+            # 恩施州 临夏州
+            result.add(m.group(1) + name[-1])
+    for suffix in SUFFIXES:
+        if(name.endswith(suffix) and len(name) - len(suffix) >= 2):
+            result.add(name[: -len(suffix)])
+            break
+    return result
+
+
+def village_aliases(name: str) -> set[str]:
+    result = {name}
+    for full, short in VILLAGE_ALIASES:
+        if(name.endswith(full) and len(name) > len(full)):
+            result.add(name[: -len(full)] + short)
+            break
+    return result
+
+
+async def main(year: int, args: list[str]) -> None:
+    config = json.loads(await read_file('config.json'))
+    index = await load(config, year)
+    start_time = time.time()
+    resolver = AreaResolver(index)
+    out('main', f'{year}年 {len(resolver.pattern_len)}个模式 '
+        f'{len(resolver.villages)}个村级名称 建立耗时{round(time.time() - start_time, 2)}s')
+    if(not args):
+        for line in sys.stdin:
+            r = resolver.resolve(line.strip())
+            out('main', r and f'{r} {index.full_name(r.id)}')
+        return
+    workers = int(args[2]) if len(args) > 2 else 0
+    start_time = time.perf_counter()
+    with open(args[0], encoding='utf-8') as src:
+        if(len(args) > 1 and args[1] != '-'):
+            with open(args[1], 'w', encoding='utf-8', newline='\n') as dst:
+                count = resolver.resolve_file(src, dst, workers=workers)
+        else:
+            count = resolver.resolve_file(src, sys.stdout, workers=workers)
+    use = time.perf_counter() - start_time
+    out('main', f'共{count}行 {max(workers, 1)}个进程 耗时{round(use, 2)}s {round(count / use)}条/s')
+
+if __name__ == '__main__':
+    # python AreaResolver.py 2021                                 从标准输入逐行解析
+    # python AreaResolver.py 2021 地址.txt [结果.tsv|-] [进程数]  文件模式 每行一个地址
+    asyncio.run(main(int(sys.argv[1]), sys.argv[2:]))
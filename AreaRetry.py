@@ -0,0 +1,134 @@
+import asyncio
+import contextlib
+import enum
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Callable, NamedTuple
+from aiohttp import ClientSession, ClientError
+from AreaCongestion import AdaptiveLimit
+from AreaMetrics import HTTP_INFLIGHT, HTTP_RESPONSES, HTTP_RETRIES, HTTP_SECONDS
+
+
+class FetchStatus(enum.Enum):
+    """请求的最终结果"""
+    Ok = 1
+    NotFound = 2
+    GaveUp = 3
+
+
+class FetchResult(NamedTuple):
+    status: FetchStatus
+    body: bytes
+    # 本次请求一共尝试的次数
+    attempts: int
+    # 最后一次失败的原因 成功时为None
+    error: str
+
+
+class RetryPolicy:
+    """重试策略 取代原先的time.sleep加无限递归
+    异步休眠不会阻塞事件循环 指数退避加全抖动 最大重试次数
+    支持服务端的Retry-After 同一个url累计失败超过预算后直接放弃"""
+
+    def __init__(self,
+                 max_attempts: int = 10,
+                 base_delay: float = 0.5,
+                 max_delay: float = 30,
+                 url_budget: int = 20,
+                 retry_status: tuple[int, ...] = (429, 500, 502, 503, 504)) -> None:
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.url_budget = url_budget
+        self.retry_status = retry_status
+        # 每个url的累计失败次数 跨多次fetch调用保留
+        self.failures: dict[str, int] = {}
+
+    @classmethod
+    def from_config(cls, config: dict) -> 'RetryPolicy':
+        """从config.json的Retry节点创建 缺省的项使用默认值"""
+        keys = {'MaxAttempts': 'max_attempts', 'BaseDelay': 'base_delay',
+                'MaxDelay': 'max_delay', 'UrlBudget': 'url_budget'}
+        return cls(**{v: config[k] for k, v in keys.items() if k in config})
+
+    def delay(self, attempt: int, retry_after: float = None) -> float:
+        """第attempt次失败后的等待秒数 全抖动: [0, base * 2^(attempt-1)]
+        服务端给出Retry-After时以它为下限 都不超过max_delay"""
+        ceiling = min(self.max_delay, self.base_delay * (1 << (attempt - 1)))
+        wait = random.uniform(0, ceiling)
+        if(retry_after != None):
+            wait = max(wait, retry_after)
+        return min(wait, self.max_delay)
+
+    def fail(self, url: str) -> bool:
+        """记录一次失败 返回该url是否还有失败预算"""
+        count = self.failures.get(url, 0) + 1
+        self.failures[url] = count
+        return count < self.url_budget
+
+    async def fetch(self,
+                    session: ClientSession,
+                    url: str,
+                    limit: asyncio.Semaphore | AdaptiveLimit = None,
+                    on_retry: Callable[[str, str, float], None] = None) -> FetchResult:
+        """带重试的get请求 limit为并发限制 只在真正发请求时占用 休眠时释放
+        limit为AdaptiveLimit时使用它给出的超时 并把每次请求的耗时和结果反馈给它
+        on_retry(url, 原因, 等待秒数)在每次重试前回调 便于调用方输出日志"""
+        attempt = 0
+        adaptive = isinstance(limit, AdaptiveLimit)
+        while True:
+            attempt += 1
+            retry_after = None
+            async with limit or contextlib.nullcontext() as epoch:
+                # 耗时从拿到并发许可开始算 不含排队
+                HTTP_INFLIGHT.inc()
+                start_time = time.perf_counter()
+                # 拥塞的原因 正常响应时为None
+                congested = None
+                options = {'timeout': limit.timeout()} if adaptive else {}
+                try:
+                    async with session.get(url, **options) as resp:
+                        reason = str(resp.status)
+                        HTTP_RESPONSES.inc(reason)
+                        if(resp.status == 200):
+                            return FetchResult(FetchStatus.Ok, await resp.content.read(), attempt, None)
+                        elif(resp.status == 404):
+                            return FetchResult(FetchStatus.NotFound, None, attempt, await resp.text(errors='replace'))
+                        error = f'{resp.status} {await resp.text(errors="replace")}'
+                        if(resp.status not in self.retry_status):
+                            return FetchResult(FetchStatus.GaveUp, None, attempt, error)
+                        congested = reason
+                        retry_after = parse_retry_after(resp.headers.get('Retry-After'))
+                # TimeoutError类名与urllib类库的超时异常类重名 这里需要指定
+                except (asyncio.exceptions.TimeoutError, ClientError) as e:
+                    reason = congested = type(e).__name__
+                    HTTP_RESPONSES.inc(reason)
+                    error = f'{reason} {e}'
+                finally:
+                    seconds = time.perf_counter() - start_time
+                    HTTP_INFLIGHT.dec()
+                    HTTP_SECONDS.observe(seconds)
+                    if(adaptive):
+                        limit.feedback(epoch, seconds, congested)
+            if(not self.fail(url) or attempt >= self.max_attempts):
+                return FetchResult(FetchStatus.GaveUp, None, attempt, error)
+            HTTP_RETRIES.inc(reason)
+            wait = self.delay(attempt, retry_after)
+            if(on_retry):
+                on_retry(url, error, wait)
+            await asyncio.sleep(wait)
+
+
+def parse_retry_after(value: str) -> float:
+    """Retry-After可能是秒数 也可能是HTTP日期 无法解析时返回None"""
+    if(not value):
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
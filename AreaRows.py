@@ -0,0 +1,51 @@
+import sys
+from array import array
+from typing import Iterator
+from AreaBase import ancestors_of
+
+
+class RowBlock:
+    """一个页面的数据 按列存放 取代每行一个9元组
+    id 区划代码 城乡分类代码放在定长array中 区划代码为12位数字 存为整数
+    名称intern 同名的村 居委会只存一份
+    年份 发布日期 级别 父级全称 parents_id一个页面只存一份 parents_id由父级id计算
+    full_name和行元组在写库时才由__iter__生成 写完即可回收"""
+
+    __slots__ = ('year', 'release_date', 'level', 'parent_id', 'parent_full_name',
+                 'ids', 'numbers', 'names', 'types')
+
+    def __init__(self, year: int, release_date: str, level: int, parent_id: int = None,
+                 parent_full_name: str = '') -> None:
+        self.year = year
+        self.release_date = release_date
+        self.level = level
+        # 省级页面为None
+        self.parent_id = parent_id
+        self.parent_full_name = parent_full_name
+        self.ids = array('q')
+        self.numbers = array('q')
+        self.names: list[str] = []
+        # 城乡分类代码 只有村级有 0表示没有
+        self.types = array('h')
+
+    def append(self, id: int, number: str, name: str, type: int = None) -> None:
+        if(len(number) != 12 or not number.isdigit()):
+            raise ValueError(f'区划代码不是12位数字 {number} {name}')
+        self.ids.append(id)
+        self.numbers.append(int(number))
+        self.names.append(sys.intern(name))
+        self.types.append(type or 0)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __iter__(self) -> Iterator[tuple[int, str, str, str, int, int, int, list[int], str]]:
+        """逐行生成 (id, number, name, full_name, type, level, year, parents_id, release_date)
+        与原先build_data构建的行一致 同一页面的行共用一个parents_id列表"""
+        if(self.parent_id == None):
+            parents, prefix = [], ''
+        else:
+            parents, prefix = ancestors_of(self.parent_id) + [self.parent_id], self.parent_full_name + '/'
+        for id, number, name, type in zip(self.ids, self.numbers, self.names, self.types):
+            yield (id, f'{number:012d}', name, prefix + name, type or None,
+                   self.level, self.year, parents, self.release_date)
@@ -0,0 +1,265 @@
+import array
+import asyncio
+import json
+import random
+import sys
+import time
+from bisect import bisect_left
+from typing import Callable
+from AreaBase import out, read_file
+from AreaIndex import Area, AreaIndex, load
+
+# 拼音首字母是可选功能 没有安装pypinyin时不建首字母索引
+try:
+    from pypinyin import Style, lazy_pinyin
+except ImportError:
+    lazy_pinyin = None
+
+
+# 名称相等 名称前缀 名称包含 排序时依次靠后
+EXACT, PREFIX, CONTAINS = 0, 1, 2
+# 一级中前缀候选最多检查的行数 超过后只取名称排序靠前的部分
+PREFIX_SCAN: int = 2000
+# 补足top-k时包含查询最多检查的候选数 常用字组成的长查询也有确定的耗时上限
+CONTAINS_SCAN: int = 3000
+# 范围内的行数不超过该值时直接扫描整个子树
+SCOPE_SCAN: int = 4000
+# 名称排序时放在所有字符之后 用于求前缀区间的结束位置
+MAX_CHAR: str = '\U0010ffff'
+
+
+class AreaSearch:
+    """地址自动补全的名称搜索 建立在AreaIndex之上
+    每一级按名称排序一份行号 前缀查询是一次二分加顺序扫描
+    名称中的单字和双字建倒排表 表内按 (级别, id) 排序 用于包含查询和限定范围的查询
+    安装了pypinyin时 每一级再按拼音首字母排序一份 查询全是字母时按首字母前缀匹配
+
+    结果按 (相等/前缀/包含, 级别, 名称长度, id) 排序 省市县排在乡村前面
+    查询中用空格或/分隔时 最后一段匹配名称 前面各段必须出现在祖先的名称中 如 "北京 朝阳"
+    scope为祖先id 只返回该区域的后代"""
+
+    def __init__(self, index: AreaIndex, pinyin: bool = True) -> None:
+        self.index = index
+        n = len(index)
+        levels = index.levels
+        names = [index.name(i) for i in range(n)]
+        # 包含查询直接在名称字节块上find 快照中的memoryview没有find 复制一份
+        self.names = index.names if isinstance(index.names, bytearray) else bytes(index.names)
+        # 每一级按名称排序的行号 同名时按id
+        self.by_name: list[array.array] = []
+        # 单字和双字 => 含有它的行号 按 (级别, id) 排序
+        self.grams: dict[str, array.array] = {}
+        for lv in range(1, 6):
+            rows = [i for i in range(n) if levels[i] == lv]
+            self.by_name.append(array.array('I', sorted(rows, key=names.__getitem__)))
+            for i in rows:
+                for g in grams(names[i]):
+                    posting = self.grams.get(g)
+                    if(posting == None):
+                        posting = self.grams[g] = array.array('I')
+                    posting.append(i)
+        # 拼音首字母 与names一样存为一整块字节加偏移
+        self.initials: bytearray = None
+        self.initial_offsets: array.array = None
+        self.by_initials: list[array.array] = []
+        if(pinyin and lazy_pinyin != None):
+            self.initials = bytearray()
+            self.initial_offsets = array.array('I', [0])
+            cache: dict[str, bytes] = {}
+            for name in names:
+                key = cache.get(name)
+                if(key == None):
+                    key = cache[name] = ''.join(p[:1] for p in lazy_pinyin(
+                        name, style=Style.FIRST_LETTER, errors='ignore')).lower().encode()
+                self.initials += key
+                self.initial_offsets.append(len(self.initials))
+            for rows in self.by_name:
+                self.by_initials.append(array.array('I', sorted(rows, key=self.initial)))
+
+    def initial(self, i: int) -> str:
+        return self.initials[self.initial_offsets[i]: self.initial_offsets[i + 1]].decode()
+
+    def search(self, query: str, k: int = 10, scope: int = None) -> list[Area]:
+        """返回前k个匹配 scope不存在时返回空"""
+        parts = query.replace('/', ' ').split()
+        if(not parts or k <= 0):
+            return []
+        q, terms = parts[-1], parts[:-1]
+        index = self.index
+        start, end = 0, len(index)
+        if(scope != None):
+            p = index.position(scope)
+            if(p < 0):
+                return []
+            start, end = p + 1, index.subtree_end[p]
+        accept = self.accepter(terms)
+        pinyin = self.initials != None and q.isascii() and q.isalpha()
+        if(pinyin):
+            q = q.lower()
+        found: list[tuple[int, int, int, int]] = []
+        if(end - start <= SCOPE_SCAN):
+            self.scan(q, pinyin, start, end, accept, found)
+        elif(pinyin):
+            self.prefix(q, self.by_initials, self.initial, start, end, accept, k, found)
+        elif(scope == None):
+            self.prefix(q, self.by_name, index.name, start, end, accept, k, found)
+            if(len(found) < k):
+                self.contains(q, start, end, accept, k, found)
+        else:
+            self.contains(q, start, end, accept, None, found)
+        found.sort()
+        return [index.row(r[3]) for r in found[:k]]
+
+    def accepter(self, terms: list[str]) -> Callable[[int], bool]:
+        """前面各段都要出现在某个祖先的名称中"""
+        if(not terms):
+            return lambda i: True
+        index = self.index
+
+        def accept(i: int) -> bool:
+            names = [a.name for a in index.ancestors(index.ids[i])]
+            return all(any(t in name for name in names) for t in terms)
+        return accept
+
+    def scan(self, q: str, pinyin: bool, start: int, end: int,
+             accept: Callable[[int], bool], found: list) -> None:
+        """范围较小时逐行比较"""
+        key = self.initial if pinyin else self.index.name
+        levels = self.index.levels
+        for i in range(start, end):
+            name = key(i)
+            if(name == q):
+                tier = EXACT
+            elif(name.startswith(q)):
+                tier = PREFIX
+            elif(not pinyin and q in name):
+                tier = CONTAINS
+            else:
+                continue
+            if(accept(i)):
+                found.append((tier, levels[i], len(name), i))
+
+    def prefix(self, q: str, sorted_rows: list[array.array], key: Callable[[int], str], start: int, end: int,
+               accept: Callable[[int], bool], k: int, found: list) -> None:
+        """每一级在名称排序中二分出前缀区间 前缀匹配攒够k个后 更深的级别只取名称相等的"""
+        hit = 0
+        for lv, rows in enumerate(sorted_rows, 1):
+            lo = bisect_left(rows, q, key=key)
+            hi = bisect_left(rows, q + MAX_CHAR, lo, min(len(rows), lo + PREFIX_SCAN), key=key)
+            for j in range(lo, hi):
+                i = rows[j]
+                name = key(i)
+                if(hit >= k and name != q):
+                    break
+                if(start <= i < end and accept(i)):
+                    found.append((EXACT if name == q else PREFIX, lv, len(name), i))
+                    hit += 1
+
+    def contains(self, q: str, start: int, end: int, accept: Callable[[int], bool], k: int, found: list) -> None:
+        """用最短的倒排表找出包含q的行 表内按 (级别, id) 排序 范围内的行在每一级中是连续的一段
+        k为空时找出范围内的所有匹配 否则只补足k个包含匹配 最多检查CONTAINS_SCAN个候选 相等和前缀匹配已由prefix找出"""
+        posting = None
+        for g in grams(q):
+            p = self.grams.get(g)
+            if(p == None):
+                return
+            if(posting == None or len(p) < len(posting)):
+                posting = p
+        # 直接在名称字节块上查找 不为每个候选解码字符串
+        levels, names, offsets = self.index.levels, self.names, self.index.name_offsets
+        code = q.encode()
+        need = None if k == None else k - len(found)
+        budget = CONTAINS_SCAN
+        for lv in range(1, 6):
+            if(need != None and (need <= 0 or budget <= 0)):
+                break
+            lo = bisect_left(posting, (lv, start), key=lambda i: (levels[i], i))
+            hi = bisect_left(posting, (lv, end), lo, key=lambda i: (levels[i], i))
+            if(need != None):
+                hi = min(hi, lo + budget)
+                budget -= hi - lo
+            for j in range(lo, hi):
+                i = posting[j]
+                a, b = offsets[i], offsets[i + 1]
+                if(names.find(code, a, b) < 0):
+                    continue
+                if(names.startswith(code, a)):
+                    # 相等和前缀匹配已由prefix找出 不再重复加入
+                    if(k != None):
+                        continue
+                    tier = EXACT if b - a == len(code) else PREFIX
+                else:
+                    tier = CONTAINS
+                if(accept(i)):
+                    found.append((tier, lv, len(names[a: b].decode()), i))
+                    if(need != None):
+                        need -= 1
+                        if(need <= 0):
+                            # 同一级中更靠后的包含匹配只在名称长度上可能更优 不再继续找
+                            break
+
+    def memory(self) -> int:
+        """索引本身占用的字节数 不含AreaIndex"""
+        arrays = self.by_name + self.by_initials + list(self.grams.values())
+        size = sum(a.itemsize * len(a) for a in arrays) + sys.getsizeof(self.grams)
+        size += sum(sys.getsizeof(g) for g in self.grams)
+        if(self.initials != None):
+            size += len(self.initials) + self.initial_offsets.itemsize * len(self.initial_offsets)
+        return size
+
+
+def grams(text: str) -> set[str]:
+    """单字和相邻两字"""
+    return set(text) | {text[i: i + 2] for i in range(len(text) - 1)}
+
+
+def bench(search: AreaSearch, loop: int = 20000) -> None:
+    """随机名称的前缀 中间的片段 以及限定在随机省市县内的查询"""
+    index = search.index
+    n = len(index)
+    queries: dict[str, list[tuple[str, int]]] = {'prefix': [], 'contains': [], 'scope': []}
+    for _ in range(loop):
+        name = index.name(random.randrange(n))
+        size = random.randint(1, min(3, len(name)))
+        queries['prefix'].append((name[:size], None))
+        at = random.randrange(len(name) - size + 1)
+        queries['contains'].append((name[at: at + size], None))
+        i = random.randrange(n)
+        while(index.levels[i] > 3):
+            i -= 1
+        queries['scope'].append((name[:size], index.ids[i]))
+    if(search.initials != None):
+        queries['pinyin'] = [(search.initial(random.randrange(n))[:2], None) for _ in range(loop)]
+    for name, items in queries.items():
+        costs = []
+        for q, scope in items:
+            start_time = time.perf_counter()
+            search.search(q, 10, scope)
+            costs.append(time.perf_counter() - start_time)
+        costs.sort()
+        out('bench', f'{name} p50 {round(costs[loop // 2] * 1e6, 1)}µs p99 {round(costs[int(loop * 0.99)] * 1e6, 1)}µs '
+            f'max {round(costs[-1] * 1e6, 1)}µs')
+
+
+async def main(year: int, args: list[str]) -> None:
+    config = json.loads(await read_file('config.json'))
+    index = await load(config, year)
+    start_time = time.time()
+    search = AreaSearch(index)
+    out('main', f'{year}年 共{len(index)}条 建索引耗时{round(time.time() - start_time, 2)}s '
+        f'占用{round(search.memory() / 1024 / 1024, 2)}MB 拼音首字母{"开启" if search.initials != None else "未安装pypinyin"}')
+    if(not args):
+        bench(search)
+        return
+    scope = None
+    if(len(args) > 1):
+        area = index.get_by_code(args[1])
+        scope = area and area.id
+    for area in search.search(args[0], 10, scope):
+        out('main', f'{area.number} {index.full_name(area.id)}')
+
+
+if __name__ == '__main__':
+    # python AreaSearch.py 2021 朝阳 [区划代码]  搜索 可限定在某个区域内
+    # python AreaSearch.py 2021                  性能测试
+    asyncio.run(main(int(sys.argv[1]), sys.argv[2:]))
@@ -0,0 +1,178 @@
+import asyncio
+import collections
+import gzip
+import hashlib
+import json
+import sys
+import time
+from typing import Callable, NamedTuple
+from aiohttp import web
+from AreaBase import out, read_file
+from AreaIndex import Area, AreaIndex, load
+from AreaSearch import AreaSearch
+from AreaSnapshot import Snapshot
+
+
+# 响应体小于该字节数时不压缩
+GZIP_MIN: int = 256
+# 区划代码的位数
+CODE_LENGTH: int = 12
+
+
+class Response(NamedTuple):
+    status: int
+    etag: str
+    body: bytes
+    # 预先压缩好的响应体 太小时为None
+    gzip: bytes
+
+
+class LRUCache:
+    """按请求路径和参数缓存已序列化 已压缩的响应 超过size个时淘汰最久没有用过的"""
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self.items: collections.OrderedDict[str, Response] = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Response:
+        item = self.items.get(key)
+        if(item == None):
+            self.misses += 1
+            return None
+        self.items.move_to_end(key)
+        self.hits += 1
+        return item
+
+    def put(self, key: str, item: Response) -> None:
+        self.items[key] = item
+        self.items.move_to_end(key)
+        if(len(self.items) > self.size):
+            self.items.popitem(last=False)
+
+
+class AreaServer:
+    """只读的区划查询接口 数据来自进程内的AreaIndex(或mmap快照)
+    GET /areas                    所有省
+    GET /areas/{code}             一个区域及其祖先
+    GET /areas/{code}/children    直接下级
+    GET /areas/search?q=&k=&scope= 名称搜索 scope为祖先的区划代码
+    数据只读 同一个请求的响应总是相同 序列化和gzip压缩的结果放进LRU缓存 ETag为响应体的摘要"""
+
+    def __init__(self, index: AreaIndex, cache_size: int = 20000) -> None:
+        self.index = index
+        self.search = AreaSearch(index)
+        self.cache = LRUCache(cache_size)
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.add_routes([web.get('/areas', self.provinces),
+                        web.get('/areas/search', self.find),
+                        web.get('/areas/{code}', self.area),
+                        web.get('/areas/{code}/children', self.children),
+                        web.get('/stats', self.stats)])
+        return app
+
+    def area_json(self, area: Area) -> dict:
+        return {'id': area.id, 'number': area.number, 'name': area.name,
+                'type': area.type, 'level': area.level}
+
+    def lookup(self, code: str, name: str) -> tuple[Area, tuple[int, dict]]:
+        """按区划代码查找 返回 (区域, None) 代码不是12位数字时为400 不存在时为404"""
+        if(len(code) != CODE_LENGTH or not code.isascii() or not code.isdigit()):
+            return None, (400, {'error': f'{name}必须是{CODE_LENGTH}位数字'})
+        area = self.index.get_by_code(code)
+        if(area == None):
+            return None, (404, {'error': f'{name}不存在'})
+        return area, None
+
+    async def provinces(self, request: web.Request) -> web.Response:
+        return self.respond(request, lambda: (200, [self.area_json(a) for a in self.index.children(None)]))
+
+    async def area(self, request: web.Request) -> web.Response:
+        def build():
+            area, error = self.lookup(request.match_info['code'], '区划代码')
+            if(error):
+                return error
+            data = self.area_json(area)
+            data['full_name'] = self.index.full_name(area.id)
+            data['parents'] = [self.area_json(a) for a in self.index.ancestors(area.id)]
+            return 200, data
+        return self.respond(request, build)
+
+    async def children(self, request: web.Request) -> web.Response:
+        def build():
+            area, error = self.lookup(request.match_info['code'], '区划代码')
+            if(error):
+                return error
+            return 200, [self.area_json(a) for a in self.index.children(area.id)]
+        return self.respond(request, build)
+
+    async def find(self, request: web.Request) -> web.Response:
+        def build():
+            q = request.query.get('q', '')
+            try:
+                k = min(int(request.query.get('k', 10)), 100)
+            except ValueError:
+                return 400, {'error': 'k必须是整数'}
+            scope = None
+            if(request.query.get('scope')):
+                area, error = self.lookup(request.query['scope'], 'scope区划代码')
+                if(error):
+                    return error
+                scope = area.id
+            return 200, [dict(self.area_json(a), full_name=self.index.full_name(a.id))
+                         for a in self.search.search(q, k, scope)]
+        return self.respond(request, build)
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response({'rows': len(self.index), 'year': self.index.year,
+                                  'cache': len(self.cache.items), 'hits': self.cache.hits, 'misses': self.cache.misses})
+
+    def respond(self, request: web.Request, build: Callable[[], tuple[int, object]]) -> web.Response:
+        """先查缓存 没有时build出 (状态码, 数据) 序列化压缩后放进缓存"""
+        key = request.path_qs
+        item = self.cache.get(key)
+        if(item == None):
+            status, data = build()
+            body = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode()
+            etag = '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+            item = Response(status, etag, body, gzip.compress(body, 6) if len(body) >= GZIP_MIN else None)
+            self.cache.put(key, item)
+        headers = {'ETag': item.etag, 'Cache-Control': 'public, max-age=3600', 'Vary': 'Accept-Encoding'}
+        if(item.status == 200 and item.etag in request.headers.get('If-None-Match', '')):
+            return web.Response(status=304, headers=headers)
+        body = item.body
+        if(item.gzip != None and 'gzip' in request.headers.get('Accept-Encoding', '')):
+            body = item.gzip
+            headers['Content-Encoding'] = 'gzip'
+        return web.Response(status=item.status, body=body, headers=headers,
+                            content_type='application/json', charset='utf-8')
+
+
+async def create(config: dict, year: int, snapshot: str = None) -> AreaServer:
+    start_time = time.time()
+    index = Snapshot(snapshot) if snapshot else await load(config, year)
+    server = AreaServer(index, config['Server']['CacheSize'])
+    out('AreaServer', f'{index.year}年 共{len(index)}条 加载耗时{round(time.time() - start_time, 2)}s')
+    return server
+
+
+async def main(year: int, snapshot: str = None) -> None:
+    config = json.loads(await read_file('config.json'))
+    server = await create(config, year, snapshot)
+    runner = web.AppRunner(server.app(), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, config['Server']['Host'], config['Server']['Port'])
+    await site.start()
+    out('AreaServer', f"监听 http://{config['Server']['Host']}:{config['Server']['Port']}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == '__main__':
+    # python AreaServer.py 2021 [area_2021.snap]  给出快照文件时从快照加载 否则从数据库加载
+    asyncio.run(main(int(sys.argv[1]), sys.argv[2] if len(sys.argv) > 2 else None))
@@ -0,0 +1,127 @@
+import array
+import asyncio
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+from AreaBase import out, read_file
+from AreaIndex import AreaIndex, bench, load
+
+
+# 文件格式 (小端)
+# 头部: 魔数 版本 年份 行数
+# 段表: 每个列一项 (文件内偏移, 字节数) 顺序与SECTIONS一致
+# 各列依次存放 每列的起始位置按8字节对齐
+MAGIC: bytes = b'AREASNAP'
+VERSION: int = 1
+HEADER: struct.Struct = struct.Struct('<8sIiQ')
+# (AreaIndex中的列名, array类型码) names为utf-8字节块
+SECTIONS: list[tuple[str, str]] = [('ids', 'q'), ('numbers', 'q'), ('levels', 'b'), ('types', 'h'),
+                                   ('name_offsets', 'I'), ('names', 'B'), ('by_number', 'I'), ('subtree_end', 'I')]
+TABLE: struct.Struct = struct.Struct(f'<{2 * len(SECTIONS)}Q')
+
+
+def write(index: AreaIndex, path: str) -> int:
+    """把已build的AreaIndex写成快照 先写临时文件再改名 读者不会看到写了一半的文件 返回文件字节数"""
+    if(len(index.name_offsets) != len(index) + 1 or len(index.subtree_end) != len(index)):
+        raise ValueError('AreaIndex还没有build')
+    columns = []
+    for name, code in SECTIONS:
+        data = getattr(index, name)
+        if(name != 'names' and sys.byteorder == 'big'):
+            data = array.array(code, data)
+            data.byteswap()
+        columns.append(bytes(data))
+    position = HEADER.size + TABLE.size
+    table = []
+    for data in columns:
+        position = align(position)
+        table += [position, len(data)]
+        position += len(data)
+    temp = f'{path}.{os.getpid()}.tmp'
+    with open(temp, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, index.year or 0, len(index)))
+        f.write(TABLE.pack(*table))
+        for offset, data in zip(table[::2], columns):
+            f.write(bytes(offset - f.tell()))
+            f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp, path)
+    return position
+
+
+def align(position: int) -> int:
+    return (position + 7) & ~7
+
+
+class Snapshot(AreaIndex):
+    """以mmap只读映射快照文件 各列是直接指向映射内存的memoryview 打开时不读取也不复制数据
+    查找方法全部继承自AreaIndex 页面由操作系统按需读入 多个进程映射同一个文件时共享page cache"""
+
+    def __init__(self, path: str) -> None:
+        if(sys.byteorder == 'big'):
+            raise ValueError('快照为小端格式 不支持在大端机器上直接映射')
+        with open(path, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.path = path
+        view = memoryview(self.mmap)
+        magic, version, year, count = HEADER.unpack_from(self.mmap, 0)
+        if(magic != MAGIC):
+            raise ValueError(f'不是区划快照文件 {path}')
+        if(version != VERSION):
+            raise ValueError(f'快照版本{version}与当前版本{VERSION}不一致 需要重新导出 {path}')
+        table = TABLE.unpack_from(self.mmap, HEADER.size)
+        self.year = year
+        for (name, code), offset, size in zip(SECTIONS, table[::2], table[1::2]):
+            if(offset + size > len(self.mmap)):
+                raise ValueError(f'快照文件不完整 {path}')
+            setattr(self, name, view[offset: offset + size].cast(code))
+        if(len(self.ids) != count or len(self.name_offsets) != count + 1):
+            raise ValueError(f'快照文件损坏 {path}')
+
+    def append(self, *args) -> None:
+        raise TypeError('快照是只读的')
+
+    def close(self) -> None:
+        """释放所有memoryview后才能关闭映射"""
+        for name, _ in SECTIONS:
+            getattr(self, name).release()
+        self.mmap.close()
+
+
+async def export(year: int, path: str) -> None:
+    config = json.loads(await read_file('config.json'))
+    start_time = time.time()
+    index = await load(config, year)
+    size = write(index, path)
+    out('export', f'{year}年 共{len(index)}条 写入{path} {round(size / 1024 / 1024, 2)}MB '
+        f'耗时{round(time.time() - start_time, 2)}s')
+
+
+def main(path: str, codes: list[str]) -> None:
+    start_time = time.perf_counter()
+    snapshot = Snapshot(path)
+    area = snapshot.get_by_code(codes[0]) if codes else snapshot.row(0) if len(snapshot) else None
+    out('main', f'{snapshot.year}年 共{len(snapshot)}条 打开并完成第一次查找耗时'
+        f'{round((time.perf_counter() - start_time) * 1000, 2)}ms')
+    for code in codes:
+        area = snapshot.get_by_code(code)
+        if(area == None):
+            out('main', f'未找到 {code}')
+            continue
+        out('main', f'{area} {snapshot.full_name(area.id)}')
+        out('main', f'下级 {[c.name for c in snapshot.children(area.id)]}')
+    if(not codes and len(snapshot)):
+        bench(snapshot)
+
+
+if __name__ == '__main__':
+    # python AreaSnapshot.py export 2021 area_2021.snap  从数据库导出一年的快照
+    # python AreaSnapshot.py area_2021.snap [区划代码 ...] 打开快照查找 不给代码时运行查找性能测试
+    if(sys.argv[1] == 'export'):
+        asyncio.run(export(int(sys.argv[2]), sys.argv[3]))
+    else:
+        main(sys.argv[1], sys.argv[2:])
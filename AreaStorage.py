@@ -0,0 +1,215 @@
+import asyncio
+import datetime
+import json
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+import asyncpg
+from asyncpg import Pool
+from AreaBase import out, read_file
+
+
+# area_info中由爬虫写入的列 create_time使用默认值
+AREA_COLUMNS: list[str] = ['id', 'number', 'name', 'full_name', 'type',
+                           'level', 'year', 'parents_id', 'release_date']
+# 建表前加的事务级咨询锁 多个worker同时启动时create table if not exists也会因系统表唯一约束冲突
+DDL_LOCK_SQL: str = 'select pg_advisory_xact_lock(20211031)'
+# COPY使用的临时表 事务提交时自动清空
+STAGE_SQL: str = """create temp table if not exists area_info_stage
+                    (like area_info including defaults) on commit delete rows"""
+# 临时表合并进area_info 与InsertSQL一样是upsert
+MERGE_SQL: str = """insert into area_info (id, number, name, full_name, type, level, year, parents_id, release_date)
+                    select id, number, name, full_name, type, level, year, parents_id, release_date from area_info_stage
+                    on conflict (id, year) do update set number = excluded.number, name = excluded.name,
+                    full_name = excluded.full_name, type = excluded.type, level = excluded.level,
+                    parents_id = excluded.parents_id, release_date = excluded.release_date"""
+
+
+class Storage:
+    """存储后端的公共接口 爬虫只通过这几个方法写数据
+    rows中的每一行为 (id, number, name, full_name, type, level, year, parents_id, release_date)"""
+
+    name: str = None
+    # 为True时各年必须按年份递增的顺序逐年写入 不能同时爬取多年
+    ordered_years: bool = False
+    # 为False时save返回后数据不一定已经落盘 不能根据断点日志跳过已完成的市
+    resumable: bool = True
+    # 为True时所有进程写入同一个数据库 分布式爬取时一年只由一个worker调用finish_year
+    # 为False时每个进程写各自的本地文件 各自调用
+    shared: bool = False
+
+    async def open(self) -> None:
+        """连接数据库并初始化表"""
+        raise NotImplementedError
+
+    async def save(self, rows: list[tuple]) -> None:
+        """在一个事务中写入一批数据 重复写入同一(id, year)不会报错"""
+        raise NotImplementedError
+
+    async def finish_year(self, year: int) -> None:
+        """一年的数据全部写入后调用"""
+
+    async def close(self) -> None:
+        raise NotImplementedError
+
+
+class PostgresStorage(Storage):
+    """asyncpg连接池 loader为copy时走二进制COPY协议 为insert时使用insert_sql逐行executemany"""
+
+    name = 'postgres'
+    shared = True
+
+    def __init__(self, dsn: str, loader: str, insert_sql: str) -> None:
+        self.dsn = dsn
+        self.loader = loader
+        self.insert_sql = insert_sql
+        self.pool: Pool = None
+
+    async def open(self) -> None:
+        out('PostgresStorage', f'正在连接 > {self.dsn}')
+        self.pool = await asyncpg.create_pool(self.dsn)
+        sql = await read_file('table.sql')
+        out('PostgresStorage', f'初始化表 > {sql}')
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute(DDL_LOCK_SQL)
+                await conn.execute(sql)
+        out('PostgresStorage', f'数据表初始化完成 写入方式 > {self.loader}')
+
+    async def save(self, rows: list[tuple]) -> None:
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                if(self.loader == 'copy'):
+                    await self.copy(conn, rows)
+                else:
+                    await conn.executemany(self.insert_sql, rows)
+
+    async def copy(self, conn: asyncpg.Connection, rows: list[tuple]) -> None:
+        """发布日期在客户端只转换一次 COPY进事务级临时表后一条语句upsert进area_info"""
+        await conn.execute(STAGE_SQL)
+        records = []
+        for r, date in zip(rows, release_dates(rows)):
+            records.append((*r[:8], date))
+        await conn.copy_records_to_table('area_info_stage', records=records, columns=AREA_COLUMNS)
+        await conn.execute(MERGE_SQL)
+
+    async def close(self) -> None:
+        await self.pool.close()
+
+
+class SqliteStorage(Storage):
+    """SQLite后端 每年一张area_info_{year}表 parents_id存为json文本
+    所有sqlite操作在一个专用线程中执行 不阻塞事件循环
+    WAL模式 synchronous=full 每次提交都落盘 断点日志记录的市在断电后不会丢数据 大缓存和mmap 每批数据一个事务
+    导入期间表上没有索引 一年结束后去重并建索引"""
+
+    name = 'sqlite'
+
+    PRAGMAS: list[str] = ['pragma journal_mode=wal',
+                          'pragma synchronous=full',
+                          'pragma temp_store=memory',
+                          'pragma cache_size=-262144',
+                          'pragma mmap_size=1073741824']
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.conn: sqlite3.Connection = None
+        self.tables: set[int] = set()
+        # sqlite连接只在这一个线程中使用
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix='sqlite')
+
+    async def run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def open(self) -> None:
+        await self.run(self.connect)
+        out('SqliteStorage', f'数据库初始化完成 > {self.path}')
+
+    def connect(self) -> None:
+        self.conn = sqlite3.connect(self.path, isolation_level=None)
+        for pragma in self.PRAGMAS:
+            self.conn.execute(pragma)
+
+    async def save(self, rows: list[tuple]) -> None:
+        await self.run(self.insert, rows)
+
+    def insert(self, rows: list[tuple]) -> None:
+        records: dict[int, list[tuple]] = {}
+        for r in rows:
+            records.setdefault(r[6], []).append(
+                (*r[:7], json.dumps(r[7], separators=(',', ':')), r[8]))
+        self.conn.execute('begin')
+        try:
+            for year, items in records.items():
+                if(year not in self.tables):
+                    self.conn.execute(table_sql(year))
+                    self.tables.add(year)
+                # 导入期间没有索引时为普通插入 重复的行由build_index去重
+                # 一年完成后再写入(重新运行或断点续爬时的省级数据)由唯一索引替换旧行
+                self.conn.executemany(f"""insert or replace into area_info_{year}
+                                          ({','.join(AREA_COLUMNS)}) values (?,?,?,?,?,?,?,?,?)""", items)
+            self.conn.execute('commit')
+        except BaseException:
+            self.conn.execute('rollback')
+            raise
+
+    async def finish_year(self, year: int) -> None:
+        start_time = time.time()
+        await self.run(self.build_index, year)
+        out('SqliteStorage', f'area_info_{year} 索引创建完成 耗时{round(time.time() - start_time, 2)}s')
+
+    def build_index(self, year: int) -> None:
+        """断点续爬会重复写入 保留每个id最后写入的一行 再建唯一索引"""
+        self.conn.execute(table_sql(year))
+        self.conn.execute('begin')
+        self.conn.execute(f"""delete from area_info_{year} where rowid not in
+                              (select max(rowid) from area_info_{year} group by id)""")
+        self.conn.execute(f'create unique index if not exists area_info_{year}_pk on area_info_{year}(id)')
+        self.conn.execute(f'create index if not exists area_info_{year}_number on area_info_{year}(number)')
+        self.conn.execute('commit')
+        self.conn.execute(f'analyze area_info_{year}')
+
+    async def close(self) -> None:
+        await self.run(self.conn.close)
+        self.executor.shutdown()
+
+
+def table_sql(year: int) -> str:
+    """每年一张表 导入时不建主键 由build_index在导入后创建"""
+    return f"""create table if not exists area_info_{year}(
+                id int8 not null,
+                number varchar(20) not null,
+                name text not null,
+                full_name text not null,
+                type int4 null,
+                level int4 not null,
+                year int4 not null,
+                parents_id text not null,
+                release_date date not null,
+                create_time timestamp not null default (datetime('now', 'localtime')))"""
+
+
+def release_dates(rows: list[tuple]) -> list[datetime.date]:
+    """rows中的发布日期字符串转换为date 相同的字符串只转换一次"""
+    dates: dict[str, datetime.date] = {}
+    result = []
+    for r in rows:
+        date = dates.get(r[8])
+        if(date == None):
+            date = dates[r[8]] = datetime.date.fromisoformat(r[8])
+        result.append(date)
+    return result
+
+
+def create_storage(config: dict) -> Storage:
+    """根据config.json的Storage创建存储后端"""
+    if(config['Storage']['Type'] == 'sqlite'):
+        return SqliteStorage(config['Storage']['Sqlite'])
+    if(config['Storage']['Type'] == 'parquet'):
+        # pyarrow是可选依赖 只在使用时导入
+        from AreaExport import ParquetStorage
+        return ParquetStorage(config['Storage']['Parquet'])
+    if(config['Storage']['Type'] == 'temporal'):
+        from AreaTemporal import TemporalStorage
+        return TemporalStorage(config['ODBC'])
+    return PostgresStorage(config['ODBC'], config['Loader'], config['InsertSQL'])
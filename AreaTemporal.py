@@ -0,0 +1,217 @@
+import asyncio
+import json
+import random
+import sys
+import time
+import asyncpg
+from asyncpg import Pool
+from AreaBase import level_range, out, read_file
+from AreaStorage import DDL_LOCK_SQL, Storage, release_dates
+
+
+# 每个区域的每个版本只存一行 valid_to不含 为空时至今有效
+# 某年的数据 = 发布了该年的所有版本中 valid_from <= 年份 < valid_to 的行
+# area_version_stage暂存正在导入的一年 一年导入完成后合并进area_version
+VERSION_TABLE_SQL: str = """create table if not exists area_version(
+                                id int8 not null,
+                                number varchar(20) not null,
+                                name text not null,
+                                full_name text not null,
+                                type int4 null,
+                                level int4 not null,
+                                parents_id _int8 not null,
+                                valid_from int4 not null,
+                                valid_to int4 null,
+                                constraint area_version_pk primary key (id, valid_from));
+                            create table if not exists area_release(
+                                year int4 not null primary key,
+                                release_date date not null);
+                            create unlogged table if not exists area_version_stage(
+                                year int4 not null,
+                                id int8 not null,
+                                number varchar(20) not null,
+                                name text not null,
+                                full_name text not null,
+                                type int4 null,
+                                level int4 not null,
+                                parents_id _int8 not null,
+                                release_date date not null,
+                                constraint area_version_stage_pk primary key (year, id));
+                            create or replace view area_info_as_of as
+                                select v.id, v.number, v.name, v.full_name, v.type, v.level, r.year, v.parents_id, r.release_date
+                                from area_release r join area_version v
+                                on v.valid_from <= r.year and (v.valid_to is null or v.valid_to > r.year)"""
+# 暂存表的列 与Storage.save的行顺序不同 年份在前
+STAGE_COLUMNS: list[str] = ['year', 'id', 'number', 'name', 'full_name', 'type',
+                            'level', 'parents_id', 'release_date']
+# 同一(year, id)重复写入时以最后一次为准 与area_info的upsert一致
+STAGE_MERGE_SQL: str = """insert into area_version_stage select * from area_version_stage_copy
+                          on conflict (year, id) do update set number = excluded.number, name = excluded.name,
+                          full_name = excluded.full_name, type = excluded.type, level = excluded.level,
+                          parents_id = excluded.parents_id, release_date = excluded.release_date"""
+# 1 今年不存在或有变化的区域 关闭其当前版本
+CLOSE_SQL: str = """update area_version v set valid_to = $1
+                    where v.valid_to is null and not exists (
+                        select 1 from area_version_stage s
+                        where s.year = $1 and s.id = v.id and s.number = v.number and s.name = v.name
+                        and s.full_name = v.full_name and s.type is not distinct from v.type
+                        and s.level = v.level and s.parents_id = v.parents_id)"""
+# 2 今年新出现或有变化的区域 开启新版本 没有变化的区域当前版本仍然有效 不写入
+OPEN_SQL: str = """insert into area_version (id, number, name, full_name, type, level, parents_id, valid_from)
+                   select s.id, s.number, s.name, s.full_name, s.type, s.level, s.parents_id, $1
+                   from area_version_stage s
+                   where s.year = $1 and not exists (
+                       select 1 from area_version v where v.id = s.id and v.valid_to is null)"""
+RELEASE_SQL: str = """insert into area_release
+                      select year, release_date from area_version_stage where year = $1 limit 1"""
+# as-of查询与原表查询 子树范围 与AreaQuery相同
+RANGE_SQL: str = """select id, number, name, full_name, type, level, parents_id from {table}
+                    where year = $1 and id >= $2 and id < $3 and level = $4 order by id"""
+
+
+async def create_tables(conn: asyncpg.Connection) -> None:
+    async with conn.transaction():
+        await conn.execute(DDL_LOCK_SQL)
+        await conn.execute(VERSION_TABLE_SQL)
+
+
+async def merge(conn: asyncpg.Connection, year: int) -> tuple[int, int] | None:
+    """把暂存的一年合并进area_version 返回 (关闭的版本数, 新开的版本数)
+    只能按年份递增的顺序导入 已导入的年份不再合并 只清空暂存 返回None 重复执行无副作用
+    year小于已导入的最大年份且没有导入过时报错"""
+    async with conn.transaction():
+        if(await conn.fetchval('select exists(select 1 from area_release where year = $1)', year)):
+            await conn.execute('delete from area_version_stage where year = $1', year)
+            return None
+        latest = await conn.fetchval('select max(year) from area_release')
+        if(latest != None and year < latest):
+            raise ValueError(f'版本表已导入到{latest}年 只能按年份递增导入 不能再导入{year}年')
+        closed = await conn.execute(CLOSE_SQL, year)
+        opened = await conn.execute(OPEN_SQL, year)
+        await conn.execute(RELEASE_SQL, year)
+        await conn.execute('delete from area_version_stage where year = $1', year)
+    return int(closed.split()[-1]), int(opened.split()[-1])
+
+
+class TemporalStorage(Storage):
+    """版本化存储 config.json的Storage.Type为temporal
+    爬虫的数据先写入area_version_stage 一年写完后再与上一年的版本对比 只记录变化
+    年份必须递增 爬虫会按年份顺序逐年爬取 中断后不能断点续爬 要删除断点日志从头爬取
+    已合并的年份重新爬取时不会重复合并"""
+
+    name = 'temporal'
+    ordered_years = True
+    shared = True
+    # 暂存表为unlogged 数据库崩溃后会被清空 断点日志中已完成的市不能跳过 否则合并时它们的区域都会被关闭
+    resumable = False
+
+    def __init__(self, dsn: str) -> None:
+        self.dsn = dsn
+        self.pool: Pool = None
+
+    async def open(self) -> None:
+        out('TemporalStorage', f'正在连接 > {self.dsn}')
+        self.pool = await asyncpg.create_pool(self.dsn)
+        async with self.pool.acquire() as conn:
+            await create_tables(conn)
+        out('TemporalStorage', '版本表初始化完成')
+
+    async def save(self, rows: list[tuple]) -> None:
+        records = [(r[6], *r[:6], r[7], date) for r, date in zip(rows, release_dates(rows))]
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute("""create temp table if not exists area_version_stage_copy
+                                      (like area_version_stage) on commit delete rows""")
+                await conn.copy_records_to_table('area_version_stage_copy', records=records, columns=STAGE_COLUMNS)
+                await conn.execute(STAGE_MERGE_SQL)
+
+    async def finish_year(self, year: int) -> None:
+        start_time = time.time()
+        async with self.pool.acquire() as conn:
+            merged = await merge(conn, year)
+        if(merged == None):
+            out('TemporalStorage', f'{year}年已导入版本表 跳过')
+            return
+        closed, opened = merged
+        out('TemporalStorage', f'{year}年 关闭{closed}个版本 新增{opened}个版本 耗时{round(time.time() - start_time, 2)}s')
+
+    async def close(self) -> None:
+        await self.pool.close()
+
+
+async def load(conn: asyncpg.Connection, year: int) -> None:
+    """把area_info中已有的一年导入版本表"""
+    start_time = time.time()
+    await create_tables(conn)
+    # 合并失败时暂存的数据一起回滚
+    async with conn.transaction():
+        await conn.execute(f"""insert into area_version_stage select {', '.join(STAGE_COLUMNS)} from area_info
+                               where year = $1 on conflict (year, id) do nothing""", year)
+        merged = await merge(conn, year)
+    if(merged == None):
+        out('load', f'{year}年已导入版本表 跳过')
+        return
+    closed, opened = merged
+    out('load', f'{year}年 关闭{closed}个版本 新增{opened}个版本 耗时{round(time.time() - start_time, 2)}s')
+
+
+async def verify(conn: asyncpg.Connection, year: int) -> bool:
+    """as-of视图与area_info中同一年的数据是否完全一致"""
+    columns = ', '.join(STAGE_COLUMNS)
+    diff = await conn.fetchval(f"""select count(*) from (
+                                       (select {columns} from area_info where year = $1
+                                        except all select {columns} from area_info_as_of where year = $1)
+                                       union all
+                                       (select {columns} from area_info_as_of where year = $1
+                                        except all select {columns} from area_info where year = $1)) d""", year)
+    out('verify', f'{year}年 as-of视图与area_info ' + ('一致' if diff == 0 else f'有{diff}行不一致'))
+    return diff == 0
+
+
+async def bench(conn: asyncpg.Connection, year: int, loop: int) -> None:
+    """对比两种存储的大小 和同一年的整年读取 子树查询的耗时"""
+    await conn.execute('analyze area_info; analyze area_version; analyze area_release')
+    for table in ('area_info', 'area_version'):
+        size = await conn.fetchval('select pg_total_relation_size($1::regclass)', table)
+        rows = await conn.fetchval(f'select count(*) from {table}')
+        out('bench', f'{table} {rows}行 {round(size / 1024 / 1024, 2)}MB(含索引)')
+    parents = await conn.fetch('select id from area_info where year = $1 and level in (2, 3)', year)
+    sample = [random.choice(parents)['id'] for _ in range(loop)]
+    for table in ('area_info', 'area_info_as_of'):
+        start_time = time.perf_counter()
+        rows = len(await conn.fetch(f'select id, number, name, full_name from {table} where year = $1', year))
+        out('bench', f'{table} 整年{rows}行 {round((time.perf_counter() - start_time) * 1000, 1)}ms')
+        sql = RANGE_SQL.format(table=table)
+        costs = []
+        for id in sample:
+            start_time = time.perf_counter()
+            await conn.fetch(sql, year, *level_range(id, 5), 5)
+            costs.append(time.perf_counter() - start_time)
+        costs.sort()
+        out('bench', f'{table} 子树查询 p50 {round(costs[loop // 2] * 1000, 2)}ms p99 {round(costs[int(loop * 0.99)] * 1000, 2)}ms')
+    plan = await conn.fetch(f'explain {RANGE_SQL.format(table="area_info_as_of")}', year, *level_range(sample[0], 5), 5)
+    out('bench', 'as-of 执行计划 ' + ' | '.join(r[0].strip() for r in plan))
+
+
+async def main(args: list[str]) -> None:
+    config = json.loads(await read_file('config.json'))
+    conn = await asyncpg.connect(config['ODBC'])
+    try:
+        if(args[0] == 'load'):
+            first, last = int(args[1]), int(args[2]) if len(args) > 2 else int(args[1])
+            for year in range(first, last + 1):
+                if(await conn.fetchval('select exists(select 1 from area_info where year = $1)', year)):
+                    await load(conn, year)
+        elif(args[0] == 'verify'):
+            await verify(conn, int(args[1]))
+        elif(args[0] == 'bench'):
+            await bench(conn, int(args[1]), int(args[2]) if len(args) > 2 else 200)
+    finally:
+        await conn.close()
+
+
+if __name__ == '__main__':
+    # python AreaTemporal.py load 2009 2023    把area_info中的各年逐年导入版本表
+    # python AreaTemporal.py verify 2021       对比as-of视图与area_info
+    # python AreaTemporal.py bench 2021 [次数] 对比存储大小和查询耗时
+    asyncio.run(main(sys.argv[1:]))
@@ -0,0 +1,168 @@
+import asyncio
+import json
+import sqlite3
+import sys
+import time
+from typing import Iterable
+import asyncpg
+import numpy as np
+from AreaBase import LEVEL_MASK, LEVEL_VALUES, out, read_file
+
+
+# 一行的检查所需字段 type没有时为-1 parents为parents_id的长度 p1~p4为parents_id的前4个 不足时为0
+ROW_DTYPE = np.dtype([('id', 'i8'), ('number', 'U20'), ('type', 'i4'), ('level', 'i4'), ('parents', 'i4'),
+                      ('p1', 'i8'), ('p2', 'i8'), ('p3', 'i8'), ('p4', 'i8')])
+# 版本化存储时从as-of视图读取 与area_info的列相同
+POSTGRES_SQL: str = """select id, number, coalesce(type, -1), level, coalesce(cardinality(parents_id), 0),
+                       coalesce(parents_id[1], 0), coalesce(parents_id[2], 0),
+                       coalesce(parents_id[3], 0), coalesce(parents_id[4], 0)
+                       from {table} where year = $1"""
+# sqlite中parents_id为json文本
+SQLITE_SQL: str = """select id, number, coalesce(type, -1), level, json_array_length(parents_id),
+                     coalesce(json_extract(parents_id, '$[0]'), 0), coalesce(json_extract(parents_id, '$[1]'), 0),
+                     coalesce(json_extract(parents_id, '$[2]'), 0), coalesce(json_extract(parents_id, '$[3]'), 0)
+                     from area_info_{year}"""
+# 统计用区划代码 省2位 地2位 县2位 乡3位 村3位 下标为level-1
+# 区划代码截取到该级的除数
+CODE_UNITS = np.array([10 ** 10, 10 ** 8, 10 ** 6, 10 ** 3, 1], dtype=np.int64)
+# 该级本段的取值个数
+CODE_SEGMENTS = np.array([100, 100, 100, 1000, 1000], dtype=np.int64)
+# 乡级代码和村级代码 001~399为民政部门确认的单位 400~599为类似单位
+MAX_SEGMENT: int = 599
+# 城乡分类代码 只有村级有
+TYPE_CODES = np.array([111, 112, 121, 122, 123, 210, 220], dtype=np.int32)
+# 每一级type值 前4级用于由id计算祖先
+ANCESTOR_VALUES = np.array(LEVEL_VALUES[:4], dtype=np.int64)
+
+
+def validate(data: np.ndarray) -> dict[str, np.ndarray]:
+    """按编制规则检查一年的数据 data为ROW_DTYPE数组 返回 规则 => 违反该规则的行号
+    所有检查都是整列运算 不逐行循环"""
+    n = len(data)
+    ids, levels, types = data['id'], data['level'], data['type']
+    problems: dict[str, np.ndarray] = {}
+
+    def check(rule: str, bad: np.ndarray) -> None:
+        problems[rule] = np.flatnonzero(bad)
+
+    number_ok = (np.char.str_len(data['number']) == 12) & np.char.isdigit(data['number'])
+    check('区划代码不是12位数字', ~number_ok)
+    numbers = np.where(number_ok, data['number'], '0').astype(np.int64)
+    level_ok = (levels >= 1) & (levels <= 5)
+    index = np.clip(levels, 1, 5) - 1
+    # id最低的非零12位区段即为所在的级别 与AreaBase.level_of相同
+    low = ids & -ids
+    id_level = np.where(ids > 0, 5 - np.log2(np.maximum(low, 1)).astype(np.int64) // 12, 0)
+    check('level与id的级别不一致', ~level_ok | (id_level != levels))
+
+    # 本级以下的代码段全为0 本级代码段不为0
+    unit = CODE_UNITS[index]
+    width_ok = (numbers % unit == 0) & (numbers // unit % CODE_SEGMENTS[index] != 0)
+    check('区划代码位数与level不一致', number_ok & level_ok & ~width_ok)
+    town, village = numbers // 1000 % 1000, numbers % 1000
+    check('乡级或村级代码超出001~599', number_ok & (((levels >= 4) & (town > MAX_SEGMENT))
+                                                 | ((levels == 5) & (village > MAX_SEGMENT))))
+    check('城乡分类代码无效', np.where(levels == 5, ~np.isin(types, TYPE_CODES), types != -1))
+
+    check('id重复', duplicated(ids))
+    # 无效的区划代码互不相同 不参与比较
+    check('区划代码重复', duplicated(np.where(number_ok, numbers, -1 - np.arange(n))))
+
+    # 由id计算应有的parents_id 跳过为0的区段(如地级市直辖的乡级单位没有县级)
+    ancestors = ids[:, None] - ids[:, None] % ANCESTOR_VALUES
+    keep = ((ancestors // ANCESTOR_VALUES) & LEVEL_MASK != 0) & (np.arange(4) < (id_level - 1)[:, None])
+    expected = np.take_along_axis(np.where(keep, ancestors, 0), np.argsort(~keep, axis=1, kind='stable'), axis=1)
+    depth = keep.sum(axis=1)
+    parents = np.stack([data['p1'], data['p2'], data['p3'], data['p4']], axis=1)
+    check('parents_id与id不一致', (depth != data['parents']) | (parents != expected).any(axis=1))
+
+    # 直接父级必须存在 且父级的区划代码是本级区划代码的前缀
+    parent = np.where(depth > 0, expected[np.arange(n), np.maximum(depth - 1, 0)], 0)
+    order = np.argsort(ids, kind='stable')
+    position = order[np.minimum(np.searchsorted(ids[order], parent), n - 1)]
+    found = ids[position] == parent
+    check('找不到父级', (depth > 0) & ~found)
+    parent_unit = CODE_UNITS[index[position]]
+    linked = (depth > 0) & found & number_ok & number_ok[position] & level_ok[position]
+    check('区划代码与父级不一致', linked & (numbers // parent_unit * parent_unit != numbers[position]))
+    return problems
+
+
+def duplicated(values: np.ndarray) -> np.ndarray:
+    """值出现不止一次的位置"""
+    ordered = np.sort(values)
+    return np.isin(values, ordered[1:][ordered[1:] == ordered[:-1]])
+
+
+def to_array(batches: Iterable[list[tuple]]) -> np.ndarray:
+    """每批直接转换为数组后拼接 不保留整年的行对象"""
+    arrays = [np.fromiter(map(tuple, rows), dtype=ROW_DTYPE, count=len(rows)) for rows in batches]
+    return np.concatenate(arrays) if arrays else np.empty(0, dtype=ROW_DTYPE)
+
+
+async def load_postgres(dsn: str, year: int, table: str = 'area_info', batch: int = 50000) -> np.ndarray:
+    conn = await asyncpg.connect(dsn)
+    batches = []
+    try:
+        async with conn.transaction():
+            cursor = await conn.cursor(POSTGRES_SQL.format(table=table), year)
+            while True:
+                records = await cursor.fetch(batch)
+                if(not records):
+                    break
+                batches.append(to_array([records]))
+    finally:
+        await conn.close()
+    return to_array([]) if not batches else np.concatenate(batches)
+
+
+def load_sqlite(path: str, year: int, batch: int = 50000) -> np.ndarray:
+    conn = sqlite3.connect(path)
+    try:
+        cursor = conn.execute(SQLITE_SQL.format(year=year))
+        return to_array(iter(lambda: cursor.fetchmany(batch), []))
+    finally:
+        conn.close()
+
+
+def report(data: np.ndarray, problems: dict[str, np.ndarray], samples: int) -> int:
+    """每条规则一行 有违反时列出前samples行 返回违反规则的总行数"""
+    total = 0
+    for rule, rows in problems.items():
+        total += len(rows)
+        if(len(rows) == 0):
+            continue
+        items = ' '.join(f'{data["id"][i]}/{data["number"][i]}/L{data["level"][i]}' for i in rows[:samples])
+        out('validate', f'{rule} {len(rows)}行 {items}{" ..." if len(rows) > samples else ""}')
+    return total
+
+
+async def main(year: int, samples: int) -> int:
+    config = json.loads(await read_file('config.json'))
+    storage: str = config['Storage']['Type']
+    if(storage not in ('sqlite', 'postgres', 'temporal')):
+        out('validate', f'不支持{storage}存储 只能检查sqlite postgres temporal')
+        return 1
+    start_time = time.time()
+    if(storage == 'sqlite'):
+        data = load_sqlite(config['Storage']['Sqlite'], year)
+    else:
+        data = await load_postgres(config['ODBC'], year, 'area_info_as_of' if storage == 'temporal' else 'area_info')
+    load_time = time.time() - start_time
+    if(len(data) == 0):
+        out('validate', f'{year}年没有数据')
+        return 1
+    start_time = time.time()
+    problems = validate(data)
+    check_time = time.time() - start_time
+    total = report(data, problems, samples)
+    broken = sum(1 for rows in problems.values() if len(rows))
+    out('validate', f'{year}年 {len(data)}行 {len(problems)}条规则 ' +
+        (f'{broken}条不通过 共{total}处' if total else '全部通过') +
+        f' 读取{round(load_time, 2)}s 检查{round(check_time, 2)}s')
+    return 1 if total else 0
+
+
+if __name__ == '__main__':
+    # python AreaValidate.py 2021 [每条规则列出的行数]  有违反规则的数据时退出码为1 可在发布前检查
+    sys.exit(asyncio.run(main(int(sys.argv[1]), int(sys.argv[2]) if len(sys.argv) > 2 else 5)))
@@ -0,0 +1,167 @@
+import asyncio
+import json
+import os
+import socket
+import sys
+import asyncpg
+from asyncpg import Pool
+from AreaBase import out, read_file
+from AreaStorage import DDL_LOCK_SQL
+
+
+# 待爬取的市 status: 0 待领取 1 爬取中 2 已完成 3 多次失败后放弃
+# lease_until之前由owner持有 过期后其他worker可以重新领取
+WORK_TABLE_SQL: str = """create table if not exists area_work(
+                             year int4 not null,
+                             id int8 not null,
+                             url text not null,
+                             parents_id _int8 not null,
+                             full_name text not null,
+                             status int2 not null default 0,
+                             owner text null,
+                             lease_until timestamptz null,
+                             attempts int4 not null default 0,
+                             error text null,
+                             update_time timestamp not null default now(),
+                             constraint area_work_pk primary key (year, id));
+                         create index if not exists area_work_todo on area_work (year, status);
+                         create table if not exists area_work_year(
+                             year int4 not null,
+                             owner text not null,
+                             finish_time timestamp not null default now(),
+                             constraint area_work_year_pk primary key (year))"""
+# 领取一个市 skip locked跳过其他worker正在领取的行 不会互相等待 也不会重复领取
+# 已领取过$4次的不再领取 租约过期多次通常是页面让worker崩溃 一直重领会让这一年永远无法收尾
+CLAIM_SQL: str = """update area_work w set status = 1, owner = $2, attempts = w.attempts + 1,
+                    lease_until = now() + make_interval(secs => $3), update_time = now()
+                    from (select year, id from area_work
+                          where year = $1 and (status = 0 or (status = 1 and lease_until < now())) and attempts < $4
+                          order by id limit 1 for update skip locked) t
+                    where w.year = t.year and w.id = t.id
+                    returning w.id, w.url, w.parents_id, w.full_name, w.attempts"""
+# 租约过期且领取次数用完的市标记为放弃
+ABANDON_SQL: str = """update area_work set status = 3, owner = null, lease_until = null,
+                      error = '租约过期次数超过上限', update_time = now()
+                      where year = $1 and status = 1 and lease_until < now() and attempts >= $2"""
+# 一年的市都已完成或放弃时 第一个插入成功的worker负责这一年的收尾 其他worker插入不了
+FINALIZE_SQL: str = """insert into area_work_year (year, owner)
+                       select $1, $2 where not exists (select 1 from area_work where year = $1 and status in (0, 1))
+                       on conflict (year) do nothing returning year"""
+# 续租 worker持有的所有市一起延长
+RENEW_SQL: str = """update area_work set lease_until = now() + make_interval(secs => $2)
+                    where owner = $1 and status = 1"""
+
+
+class WorkQueue:
+    """以Postgres表为工作队列的分布式爬取 任意多个进程(可以在不同机器上)领取市级页面各自爬取
+    每个worker都会爬取省级和市级页面并publish 已存在的市不会重复插入
+    领取时带租约 worker定时续租 进程退出后租约过期 市会被其他worker重新领取
+    数据写入为upsert 同一个市被重复爬取时结果不变"""
+
+    def __init__(self, dsn: str, lease: float = 120, max_attempts: int = 5, poll: float = 5) -> None:
+        self.dsn = dsn
+        # 租约秒数 续租间隔为租约的三分之一
+        self.lease = lease
+        # 一个市领取超过该次数仍未完成时放弃
+        self.max_attempts = max_attempts
+        # 暂时没有可领取的市 但还有其他worker在爬时 等待的秒数
+        self.poll = poll
+        self.worker = f'{socket.gethostname()}:{os.getpid()}'
+        self.pool: Pool = None
+        self.heartbeat: asyncio.Task = None
+
+    @classmethod
+    def from_config(cls, dsn: str, config: dict) -> 'WorkQueue':
+        return cls(dsn, config['Lease'], config['MaxAttempts'], config['Poll'])
+
+    async def open(self) -> None:
+        self.pool = await asyncpg.create_pool(self.dsn, min_size=1, max_size=2)
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute(DDL_LOCK_SQL)
+                await conn.execute(WORK_TABLE_SQL)
+        self.heartbeat = asyncio.create_task(self.renew())
+
+    async def renew(self) -> None:
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            try:
+                await self.pool.execute(RENEW_SQL, self.worker, self.lease)
+            except (OSError, asyncpg.PostgresError) as e:
+                # 数据库暂时不可用 下次再续 租约过期前恢复即可
+                out('WorkQueue', f'续租失败 {type(e).__name__} {e}')
+
+    async def publish(self, year: int, cities: list[tuple[str, int, list[int], str]]) -> int:
+        """写入一年的市 已存在的不变 返回该年市的总数"""
+        async with self.pool.acquire() as conn:
+            await conn.executemany(
+                """insert into area_work (year, id, url, parents_id, full_name)
+                   values ($1, $2, $3, $4, $5) on conflict (year, id) do nothing""",
+                [(year, c[1], c[0], c[2], c[3]) for c in cities])
+            count = await conn.fetchval('select count(*) from area_work where year = $1', year)
+        return count
+
+    async def claim(self, year: int) -> tuple[tuple[str, int, list[int], str], int]:
+        """领取一个市 返回 ((url, id, parents_id, full_name), 第几次领取) 没有可领取的时返回None"""
+        r = await self.pool.fetchrow(CLAIM_SQL, year, self.worker, self.lease, self.max_attempts)
+        if(r == None):
+            return None
+        return (r['url'], r['id'], list(r['parents_id']), r['full_name']), r['attempts']
+
+    async def finish(self, year: int, id: int) -> None:
+        await self.pool.execute("""update area_work set status = 2, lease_until = null, error = null, update_time = now()
+                                   where year = $1 and id = $2 and owner = $3""", year, id, self.worker)
+
+    async def release(self, year: int, id: int, attempts: int, error: str) -> None:
+        """爬取失败 放回队列让其他worker重试 次数用完时标记为放弃"""
+        await self.pool.execute("""update area_work set status = $4, owner = null, lease_until = null,
+                                   error = $5, update_time = now() where year = $1 and id = $2 and owner = $3""",
+                                year, id, self.worker, 3 if attempts >= self.max_attempts else 0, error)
+
+    async def finalize(self, year: int) -> bool:
+        """队列已经清空且这一年还没有worker收尾时返回True 多个worker同时调用时只有一个返回True"""
+        await self.abandon(year)
+        return await self.pool.fetchval(FINALIZE_SQL, year, self.worker) != None
+
+    async def abandon(self, year: int) -> None:
+        """放弃租约过期且不能再领取的市 否则它们一直是爬取中"""
+        await self.pool.execute(ABANDON_SQL, year, self.max_attempts)
+
+    async def running(self, year: int) -> int:
+        """其他worker还持有租约的市的个数 它们的租约过期后可能需要接手"""
+        await self.abandon(year)
+        return await self.pool.fetchval('select count(*) from area_work where year = $1 and status = 1', year)
+
+    async def stats(self, year: int) -> dict[int, int]:
+        """status => 个数"""
+        rows = await self.pool.fetch('select status, count(*) from area_work where year = $1 group by status', year)
+        return {r['status']: r['count'] for r in rows}
+
+    async def close(self) -> None:
+        if(self.heartbeat):
+            self.heartbeat.cancel()
+            await asyncio.gather(self.heartbeat, return_exceptions=True)
+        if(self.pool):
+            await self.pool.close()
+
+
+async def main(year: int, command: str) -> None:
+    config = json.loads(await read_file('config.json'))
+    queue = WorkQueue.from_config(config['ODBC'], config['Distributed'])
+    await queue.open()
+    try:
+        if(command == 'reset'):
+            # 重新爬取放弃的市
+            status = await queue.pool.execute('update area_work set status = 0, attempts = 0 where year = $1 and status = 3', year)
+            # 重新爬完后需要再次收尾
+            await queue.pool.execute('delete from area_work_year where year = $1', year)
+            out('WorkQueue', f'{year}年 {status}')
+        names = {0: '待领取', 1: '爬取中', 2: '已完成', 3: '已放弃'}
+        out('WorkQueue', f'{year}年 ' + ' '.join(f'{names[k]}{v}' for k, v in sorted((await queue.stats(year)).items())))
+    finally:
+        await queue.close()
+
+
+if __name__ == '__main__':
+    # python AreaWorkQueue.py 2021 [reset]  查看工作队列 reset把放弃的市放回队列
+    asyncio.run(main(int(sys.argv[1]), sys.argv[2] if len(sys.argv) > 2 else 'stats'))
@@ -0,0 +1,104 @@
+import asyncio
+import collections
+import time
+from typing import Awaitable, Callable, Collection, Hashable, Iterable
+
+
+class RowWriter:
+    """爬虫与数据库之间的生产者消费者管道
+    爬虫把每个页面的数据放进有界队列 队列满时put会等待 自然地让爬虫慢下来
+    若干个写入task从队列取数据 攒够flush_rows条或距上次写入超过flush_seconds秒就写一次库
+    每批数据带一个key(例如市的id) wait(key)在该key的数据全部写入后返回 用于断点日志"""
+
+    def __init__(self,
+                 save: Callable[[list[tuple]], Awaitable[None]],
+                 writers: int = 2,
+                 queue_size: int = 256,
+                 flush_rows: int = 20000,
+                 flush_seconds: float = 2) -> None:
+        self.save = save
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.queue: asyncio.Queue[tuple[Hashable, list[tuple]]] = asyncio.Queue(queue_size)
+        # 每个key还没有写入的批次数
+        self.pending: collections.Counter = collections.Counter()
+        self.events: dict[Hashable, asyncio.Event] = {}
+        self.tasks = [asyncio.create_task(self.run()) for _ in range(writers)]
+
+    @classmethod
+    def from_config(cls, save: Callable[[list[tuple]], Awaitable[None]], config: dict) -> 'RowWriter':
+        return cls(save, config['Writers'], config['QueueSize'],
+                   config['FlushRows'], config['FlushSeconds'])
+
+    async def put(self, key: Hashable, rows: Collection[tuple]) -> None:
+        """放入一批数据 rows为行的列表或RowBlock 队列满时等待"""
+        self.check()
+        if(not rows):
+            return
+        self.pending[key] += 1
+        self.events.setdefault(key, asyncio.Event()).clear()
+        while True:
+            try:
+                # 写入task异常退出后队列不会再被消费 定时醒来检查一下
+                await asyncio.wait_for(self.queue.put((key, rows)), self.flush_seconds)
+                return
+            except asyncio.TimeoutError:
+                self.check()
+
+    async def wait(self, key: Hashable) -> None:
+        """等待key的所有数据写入数据库"""
+        while(self.pending[key] > 0):
+            self.check()
+            event = self.events[key]
+            # 写入task异常退出时event不会再被set 这里定时检查一下
+            try:
+                await asyncio.wait_for(event.wait(), self.flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+        self.pending.pop(key, None)
+        self.events.pop(key, None)
+
+    async def close(self) -> None:
+        """写完队列中剩余的数据后结束所有写入task"""
+        self.check()
+        for _ in self.tasks:
+            await self.queue.put(None)
+        await asyncio.gather(*self.tasks)
+
+    def check(self) -> None:
+        """写入task出现异常时抛给生产者 避免爬虫继续往写不进去的队列里放数据"""
+        for task in self.tasks:
+            if(task.done() and not task.cancelled() and task.exception()):
+                raise task.exception()
+
+    async def run(self) -> None:
+        # 攒着的批次和总行数 批次可以是行的列表 也可以是RowBlock 写库时才展开成行
+        buffer: list[Iterable[tuple]] = []
+        count = 0
+        keys: list[Hashable] = []
+        deadline = time.monotonic() + self.flush_seconds
+        stop = False
+        while(not stop):
+            try:
+                item = await asyncio.wait_for(self.queue.get(),
+                                              max(0, deadline - time.monotonic()))
+                self.queue.task_done()
+                if(item == None):
+                    stop = True
+                else:
+                    keys.append(item[0])
+                    buffer.append(item[1])
+                    count += len(item[1])
+            except asyncio.TimeoutError:
+                pass
+            if(stop or count >= self.flush_rows or time.monotonic() >= deadline):
+                if(buffer):
+                    await self.save([row for rows in buffer for row in rows])
+                    buffer = []
+                    count = 0
+                for key in keys:
+                    self.pending[key] -= 1
+                    if(self.pending[key] == 0):
+                        self.events[key].set()
+                keys = []
+                deadline = time.monotonic() + self.flush_seconds
@@ -10,4 +10,6 @@ CREATE TABLE IF NOT EXISTS area_info(
 	release_date date NOT NULL,
 	create_time timestamp NOT NULL DEFAULT now(),
     CONSTRAINT area_info_pk PRIMARY KEY (id,year)
-);
\ No newline at end of file
+);
+-- 子树查询: 后代的id在(id, id + 本级type值)内 year等值加id范围走索引范围扫描
+CREATE INDEX IF NOT EXISTS area_info_year_id ON area_info (year, id);
@@ -0,0 +1,55 @@
+import pytest
+from AreaBase import AreaType, ancestors_of, parent_of
+from AreaIndex import AreaIndex
+from AreaSearch import AreaSearch
+
+# 广东省/东莞市 地级市直辖乡级单位 没有县级 以及一个有县级的市作对照
+PROVINCE = AreaType.Province.value * 19
+DONGGUAN = PROVINCE + AreaType.City.value * 17
+TOWN = DONGGUAN + AreaType.Town.value * 3
+VILLAGE = TOWN + 5
+SHAOGUAN = PROVINCE + AreaType.City.value * 2
+COUNTY = SHAOGUAN + AreaType.Country.value * 1
+COUNTY_TOWN = COUNTY + AreaType.Town.value * 1
+
+
+def make_index() -> AreaIndex:
+    return AreaIndex.from_rows(sorted([
+        (PROVINCE, '440000000000', '广东省', None, 1),
+        (SHAOGUAN, '440200000000', '韶关市', None, 2),
+        (COUNTY, '440203000000', '武江区', None, 3),
+        (COUNTY_TOWN, '440203001000', '新华街道', None, 4),
+        (DONGGUAN, '441900000000', '东莞市', None, 2),
+        (TOWN, '441900003000', '东城街道', None, 4),
+        (VILLAGE, '441900003005', '主山社区', 111, 5),
+    ]), 2021)
+
+
+def test_ancestors_skip_missing_county():
+    assert ancestors_of(TOWN) == [PROVINCE, DONGGUAN]
+    assert ancestors_of(VILLAGE) == [PROVINCE, DONGGUAN, TOWN]
+    assert parent_of(TOWN) == DONGGUAN
+    assert ancestors_of(COUNTY_TOWN) == [PROVINCE, SHAOGUAN, COUNTY]
+
+
+def test_index_town_under_city():
+    index = make_index()
+    assert [a.name for a in index.ancestors(VILLAGE)] == ['广东省', '东莞市', '东城街道']
+    assert index.full_name(TOWN) == '广东省/东莞市/东城街道'
+    assert index.full_name(VILLAGE) == '广东省/东莞市/东城街道/主山社区'
+    assert [a.name for a in index.children(DONGGUAN)] == ['东城街道']
+    assert index.full_name(COUNTY_TOWN) == '广东省/韶关市/武江区/新华街道'
+
+
+def test_missing_ancestor():
+    """某个省或市没有爬到时 缺少的祖先跳过 不存在的id抛出KeyError"""
+    index = AreaIndex.from_rows(sorted([
+        (PROVINCE, '440000000000', '广东省', None, 1),
+        (TOWN, '441900003000', '东城街道', None, 4),
+        (VILLAGE, '441900003005', '主山社区', 111, 5),
+    ]), 2021)
+    assert [a.name for a in index.ancestors(VILLAGE)] == ['广东省', '东城街道']
+    assert index.full_name(VILLAGE) == '广东省/东城街道/主山社区'
+    with pytest.raises(KeyError):
+        index.full_name(DONGGUAN)
+    assert [a.name for a in AreaSearch(index, pinyin=False).search('广东 主山')] == ['主山社区']
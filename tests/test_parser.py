@@ -0,0 +1,47 @@
+import glob
+import os
+import pytest
+from AreaBase import AreaType
+from AreaParser import BACKENDS, extract
+
+PAGES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pages')
+
+
+def read(name: str) -> bytes:
+    with open(os.path.join(PAGES, name), 'rb') as f:
+        return f.read()
+
+
+def result(backend: str, body: bytes):
+    try:
+        return extract(body, backend)
+    except ValueError:
+        return ValueError
+
+
+@pytest.mark.parametrize('file', sorted(glob.glob(os.path.join(PAGES, '*.html'))), ids=os.path.basename)
+def test_backends_agree(file):
+    """保存的页面 各后端的抽取结果完全一致"""
+    with open(file, 'rb') as f:
+        body = f.read()
+    results = [result(backend, body) for backend in BACKENDS]
+    assert all(r == results[0] for r in results)
+
+
+def test_nested_layout_row():
+    """数据表格在排版用的tr里 且前面没有表头行 第一行不能被外层tr吞掉"""
+    type, rows = extract(read('city_nested.html'), 'fast')
+    assert type == AreaType.City
+    assert [r[0][1] for r in rows] == ['石家庄市', '唐山市']
+
+
+def test_edge_cases():
+    province = extract(read('province.html'), 'fast')
+    assert province[1][0] == (('北京市',), '11.html')
+    county = extract(read('county.html'), 'fast')[1]
+    assert county[0] == (('130101000000', '市辖区'), None)
+    assert county[1][0][1] == '长安区\xa0'
+    kinmen = extract(read('county_kinmen.html'), 'fast')[1]
+    assert kinmen[-1] == (('350527000000', '金门县'), '05/350527.html')
+    assert extract(read('village_empty_dahutong.html'), 'fast') == None
+    assert result('fast', read('not_area.html')) == ValueError
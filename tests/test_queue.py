@@ -0,0 +1,67 @@
+import asyncio
+import os
+import pytest
+
+# 需要一个可以随意建表的空库 没有设置时跳过
+DSN = os.environ.get('AREA_TEST_DSN')
+pytestmark = pytest.mark.skipif(DSN == None, reason='没有设置AREA_TEST_DSN')
+YEAR = 1999
+
+
+def test_finalize_once():
+    """队列没有清空时不能收尾 清空后多个worker同时申请只有一个成功"""
+    from AreaWorkQueue import WorkQueue
+
+    async def run() -> None:
+        queues = [WorkQueue(DSN) for _ in range(3)]
+        for i, queue in enumerate(queues):
+            queue.worker = f'test:{i}'
+            await queue.open()
+        try:
+            await queues[0].pool.execute('delete from area_work where year = $1', YEAR)
+            await queues[0].pool.execute('delete from area_work_year where year = $1', YEAR)
+            cities = [(f'{YEAR}/11/{i}.html', i << 36, [1 << 48], f'城市{i}') for i in (1, 2)]
+            await queues[0].publish(YEAR, cities)
+            (city, _), = [await queues[0].claim(YEAR)]
+            assert not await queues[0].finalize(YEAR)
+            await queues[0].finish(YEAR, city[1])
+            (city, attempts), = [await queues[1].claim(YEAR)]
+            assert not await queues[1].finalize(YEAR)
+            # 多次失败后放弃的市不阻止收尾
+            await queues[1].release(YEAR, city[1], queues[1].max_attempts, 'test')
+            granted = await asyncio.gather(*[q.finalize(YEAR) for q in queues])
+            assert sorted(granted) == [False, False, True]
+            assert not await queues[0].finalize(YEAR)
+        finally:
+            await queues[0].pool.execute('delete from area_work where year = $1', YEAR)
+            await queues[0].pool.execute('delete from area_work_year where year = $1', YEAR)
+            for queue in queues:
+                await queue.close()
+    asyncio.run(run())
+
+
+def test_expired_lease_gives_up():
+    """worker崩溃时租约过期 领取次数用完后不再领取 标记为放弃 这一年仍能收尾"""
+    from AreaWorkQueue import WorkQueue
+
+    async def run() -> None:
+        queue = WorkQueue(DSN, max_attempts=2)
+        await queue.open()
+        expire = 'update area_work set lease_until = now() - interval \'1 second\' where year = $1'
+        try:
+            await queue.pool.execute('delete from area_work where year = $1', YEAR)
+            await queue.pool.execute('delete from area_work_year where year = $1', YEAR)
+            await queue.publish(YEAR, [(f'{YEAR}/11/01.html', 1 << 36, [1 << 48], '城市')])
+            for attempt in (1, 2):
+                _, attempts = await queue.claim(YEAR)
+                assert attempts == attempt
+                await queue.pool.execute(expire, YEAR)
+            assert await queue.claim(YEAR) == None
+            assert await queue.running(YEAR) == 0
+            assert await queue.stats(YEAR) == {3: 1}
+            assert await queue.finalize(YEAR)
+        finally:
+            await queue.pool.execute('delete from area_work where year = $1', YEAR)
+            await queue.pool.execute('delete from area_work_year where year = $1', YEAR)
+            await queue.close()
+    asyncio.run(run())
@@ -0,0 +1,192 @@
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import pytest
+from AreaBench import ReplaySite, synthetic
+from AreaWorkQueue import WORK_TABLE_SQL
+import AreaInfo
+
+YEAR = 2021
+# postgres相关的测试需要一个可以随意建表的空库 没有设置时跳过
+DSN = os.environ.get('AREA_TEST_DSN')
+
+
+def site_pages() -> tuple[dict, int]:
+    return synthetic(YEAR, f'{YEAR}-10-31', provinces=1, cities=2, counties=2, towns=2, villages=3)
+
+
+async def crawl(work: str, storage: str, distributed: bool = False, cache: str = 'bypass', patch: dict = None,
+                port: int = 0) -> int:
+    """用work目录中的断点日志和数据库爬取一次模拟站点 返回应得的行数 patch中的页面替换模拟站点的页面"""
+    with open('config.json', encoding='utf-8') as f:
+        config = json.load(f)
+    pages, rows = site_pages()
+    site = ReplaySite({**pages, **(patch or {})})
+    runner, url = await site.start(port)
+    config['Year'] = [YEAR]
+    config['Cache'] = {'Path': os.path.join(work, 'cache'), 'Mode': cache}
+    config['Checkpoint'] = os.path.join(work, 'checkpoint.jsonl')
+    config['Incremental']['Enable'] = False
+    config['Distributed']['Enable'] = distributed
+    config['ODBC'] = DSN or config['ODBC']
+    config['Metrics']['Port'] = 0
+    config['Storage']['Sqlite'] = os.path.join(work, 'area.sqlite3')
+    config['Storage']['Parquet'] = os.path.join(work, 'parquet')
+    AreaInfo.URL_BASE = url
+    try:
+        await AreaInfo.init(storage, config)
+        try:
+            await AreaInfo.start()
+        finally:
+            await AreaInfo.close()
+    finally:
+        await runner.cleanup()
+    return rows
+
+
+def test_sqlite_crawl_twice(tmp_path):
+    """同一断点日志再爬一次 已完成的年份仍会写入省级数据 不应违反id的唯一索引 也不产生重复行"""
+    work = str(tmp_path)
+    expected = asyncio.run(crawl(work, 'sqlite'))
+    assert asyncio.run(crawl(work, 'sqlite')) == expected
+    conn = sqlite3.connect(os.path.join(work, 'area.sqlite3'))
+    try:
+        assert conn.execute(f'select count(*), count(distinct id) from area_info_{YEAR}').fetchone() == (expected, expected)
+    finally:
+        conn.close()
+
+
+def test_cache_evicts_garbage_page(tmp_path):
+    """限流或验证页面状态码也是200 解析失败时不能留在缓存里 下次读缓存时重新下载"""
+    work = str(tmp_path)
+    pages, _ = site_pages()
+    # 一个村级页面
+    path = max(pages, key=lambda p: p.count('/'))
+    garbage = '<html><body>请开启JavaScript</body></html>'.encode('gb18030')
+    # 缓存以完整url为键 两次使用同一个端口
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    with pytest.raises(ValueError):
+        asyncio.run(crawl(work, 'sqlite', cache='read', patch={path: (200, garbage)}, port=port))
+    expected = asyncio.run(crawl(work, 'sqlite', cache='read', port=port))
+    conn = sqlite3.connect(os.path.join(work, 'area.sqlite3'))
+    try:
+        assert conn.execute(f'select count(*) from area_info_{YEAR}').fetchone()[0] == expected
+    finally:
+        conn.close()
+
+
+def test_parquet_refuses_resume(tmp_path):
+    """parquet的一年写完才发布 断点日志中已有该年的记录时拒绝启动 不会丢掉之前的市"""
+    pq = pytest.importorskip('pyarrow.parquet')
+    work = str(tmp_path)
+    expected = asyncio.run(crawl(work, 'parquet'))
+    folder = os.path.join(work, 'parquet', f'year={YEAR}')
+    files = [os.path.join(root, f) for root, _, names in os.walk(folder) for f in names]
+    assert all(os.path.basename(f).startswith('part-') for f in files)
+    assert sum(pq.read_metadata(f).num_rows for f in files) == expected
+    with pytest.raises(ValueError):
+        asyncio.run(crawl(work, 'parquet'))
+
+
+def test_parquet_sink_atomic(tmp_path):
+    """中途放弃时以前发布的文件不变 没有半写的文件"""
+    pq = pytest.importorskip('pyarrow.parquet')
+    from AreaExport import ParquetSink
+    row = (281474976710656, '110000000000', '北京市', '北京市', None, 1, YEAR, [], '2021-10-31')
+    sink = ParquetSink(str(tmp_path))
+    sink.write([row])
+    sink.close()
+    sink = ParquetSink(str(tmp_path))
+    sink.run += '-2'
+    sink.write([row, row])
+    sink.flush((YEAR, 1))
+    sink.close(publish=False)
+    folder = os.path.join(str(tmp_path), f'year={YEAR}', 'level=1')
+    assert len(os.listdir(folder)) == 1
+    assert pq.read_table(folder).num_rows == 1
+
+
+async def query(sql: str, *args) -> int:
+    import asyncpg
+    conn = await asyncpg.connect(DSN)
+    try:
+        return await conn.fetchval(sql, *args)
+    finally:
+        await conn.close()
+
+
+async def reset_temporal() -> None:
+    await query('drop view if exists area_info_as_of')
+    await query('drop table if exists area_version, area_release, area_version_stage')
+
+
+@pytest.mark.skipif(DSN == None, reason='没有设置AREA_TEST_DSN')
+def test_temporal_crawl_twice(tmp_path):
+    """已合并的年份再爬一次 不报错 版本表不变 暂存表清空 不能与分布式爬取同时开启"""
+    pytest.importorskip('asyncpg')
+    asyncio.run(reset_temporal())
+    work = str(tmp_path)
+    expected = asyncio.run(crawl(work, 'temporal'))
+    assert asyncio.run(query('select count(*) from area_version')) == expected
+    os.remove(os.path.join(work, 'checkpoint.jsonl'))
+    assert asyncio.run(crawl(work, 'temporal')) == expected
+    assert asyncio.run(query('select count(*) from area_version')) == expected
+    # 收尾前要等省级数据写完 否则会留在暂存表中
+    assert asyncio.run(query('select count(*) from area_version_stage')) == 0
+    with pytest.raises(ValueError):
+        asyncio.run(crawl(work, 'temporal', distributed=True))
+
+
+@pytest.mark.skipif(DSN == None, reason='没有设置AREA_TEST_DSN')
+def test_temporal_refuses_resume(tmp_path, monkeypatch):
+    """合并前中断 暂存表的数据丢失(如unlogged表在崩溃后被清空)时 不能根据断点日志跳过已完成的市
+    否则合并时缺少的区域都会被关闭"""
+    pytest.importorskip('asyncpg')
+    from AreaTemporal import TemporalStorage
+    asyncio.run(reset_temporal())
+    work = str(tmp_path)
+
+    async def crash(self, year: int) -> None:
+        pass
+    monkeypatch.setattr(TemporalStorage, 'finish_year', crash)
+    expected = asyncio.run(crawl(work, 'temporal'))
+    monkeypatch.undo()
+    asyncio.run(query('truncate area_version_stage'))
+    with pytest.raises(ValueError):
+        asyncio.run(crawl(work, 'temporal'))
+    assert asyncio.run(query('select count(*) from area_version')) == 0
+    os.remove(os.path.join(work, 'checkpoint.jsonl'))
+    asyncio.run(crawl(work, 'temporal'))
+    assert asyncio.run(query('select count(*) from area_version where valid_to is null')) == expected
+
+
+@pytest.mark.skipif(DSN == None, reason='没有设置AREA_TEST_DSN')
+def test_distributed_finalize(tmp_path):
+    """分布式爬取 清空队列的worker收尾一次 再爬一次时不会重复收尾"""
+    asyncpg = pytest.importorskip('asyncpg')
+
+    async def execute(sql: str) -> int:
+        conn = await asyncpg.connect(DSN)
+        try:
+            return await conn.fetchval(sql, YEAR)
+        finally:
+            await conn.close()
+    async def reset() -> None:
+        conn = await asyncpg.connect(DSN)
+        try:
+            await conn.execute(WORK_TABLE_SQL)
+            await conn.execute('delete from area_work where year = $1', YEAR)
+            await conn.execute('delete from area_work_year where year = $1', YEAR)
+        finally:
+            await conn.close()
+    asyncio.run(reset())
+    work = str(tmp_path)
+    expected = asyncio.run(crawl(work, 'postgres', distributed=True))
+    assert asyncio.run(execute('select count(*) from area_info where year = $1')) == expected
+    assert asyncio.run(execute('select count(*) from area_work_year where year = $1')) == 1
+    asyncio.run(crawl(work, 'postgres', distributed=True))
+    assert asyncio.run(execute('select count(*) from area_work where year = $1 and status <> 2')) == 0
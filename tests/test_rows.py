@@ -0,0 +1,37 @@
+from urllib.parse import urlparse
+from AreaBase import AreaType
+from AreaBench import PATH_BASE, block_rows, synthetic, tuple_rows, walk
+from AreaParser import extract
+import AreaInfo
+
+YEAR, DATE = 2021, '2021-10-31'
+
+
+def city_pages() -> list[tuple[tuple, bytes]]:
+    """模拟站点上所有省以下的页面"""
+    pages, _ = synthetic(YEAR, DATE)
+    index = f'http://replay{PATH_BASE}{YEAR}/index.html'
+    ctx = AreaInfo.CrawlContext(YEAR, DATE)
+    provinces = AreaInfo.build_data(ctx, extract(pages[urlparse(index).path][1], 'fast')[1], AreaType.Province, index)[1]
+    return [page for p in provinces for page in walk(pages, p)]
+
+
+def test_block_rows_match_tuple_rows():
+    """RowBlock生成的行与原先逐行构建的9元组完全一致"""
+    for info, body in city_pages():
+        type, data = extract(body, 'fast')
+        assert list(block_rows(info, type, data, YEAR, DATE)) == tuple_rows(info, type, data, YEAR, DATE)
+
+
+def test_town_under_city_parents():
+    """不设县级的地级市 村的parents_id为 [省, 市, 乡]"""
+    villages = []
+    for info, body in city_pages():
+        type, data = extract(body, 'fast')
+        if(type == AreaType.Village and len(info[2]) == 2):
+            villages += list(block_rows(info, type, data, YEAR, DATE))
+    assert villages
+    for row in villages:
+        assert len(row[7]) == 3
+        assert row[0] - row[0] % AreaType.Town.value == row[7][2]
+        assert row[3].count('/') == 3
@@ -0,0 +1,28 @@
+from AreaBase import AreaType
+from AreaIndex import AreaIndex
+from AreaSearch import SCOPE_SCAN, AreaSearch
+
+# 两个市下各有一个朝阳区 再加一个名称包含朝阳区的县 其余为填充的县 总行数超过SCOPE_SCAN 不在范围内逐行扫描
+PROVINCE = AreaType.Province.value * 11
+COUNTIES = SCOPE_SCAN // 2 + 100
+
+
+def make_index() -> AreaIndex:
+    rows = [(PROVINCE, '110000000000', '北京市', None, 1)]
+    for c in range(1, 3):
+        city = PROVINCE + AreaType.City.value * c
+        rows.append((city, f'11{c:02d}00000000', f'市{c}', None, 2))
+        for i in range(1, COUNTIES + 1):
+            name = '朝阳区' if i == 1 else '新朝阳区' if i == 2 and c == 1 else f'县{c}_{i}'
+            rows.append((city + AreaType.Country.value * i, f'11{c:02d}{i:04d}000000', name, None, 3))
+    return AreaIndex.from_rows(sorted(rows), 2021)
+
+
+def test_unscoped_no_duplicates():
+    """相等匹配由prefix找出后 contains补足时不能再次加入"""
+    index = make_index()
+    assert len(index) > SCOPE_SCAN
+    found = AreaSearch(index, pinyin=False).search('朝阳区')
+    ids = [a.id for a in found]
+    assert len(ids) == len(set(ids)) == 3
+    assert [a.name for a in found] == ['朝阳区', '朝阳区', '新朝阳区']
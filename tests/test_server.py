@@ -0,0 +1,33 @@
+import asyncio
+from aiohttp.test_utils import TestClient, TestServer
+from AreaServer import AreaServer
+from test_index import make_index
+
+
+async def get(paths: list[str]) -> list[tuple[int, object]]:
+    client = TestClient(TestServer(AreaServer(make_index()).app()))
+    await client.start_server()
+    try:
+        results = []
+        for path in paths:
+            response = await client.get(path)
+            results.append((response.status, await response.json()))
+        return results
+    finally:
+        await client.close()
+
+
+def test_bad_code():
+    """区划代码不是12位数字时返回400 不存在时返回404 不能是500"""
+    results = asyncio.run(get(['/areas/abc', '/areas/abc/children', '/areas/4419', '/areas/４４１９００００００００',
+                               '/areas/search?q=东城&scope=x1', '/areas/999900000000', '/areas/search?q=东城&scope=999900000000']))
+    assert [status for status, _ in results] == [400, 400, 400, 400, 400, 404, 404]
+
+
+def test_code():
+    (status, data), (_, children), (_, found) = asyncio.run(
+        get(['/areas/441900003000', '/areas/441900000000/children', '/areas/search?q=东城&scope=441900000000']))
+    assert status == 200 and data['full_name'] == '广东省/东莞市/东城街道'
+    assert [a['name'] for a in data['parents']] == ['广东省', '东莞市']
+    assert [a['name'] for a in children] == ['东城街道']
+    assert [a['name'] for a in found] == ['东城街道']
@@ -0,0 +1,51 @@
+from urllib.parse import urlparse
+import numpy as np
+from AreaBase import AreaType
+from AreaBench import PATH_BASE, block_rows, synthetic, walk
+from AreaParser import extract
+from AreaValidate import to_array, validate
+import AreaInfo
+
+YEAR, DATE = 2021, '2021-10-31'
+
+
+def synthetic_rows() -> np.ndarray:
+    """模拟站点上一年的所有行 转换为ROW_DTYPE数组"""
+    pages, expected = synthetic(YEAR, DATE)
+    index = f'http://replay{PATH_BASE}{YEAR}/index.html'
+    ctx = AreaInfo.CrawlContext(YEAR, DATE)
+    block, provinces = AreaInfo.build_data(ctx, extract(pages[urlparse(index).path][1], 'fast')[1], AreaType.Province, index)
+    rows = list(block)
+    for p in provinces:
+        for info, body in walk(pages, p):
+            type, data = extract(body, 'fast')
+            rows += block_rows(info, type, data, YEAR, DATE)
+    assert len(rows) == expected
+    return to_array([[(r[0], r[1], -1 if r[4] == None else r[4], r[5], len(r[7]), *(r[7] + [0] * 4)[:4])
+                      for r in rows]])
+
+
+def broken(problems: dict[str, np.ndarray]) -> dict[str, int]:
+    return {rule: len(rows) for rule, rows in problems.items() if len(rows)}
+
+
+def test_clean():
+    assert broken(validate(synthetic_rows())) == {}
+
+
+def test_faults():
+    data = synthetic_rows()
+    villages = np.flatnonzero(data['level'] == 5)
+    towns = np.flatnonzero(data['level'] == 4)
+    data['type'][villages[0]] = 999
+    data['p2'][villages[1]] += AreaType.City.value
+    # 同样是合法的12位村级代码 但前缀不是父级的代码
+    number = data['number'][villages[2]]
+    data['number'][villages[2]] = number[:6] + '598' + number[9:]
+    # 删除一个乡 它的村找不到父级
+    town = towns[-1]
+    orphans = int(np.count_nonzero((data['level'] == 5) & (data['id'] - data['id'] % AreaType.Town.value == data['id'][town])))
+    data = np.delete(data, town)
+    assert orphans > 0
+    assert broken(validate(data)) == {'城乡分类代码无效': 1, 'parents_id与id不一致': 1,
+                                      '区划代码与父级不一致': 1, '找不到父级': orphans}